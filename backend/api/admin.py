@@ -1,3 +1,28 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GeocodeCacheEntry, RouteCacheEntry, TripJob, TripPlan
+
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('query', 'latitude', 'longitude', 'found', 'updated_at')
+    list_filter = ('found',)
+    search_fields = ('query',)
+
+
+@admin.register(RouteCacheEntry)
+class RouteCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'distance_miles', 'duration_hours', 'updated_at')
+    search_fields = ('key',)
+
+
+@admin.register(TripPlan)
+class TripPlanAdmin(admin.ModelAdmin):
+    list_display = ('id', 'locations', 'hours_used', 'created_at')
+    exclude = ('cumulative_miles',)
+
+
+@admin.register(TripJob)
+class TripJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status',)
@@ -0,0 +1,264 @@
+import asyncio
+import importlib.util
+import time
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics, resilience, services, throttle
+from .cache import MISSING
+from .utils import normalize_location
+
+# HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+# One pooled client per event loop, closed when its loop shuts down
+_clients = weakref.WeakKeyDictionary()
+
+_geocode_flight = throttle.AsyncSingleFlight()
+
+
+def get_async_client():
+    """
+    Returns the pooled client for Nominatim and ORS of the running event
+    loop. Under ASGI that is one long-lived client per worker process; under
+    WSGI each async view call runs on its own short-lived loop (async_to_sync),
+    whose client is closed with it.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers={'User-Agent': services.USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+        entry = _clients[loop] = (client, _close_with_loop(client))
+    return entry[0]
+
+
+def _close_with_loop(client):
+    """
+    Ties a client's lifetime to the running loop: the returned async
+    generator is parked at its yield, so the loop's asyncgen hooks track it
+    and loop.shutdown_asyncgens() (run by asyncio.run before closing the
+    loop) closes the client.
+    """
+    async def guard():
+        try:
+            yield
+        finally:
+            await client.aclose()
+
+    parked = guard()
+    # Step to the yield now; nothing is awaited before it, so this completes synchronously
+    try:
+        parked.asend(None).send(None)
+    except StopIteration:
+        pass
+    return parked
+
+
+async def ageocode_and_route(location_names):
+    """
+    Async counterpart of services.geocode_and_route: geocodes concurrently,
+    then routes every leg with one multi-waypoint request.
+    """
+    coords = [None] * len(location_names)
+    legs = [None] * max(len(location_names) - 1, 0)
+
+    with metrics.stage('geocode'):
+        tasks = {
+            asyncio.ensure_future(ageocode_location(name)): i
+            for i, name in enumerate(location_names)
+        }
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                coords[tasks[task]] = task.result()
+                if coords[tasks[task]] is None:
+                    # Let in-flight geocodes finish in the background; their results are cached
+                    return coords, legs
+
+    with metrics.stage('route'):
+        route = await aget_route(coords)
+    if route:
+        legs = route['legs']
+    return coords, legs
+
+
+async def ageocode_location(location_name):
+    """Async counterpart of services.geocode_location, sharing both cache tiers."""
+    query = normalize_location(location_name)[:255]
+    if not query:
+        return None
+
+    coords = services.gazetteer_lookup(query)
+    if coords is not None:
+        return coords
+
+    coords = services._geocode_cache.get(query)
+    if coords is MISSING:
+        coords = await sync_to_async(services._load_geocode_entry)(query)
+    if coords is not MISSING:
+        if coords is None:
+            services._count(services._geocode_counters, 'negative_hits')
+        return coords
+
+    try:
+        coords, shared = await _geocode_flight.do(query, lambda: _ageocode_upstream(location_name))
+    except Exception as e:
+        print(f"Geocoding error: {e}")
+        return None
+    if shared:
+        services._count(services._geocode_counters, 'coalesced')
+    return coords
+
+
+async def _ageocode_upstream(location_name):
+    """Async counterpart of services._geocode_upstream."""
+    await services.nominatim_limiter.aacquire()
+    timeout = resilience.attempt_timeout(services.GEOCODE_TIMEOUT)
+    if timeout is None:
+        raise httpx.TimeoutException('Request deadline reached before geocoding')
+    try:
+        services._count(services._geocode_counters, 'upstream_calls')
+        with metrics.stage('nominatim'):
+            response = await get_async_client().get(
+                services.NOMINATIM_URL,
+                params=services._nominatim_params(location_name),
+                timeout=timeout,
+            )
+            response.raise_for_status()
+    except Exception:
+        metrics.EXTERNAL_CALLS.inc(service='nominatim', outcome='error')
+        raise
+    metrics.EXTERNAL_CALLS.inc(service='nominatim', outcome='ok')
+    coords = services._parse_geocode(response.json())
+
+    await sync_to_async(services.cache_geocode_result)(location_name, coords)
+    return coords
+
+
+async def aget_route(waypoints):
+    """Async counterpart of services.get_route, sharing the route cache."""
+    pairs = list(zip(waypoints, waypoints[1:]))
+    keys = [services.route_cache_key(start, end) for start, end in pairs]
+
+    get_cached_leg = sync_to_async(services._get_cached_leg)
+    legs = []
+    for key, (start, end) in zip(keys, pairs):
+        leg = await get_cached_leg(key, start, end)
+        if leg is None:
+            break
+        legs.append(leg)
+    else:
+        return services._combine_legs(legs)
+
+    legs = await sync_to_async(services.local_route_legs, thread_sensitive=False)(waypoints)
+    if legs is None and (settings.ROUTING_BACKEND != 'graph' or settings.ROUTING_ORS_FALLBACK):
+        legs = await afetch_route_legs(waypoints)
+    if not legs:
+        return None
+    cache_route_result = sync_to_async(services.cache_route_result)
+    for key, leg in zip(keys, legs):
+        await cache_route_result(key, leg)
+    return services._combine_legs(legs)
+
+
+async def afetch_route_legs(waypoints):
+    """Async counterpart of services.fetch_route_legs, with the same retry policy."""
+    try:
+        headers = services._ors_headers()
+    except ValueError as e:
+        print(f"Routing error: {e}")
+        return None
+    body = services._ors_body(waypoints)
+    attempts = 1 + services.ORS_MAX_RETRIES
+    services._ors_retry_budget.deposit()
+
+    last_error = None
+    for attempt in range(attempts):
+        # Deadline first, so no half-open probe is taken for a call that won't be sent
+        timeout = resilience.attempt_timeout(services.ORS_TIMEOUT)
+        if timeout is None:
+            print("Routing abandoned: request deadline reached")
+            return None
+        if not services.ors_breaker.allow():
+            print("Routing skipped: ORS circuit breaker is open")
+            return None
+
+        try:
+            services._count(services._route_counters, 'upstream_calls')
+            with metrics.stage('ors'):
+                response = await _asend_ors(body, headers, timeout)
+            services.ors_breaker.record_success()
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='ok')
+            return services._parse_route_legs(response.json(), len(waypoints) - 1)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            services.ors_breaker.record_failure()
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='error')
+            last_error = e
+            print(f"Routing attempt {attempt + 1}/{attempts} failed (timeout/connection): {e}")
+        except httpx.HTTPStatusError as e:
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='error')
+            last_error = e
+            status_code = e.response.status_code
+            if status_code in (502, 503, 504):
+                services.ors_breaker.record_failure()
+                print(f"Routing attempt {attempt + 1}/{attempts} failed ({status_code}): {e}")
+            else:
+                # Non-transient HTTP error (4xx, etc.) — ORS is up, don't retry
+                services.ors_breaker.record_success()
+                print(f"Routing error (non-retryable {status_code}): {e}")
+                return None
+        except asyncio.CancelledError:
+            # The client went away mid-call (CancelledError is not an Exception): hand back a probe
+            services.ors_breaker.release()
+            raise
+        except Exception as e:
+            services.ors_breaker.release()
+            print(f"Routing error (unexpected): {e}")
+            return None
+
+        # Backoff before next retry, without blocking the event loop
+        if attempt < services.ORS_MAX_RETRIES:
+            delay = resilience.backoff_delay(attempt, services.ORS_RETRY_BACKOFF)
+            left = resilience.remaining()
+            if left is not None and left < delay + 1:
+                print("Not retrying: request deadline too close")
+                break
+            if not services._ors_retry_budget.try_spend():
+                print("Not retrying: ORS retry budget exhausted")
+                break
+            print(f"Retrying in {delay:.2f}s...")
+            metrics.EXTERNAL_RETRIES.inc(service='ors')
+            with metrics.stage('ors_backoff'):
+                await asyncio.sleep(delay)
+
+    print(f"Routing failed after {attempt + 1} attempts. Last error: {last_error}")
+    return None
+
+
+async def _asend_ors(body, headers, timeout):
+    """Async counterpart of services._send_ors."""
+    async def post():
+        start = time.monotonic()
+        response = await get_async_client().post(
+            services.ORS_DIRECTIONS_URL, json=body, headers=headers, timeout=timeout
+        )
+        response.raise_for_status()
+        services._ors_latency.observe(time.monotonic() - start)
+        return response
+
+    if settings.ORS_HEDGE:
+        p95 = services._ors_latency.percentile(95)
+        if p95 is not None and p95 < timeout:
+            return await resilience.ahedged(post, max(p95, settings.ORS_HEDGE_MIN_DELAY), 'ors')
+    return await post()
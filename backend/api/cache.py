@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()  # Sentinel for cache misses (None is a valid cached value)
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry TTL.
+
+    Entries expire after their TTL and the least recently used entry is
+    evicted once maxsize is reached. Hit/miss/eviction counters are kept
+    for observability.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, stored_at, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        """Returns the cached value, or default if the key is missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[2] <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_with_age(self, key, default=MISSING):
+        """Like get(), but returns (value, age_in_seconds), or default on a miss."""
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0], now - entry[1]
+
+    def peek(self, key, default=MISSING):
+        """Like get_with_age(), but leaves the counters and the LRU order alone."""
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is None or entry[2] <= now:
+                return default
+            return entry[0], now - entry[1]
+
+    def set(self, key, value, ttl=None, age=0.0):
+        """Stores value; age backdates an entry loaded from a slower tier."""
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, now - age, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class SizedLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values rather
+    than by entry count. Sizes are given by the caller (e.g. len(body)).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        """Stores value, evicting least recently used entries; returns False if it can never fit."""
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
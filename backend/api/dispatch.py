@@ -0,0 +1,202 @@
+import math
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .services import get_distances_to
+from .utils import calculate_trip_segments_batch, haversine_to
+
+MILES_PER_DEGREE = 69.09  # Miles per degree of latitude (and of longitude at the equator)
+TRUCK_CLOCKS = ('driving_since_break', 'driving_today', 'on_duty_today')
+
+
+class GridIndex:
+    """
+    Points bucketed into square cells of `cell_degrees`. A radius query only
+    visits the cells overlapping the circle's bounding box, then filters
+    their points by exact haversine distance.
+    """
+
+    def __init__(self, lats, lngs, cell_degrees=1.0):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.cell_degrees = float(cell_degrees)
+        self._columns = math.ceil(360 / self.cell_degrees)  # Column keys wrap at the antimeridian
+        self._cells = {}
+        rows = np.floor(self.lats / self.cell_degrees).astype(np.int64)
+        cols = np.floor(self.lngs / self.cell_degrees).astype(np.int64) % self._columns
+        for i, key in enumerate(zip(rows.tolist(), cols.tolist())):
+            self._cells.setdefault(key, []).append(i)
+
+    def __len__(self):
+        return self.lats.size
+
+    def within(self, lat, lng, radius_miles):
+        """Returns (indices, miles) of the points within radius_miles of (lat, lng), nearest first."""
+        dlat = radius_miles / MILES_PER_DEGREE
+        # Longitude degrees are shortest on the box's edge nearest a pole
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+        dlng = radius_miles / (MILES_PER_DEGREE * cos_lat) if cos_lat > 1e-6 else 180.0
+
+        rows = range(math.floor((lat - dlat) / self.cell_degrees), math.floor((lat + dlat) / self.cell_degrees) + 1)
+        if dlng >= 180.0:
+            cols = range(self._columns)
+        else:
+            first = math.floor((lng - dlng) / self.cell_degrees)
+            last = math.floor((lng + dlng) / self.cell_degrees)
+            cols = sorted({col % self._columns for col in range(first, min(last, first + self._columns - 1) + 1)})
+        candidates = [i for row in rows for col in cols for i in self._cells.get((row, col), ())]
+
+        indices = np.array(candidates, dtype=np.int64)
+        miles = haversine_to(lat, lng, self.lats[indices], self.lngs[indices])
+        inside = miles <= radius_miles
+        indices, miles = indices[inside], miles[inside]
+        order = np.argsort(miles, kind='stable')
+        return indices[order], miles[order]
+
+
+class Fleet:
+    """A fleet snapshot as parallel arrays, one entry per truck."""
+
+    def __init__(self, ids, lats, lngs, hours_used, clocks):
+        self.ids = ids
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.hours_used = np.asarray(hours_used, dtype=np.float64)
+        self.clocks = {name: np.asarray(values, dtype=np.float64) for name, values in clocks.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def parse_dispatch_input(data):
+    """
+    Validates a dispatch body: pickup_location, dropoff_location, fleet (a
+    list of {id, latitude, longitude, hours_used} with optional
+    TRUCK_CLOCKS), and optional top_k and max_deadhead_miles.
+    Returns ([pickup, dropoff], Fleet, top_k, max_deadhead_miles) or raises
+    ValueError with a message suitable for a 400 response.
+    """
+    pickup, dropoff = data.get('pickup_location'), data.get('dropoff_location')
+    if not pickup or not dropoff:
+        raise ValueError('pickup_location and dropoff_location are required.')
+
+    trucks = data.get('fleet')
+    if not isinstance(trucks, list) or not 1 <= len(trucks) <= settings.DISPATCH_MAX_FLEET:
+        raise ValueError(f'fleet must be a list of 1 to {settings.DISPATCH_MAX_FLEET} trucks.')
+
+    ids, lats, lngs, hours_used = [], [], [], []
+    clocks = {name: [] for name in TRUCK_CLOCKS}
+    for truck in trucks:
+        if not isinstance(truck, dict) or truck.get('id') in (None, ''):
+            raise ValueError('Each truck needs an id.')
+        try:
+            lat, lng = float(truck.get('latitude')), float(truck.get('longitude'))
+        except (ValueError, TypeError):
+            raise ValueError(f'Invalid position for truck {truck["id"]}.')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError(f'Invalid position for truck {truck["id"]}.')
+        try:
+            used = float(truck.get('hours_used'))
+        except (ValueError, TypeError):
+            raise ValueError(f'Invalid hours_used for truck {truck["id"]}.')
+        # A truck with its 70 hours used is part of the snapshot; it just can't take the load
+        if not 0 <= used <= 70:
+            raise ValueError(f'hours_used for truck {truck["id"]} must be between 0 and 70.')
+        for name in TRUCK_CLOCKS:
+            value = truck.get(name)
+            try:
+                value = 0.0 if value in (None, '') else float(value)
+            except (ValueError, TypeError):
+                raise ValueError(f'Invalid {name} for truck {truck["id"]}.')
+            if value < 0:
+                raise ValueError(f'{name} for truck {truck["id"]} must not be negative.')
+            clocks[name].append(value)
+        ids.append(truck['id'])
+        lats.append(lat)
+        lngs.append(lng)
+        hours_used.append(used)
+
+    top_k = _parse_number(data.get('top_k'), settings.DISPATCH_TOP_K, int, 'top_k')
+    if not 1 <= top_k <= settings.DISPATCH_MAX_TOP_K:
+        raise ValueError(f'top_k must be between 1 and {settings.DISPATCH_MAX_TOP_K}.')
+    max_deadhead = _parse_number(
+        data.get('max_deadhead_miles'), settings.DISPATCH_MAX_DEADHEAD_MILES, float, 'max_deadhead_miles'
+    )
+    if max_deadhead <= 0:
+        raise ValueError('max_deadhead_miles must be positive.')
+    return [pickup, dropoff], Fleet(ids, lats, lngs, hours_used, clocks), top_k, max_deadhead
+
+
+def _parse_number(value, default, kind, name):
+    if value in (None, ''):
+        return default
+    try:
+        return kind(value)
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid {name} value.')
+
+
+def rank_fleet(fleet, pickup, loaded_miles, top_k, max_deadhead_miles):
+    """
+    Ranks the trucks of a Fleet for a load picked up at `pickup` (lat, lng)
+    and driven loaded_miles. Trucks within max_deadhead_miles of the pickup
+    (straight line, a lower bound on road miles) are planned in one batch
+    HOS run over straight-line deadhead + loaded miles; the top_k by that
+    estimate get real deadhead distances and are planned again. Returns
+    (ranking, in_range): one dict per routed truck, feasible trucks first
+    by ETA, and the number of trucks within range.
+    """
+    with metrics.stage('prefilter'):
+        index = GridIndex(fleet.lats, fleet.lngs, settings.DISPATCH_GRID_DEGREES)
+        nearby, straight_miles = index.within(pickup[0], pickup[1], max_deadhead_miles)
+        estimate = _plan(fleet, nearby, straight_miles + loaded_miles)
+        best = np.lexsort((straight_miles, estimate['total_trip_hours'], ~estimate['completed']))[:top_k]
+    candidates, straight_miles = nearby[best], straight_miles[best]
+
+    with metrics.stage('deadhead'):
+        routed = get_distances_to([(fleet.lats[i], fleet.lngs[i]) for i in candidates], pickup)
+    estimated = routed is None
+    if estimated:
+        deadhead_miles = straight_miles * settings.DISPATCH_ROAD_FACTOR
+        deadhead_hours = np.full(len(candidates), np.nan)
+    else:
+        deadhead_miles, deadhead_hours = routed
+    routable = np.isfinite(deadhead_miles)
+
+    with metrics.stage('hos'):
+        planned = _plan(fleet, candidates, np.where(routable, deadhead_miles, 0.0) + loaded_miles)
+    feasible = planned['completed'] & routable
+    eta = np.where(feasible, planned['total_trip_hours'], np.inf)
+    order = np.lexsort((deadhead_miles, eta, ~feasible))
+
+    ranking = []
+    for rank, k in enumerate(order, 1):
+        i = candidates[k]
+        ranking.append({
+            'rank': rank,
+            'truck_id': fleet.ids[i],
+            'latitude': float(fleet.lats[i]),
+            'longitude': float(fleet.lngs[i]),
+            'feasible': bool(feasible[k]),
+            'eta_hours': float(eta[k]) if feasible[k] else None,
+            'deadhead_miles': float(deadhead_miles[k]) if routable[k] else None,
+            'deadhead_hours': float(deadhead_hours[k]) if routable[k] and not estimated else None,
+            'deadhead_estimated': estimated,
+            'straight_line_miles': float(straight_miles[k]),
+            'available_hours': float(70 - fleet.hours_used[i] - np.nan_to_num(planned['cycle_hours_consumed'][k])),
+            'limit_reached': bool(planned['limit_reached'][k]),
+        })
+    return ranking, len(nearby)
+
+
+def _plan(fleet, indices, distances):
+    """Batch HOS run for the trucks at `indices`, each driving its own distance."""
+    clocks = {name: values[indices] for name, values in fleet.clocks.items()}
+    return calculate_trip_segments_batch(
+        distances, fleet.hours_used[indices],
+        driving_since_break=clocks['driving_since_break'],
+        driving_daily=clocks['driving_today'],
+        on_duty_daily=clocks['on_duty_today'],
+    )
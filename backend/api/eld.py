@@ -0,0 +1,275 @@
+import io
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+from . import metrics
+from .cache import MISSING, SizedLRUCache
+from .throttle import SingleFlight
+from .utils import SegmentStatus
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+RENDER_FORMATS = ('png', 'pdf')
+
+# Same colors as the browser log (frontend/src/components/ELDLog.jsx)
+STATUS_COLORS = {
+    SegmentStatus.OFF_DUTY: '#212121',
+    SegmentStatus.SLEEPER: '#1976D2',
+    SegmentStatus.DRIVING: '#388E3C',
+    SegmentStatus.ON_DUTY: '#FBC02D',
+}
+STATUS_NAMES = {
+    SegmentStatus.OFF_DUTY: 'Off Duty',
+    SegmentStatus.SLEEPER: 'Sleeper Berth',
+    SegmentStatus.DRIVING: 'Driving',
+    SegmentStatus.ON_DUTY: 'On Duty',
+}
+
+_render_pool = None
+
+# Rendered sheets keyed by (trip plan id, day or None for the whole log book, format)
+_rendered = SizedLRUCache(max_bytes=settings.ELD_RENDER_CACHE_BYTES)
+_render_flight = SingleFlight()
+
+
+def daily_sheets(segments):
+    """
+    Splits a trip timeline (Segments, hours from trip start) into 24-hour
+    log sheets. Each sheet has:
+      day: 1-based day of the trip; start_hour: its first hour on the timeline
+      grid: SLOTS_PER_DAY SegmentStatus codes, the status at the middle of each
+            15-minute slot (off duty before the trip starts and after it ends)
+      totals: hours per status label (summing to 24)
+      miles_driven: miles of the driving segments (or parts of them) that day
+      remarks: duty status changes at stops, with hour of day and coordinates
+    """
+    if not segments:
+        return []
+    starts = np.array([segment.start_time for segment in segments], dtype=np.float64)
+    ends = starts + np.array([segment.duration for segment in segments], dtype=np.float64)
+    codes = np.array([int(segment.status) for segment in segments], dtype=np.int8)
+    miles = np.array([segment.distance_miles for segment in segments], dtype=np.float64)
+
+    first_day = int(starts[0] // 24)
+    last_day = max(first_day + 1, math.ceil(ends.max() / 24))
+    day_starts = np.arange(first_day, last_day, dtype=np.float64) * 24.0
+
+    # Status at each slot midpoint: the last segment starting at or before it, if it hasn't ended
+    midpoints = (np.arange(len(day_starts) * SLOTS_PER_DAY) + 0.5) * (SLOT_MINUTES / 60) + day_starts[0]
+    index = np.searchsorted(starts, midpoints, side='right') - 1
+    clipped = np.maximum(index, 0)
+    inside = (index >= 0) & (midpoints < ends[clipped])
+    grid = np.where(inside, codes[clipped], int(SegmentStatus.OFF_DUTY)).reshape(len(day_starts), SLOTS_PER_DAY)
+
+    # Hours of each segment falling on each day: (days, segments)
+    overlap = np.clip(
+        np.minimum(ends, day_starts[:, None] + 24.0) - np.maximum(starts, day_starts[:, None]), 0.0, None
+    )
+    durations = ends - starts
+    driving = codes == int(SegmentStatus.DRIVING)
+    share = np.divide(overlap, durations, out=np.zeros_like(overlap), where=durations > 0)
+    miles_by_day = (share[:, driving] * miles[driving]).sum(axis=1)
+
+    sheets = []
+    for i, day_start in enumerate(day_starts):
+        totals = {status.label: float(overlap[i, codes == int(status)].sum()) for status in SegmentStatus}
+        # Time outside the trip is logged off duty
+        totals[SegmentStatus.OFF_DUTY.label] += 24.0 - sum(totals.values())
+        remarks = [
+            {
+                'time': segment.start_time - day_start,
+                'status': segment.status.label,
+                'description': segment.description,
+                'latitude': segment.latitude,
+                'longitude': segment.longitude,
+            }
+            for segment in segments
+            if segment.status != SegmentStatus.DRIVING and day_start <= segment.start_time < day_start + 24.0
+        ]
+        sheets.append({
+            'day': first_day + i + 1,
+            'start_hour': float(day_start),
+            'grid': grid[i].tolist(),
+            'totals': {label: round(hours, 4) for label, hours in totals.items()},
+            'miles_driven': round(float(miles_by_day[i]), 2),
+            'remarks': remarks,
+        })
+    return sheets
+
+
+# --- Rendering ---
+# Layout of a rendered sheet, in pixels
+MARGIN = 20
+LABEL_WIDTH = 120
+HOUR_WIDTH = 36
+TOTALS_WIDTH = 80
+ROW_HEIGHT = 40
+GRID_TOP = 90
+REMARK_HEIGHT = 18
+SHEET_WIDTH = MARGIN * 2 + LABEL_WIDTH + HOUR_WIDTH * 24 + TOTALS_WIDTH
+
+
+def _hour_label(hour):
+    if hour in (0, 24):
+        return 'M'
+    if hour == 12:
+        return 'N'
+    return str(hour if hour < 12 else hour - 12)
+
+
+def _clock(hours):
+    minutes = int(round(hours * 60))
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def sheet_image(sheet):
+    """Draws one log sheet (see daily_sheets) as a printable RGB image."""
+    font = ImageFont.load_default(size=14)
+    small = ImageFont.load_default(size=11)
+    title = ImageFont.load_default(size=20)
+
+    grid_bottom = GRID_TOP + ROW_HEIGHT * len(SegmentStatus)
+    height = grid_bottom + 40 + REMARK_HEIGHT * max(1, len(sheet['remarks'])) + MARGIN
+    image = Image.new('RGB', (SHEET_WIDTH, height), 'white')
+    draw = ImageDraw.Draw(image)
+    left = MARGIN + LABEL_WIDTH
+    right = left + HOUR_WIDTH * 24
+
+    draw.text((MARGIN, MARGIN), f"Driver's Daily Log - Day {sheet['day']}", fill='black', font=title)
+    draw.text(
+        (MARGIN, MARGIN + 28),
+        f"Trip hours {sheet['start_hour']:g}-{sheet['start_hour'] + 24:g}    "
+        f"Miles driven today: {sheet['miles_driven']:.1f}",
+        fill='#555', font=font,
+    )
+
+    # Rows, hour lines and quarter-hour ticks
+    for status in SegmentStatus:
+        top = GRID_TOP + ROW_HEIGHT * status
+        draw.rectangle((left, top, right, top + ROW_HEIGHT), outline='#999')
+        draw.text((left - 8, top + ROW_HEIGHT / 2), STATUS_NAMES[status], fill='#333', font=font, anchor='rm')
+        draw.text(
+            (right + TOTALS_WIDTH - 8, top + ROW_HEIGHT / 2), _clock(sheet['totals'][status.label]),
+            fill='black', font=font, anchor='rm',
+        )
+        for quarter in range(1, 24 * 4):
+            if quarter % 4:
+                x = left + quarter * HOUR_WIDTH / 4
+                tick = 10 if quarter % 2 == 0 else 6
+                draw.line((x, top, x, top + tick), fill='#bbb')
+    for hour in range(25):
+        x = left + hour * HOUR_WIDTH
+        draw.line((x, GRID_TOP, x, grid_bottom), fill='#999' if hour % 3 else '#555')
+        draw.text((x, GRID_TOP - 6), _hour_label(hour), fill='#333', font=small, anchor='mb')
+    draw.text((right + TOTALS_WIDTH - 8, GRID_TOP - 6), 'Total', fill='#333', font=small, anchor='rb')
+    draw.text(
+        (right + TOTALS_WIDTH - 8, grid_bottom + 14), _clock(sum(sheet['totals'].values())),
+        fill='black', font=font, anchor='rm',
+    )
+
+    # Duty status line: one bar per run of equal slots, joined by vertical lines
+    slot_width = HOUR_WIDTH * 24 / SLOTS_PER_DAY
+    grid = sheet['grid']
+    start, previous_y = 0, None
+    for slot in range(1, len(grid) + 1):
+        if slot < len(grid) and grid[slot] == grid[start]:
+            continue
+        status = SegmentStatus(grid[start])
+        y = GRID_TOP + ROW_HEIGHT * status + ROW_HEIGHT / 2
+        x0, x1 = left + start * slot_width, left + slot * slot_width
+        if previous_y is not None:
+            draw.line((x0, previous_y, x0, y), fill='black', width=2)
+        draw.line((x0, y, x1, y), fill=STATUS_COLORS[status], width=6)
+        start, previous_y = slot, y
+
+    # Remarks
+    top = grid_bottom + 40
+    draw.text((MARGIN, top), 'Remarks', fill='black', font=font)
+    for i, remark in enumerate(sheet['remarks']):
+        location = ''
+        if remark['latitude'] is not None:
+            location = f" ({remark['latitude']:.4f}, {remark['longitude']:.4f})"
+        draw.text(
+            (MARGIN + 80, top + i * REMARK_HEIGHT), f"{_clock(remark['time'])}  {remark['description']}{location}",
+            fill='#333', font=small,
+        )
+    return image
+
+
+def render_sheets(sheets, fmt):
+    """
+    Renders log sheets to bytes: a PNG of the first sheet, or a PDF with one
+    page per sheet. Runs in render pool processes.
+    """
+    images = [sheet_image(sheet) for sheet in sheets]
+    buffer = io.BytesIO()
+    if fmt == 'pdf':
+        images[0].save(buffer, format='PDF', resolution=100.0, save_all=True, append_images=images[1:])
+    else:
+        images[0].save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def rendered_sheets(plan_id, sheets, day, fmt):
+    """
+    Rendered bytes of a stored plan's sheet for `day` (None: every sheet, as
+    one PDF). Cached per plan, day and format; concurrent requests for the
+    same sheet share one render. Raises ValueError for an unknown format.
+    """
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(RENDER_FORMATS)}.")
+    key = (str(plan_id), day, fmt)
+    data = _rendered.get(key)
+    if data is not MISSING:
+        return data
+
+    if day is not None:
+        sheets = [sheet for sheet in sheets if sheet['day'] == day]
+
+    def render():
+        with metrics.stage('render'):
+            if settings.ELD_RENDER_PROCESSES < 1:
+                return render_sheets(sheets, fmt)
+            return _get_render_pool().submit(render_sheets, sheets, fmt).result()
+
+    data, shared = _render_flight.do(key, render)
+    if not shared:
+        _rendered.set(key, data, len(data))
+    return data
+
+
+def render_cache_stats():
+    return _rendered.stats()
+
+
+def clear_render_cache():
+    _rendered.clear()
+
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        # spawn, like the batch planning pool: workers don't inherit the web worker's threads
+        _render_pool = ProcessPoolExecutor(
+            max_workers=settings.ELD_RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _render_pool
+
+
+def _render_metrics():
+    rendered = _rendered.stats()
+    return [
+        ('trucking_eld_render_cache_events_total', 'counter', 'Rendered log sheet cache events since the last reset.',
+         [({'event': event}, rendered[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('trucking_eld_render_cache_bytes', 'gauge', 'Bytes of rendered log sheets held in memory.',
+         [({}, rendered['bytes'])]),
+    ]
+
+
+metrics.register_collector(_render_metrics)
@@ -0,0 +1,150 @@
+import csv
+import sqlite3
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from .utils import normalize_location
+
+Place = namedtuple('Place', ['name', 'latitude', 'longitude', 'kind', 'rank'])
+
+RESULTS = ''        # Trie key holding a node's suggestions (never a single character)
+TRIE_DEPTH = 12     # Deeper prefixes filter the candidates stored at this depth
+MAX_SUGGESTIONS = 10
+
+_gazetteer = (None, None)  # (path, Gazetteer) of the loaded file
+_gazetteer_lock = threading.Lock()
+
+
+class Gazetteer:
+    """
+    In-memory index of known places and facilities.
+
+    Exact lookups go through a dict keyed by normalized name; type-ahead
+    walks a character trie whose nodes hold their best-ranked places, so
+    both cost a few dict lookups regardless of how many places are loaded.
+    """
+
+    def __init__(self, places):
+        self.places = []
+        self._by_name = {}
+        self._trie = {}
+
+        entries = []
+        for place, aliases in places:
+            index = len(self.places)
+            self.places.append(place)
+            for name in (place.name, *aliases):
+                key = normalize_location(name)
+                if key and key not in self._by_name:
+                    self._by_name[key] = index
+                    entries.append((key, index))
+
+        # Highest rank first, so each trie node keeps the places worth suggesting
+        entries.sort(key=lambda entry: (-self.places[entry[1]].rank, entry[0]))
+        for key, index in entries:
+            node = self._trie
+            for depth, char in enumerate(key[:TRIE_DEPTH], 1):
+                node = node.setdefault(char, {})
+                results = node.setdefault(RESULTS, [])
+                if depth == TRIE_DEPTH:
+                    # Deepest nodes keep every name so longer prefixes can be filtered
+                    results.append((key, index))
+                elif len(results) < MAX_SUGGESTIONS and all(i != index for _, i in results):
+                    results.append((key, index))
+
+    def __len__(self):
+        return len(self.places)
+
+    def lookup(self, location_name):
+        """Returns (lat, lng) for a known place name, or None."""
+        index = self._by_name.get(normalize_location(location_name))
+        if index is None:
+            return None
+        place = self.places[index]
+        return (place.latitude, place.longitude)
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """Returns up to limit places whose name (or alias) starts with prefix, best ranked first."""
+        prefix = normalize_location(prefix)
+        if not prefix:
+            return []
+        node = self._trie
+        for char in prefix[:TRIE_DEPTH]:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        matches = []
+        for key, index in node[RESULTS]:
+            if index not in matches and key.startswith(prefix):
+                matches.append(index)
+                if len(matches) >= limit:
+                    break
+        return [self.places[index] for index in matches]
+
+    @classmethod
+    def load(cls, path):
+        """Loads places from a CSV file or a SQLite database with a `places` table."""
+        if str(path).endswith(('.sqlite', '.sqlite3', '.db')):
+            connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                connection.row_factory = sqlite3.Row
+                rows = [dict(row) for row in connection.execute('SELECT * FROM places')]
+            finally:
+                connection.close()
+        else:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f))
+        return cls(parse_place(row) for row in rows)
+
+
+def parse_place(row):
+    """
+    Converts a CSV/SQLite row to (Place, aliases).
+    Columns: name, latitude, longitude, optional kind, rank and aliases ('|'-separated).
+    """
+    try:
+        place = Place(
+            name=str(row['name']).strip(),
+            latitude=float(row['latitude']),
+            longitude=float(row['longitude']),
+            kind=row.get('kind') or 'place',
+            rank=float(row.get('rank') or 0),
+        )
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid gazetteer row: {row}")
+    aliases = [alias.strip() for alias in (row.get('aliases') or '').split('|') if alias.strip()]
+    return place, aliases
+
+
+def get_gazetteer():
+    """
+    Returns the gazetteer loaded from GAZETTEER_PATH (once per process and path),
+    or None if no path is configured or the file can't be loaded.
+    """
+    global _gazetteer
+    path = settings.GAZETTEER_PATH
+    if not path:
+        return None
+    if _gazetteer[0] != path:
+        with _gazetteer_lock:
+            if _gazetteer[0] != path:
+                try:
+                    _gazetteer = (path, Gazetteer.load(path))
+                except (OSError, sqlite3.Error, ValueError) as e:
+                    print(f"Gazetteer unavailable ({path}): {e}")
+                    _gazetteer = (path, None)
+    return _gazetteer[1]
+
+
+def lookup(location_name):
+    """Returns (lat, lng) from the local gazetteer, or None on a miss."""
+    gazetteer = get_gazetteer()
+    return gazetteer.lookup(location_name) if gazetteer is not None else None
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    gazetteer = get_gazetteer()
+    return gazetteer.suggest(prefix, limit) if gazetteer is not None else []
@@ -0,0 +1,215 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Count, F
+from django.utils import timezone
+from rest_framework import status
+
+from . import metrics, resilience
+from .models import TripJob
+from .services import geocode_and_route
+from .trips import (
+    GEOCODE_ERROR, ROUTING_ERROR, parse_layout, parse_trip_input, parse_zoom, plan_trip, publish_trip_plan
+)
+
+JOB_SECONDS = metrics.histogram(
+    'trucking_trip_job_seconds', 'Time from claiming a trip job to finishing it.', ('status',),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+
+class QueueFull(Exception):
+    """Raised by submit() when TRIP_JOB_MAX_QUEUED jobs are already waiting."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it was cancelled or its lease was lost."""
+
+
+def submit(data):
+    """
+    Validates a trip request body (as /api/calculate-trip/ takes it) and
+    queues it. Returns the TripJob; raises ValueError for invalid input and
+    QueueFull when the queue is at TRIP_JOB_MAX_QUEUED.
+    """
+    locations, hours_used = parse_trip_input(data)
+    payload = {
+        'locations': locations,
+        'hours_used': hours_used,
+        'layout': parse_layout(data.get('layout')),
+        'zoom': parse_zoom(data.get('zoom')),
+    }
+    if TripJob.objects.filter(status=TripJob.QUEUED).count() >= settings.TRIP_JOB_MAX_QUEUED:
+        raise QueueFull(f'{settings.TRIP_JOB_MAX_QUEUED} trip jobs are already queued.')
+    return TripJob.objects.create(payload=payload)
+
+
+def job_status(job):
+    """Status body for a job: the trip response once it succeeded, the error once it failed."""
+    data = {
+        'job_id': str(job.id),
+        'status': job.status,
+        'attempts': job.attempts,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == TripJob.SUCCEEDED:
+        data['result'] = job.result
+    elif job.status == TripJob.FAILED:
+        data['error'] = job.result['error']
+        data['status_code'] = job.status_code
+    elif job.cancel_requested:
+        data['cancel_requested'] = True
+    return data
+
+
+def cancel(job_id):
+    """
+    Cancels a job: a queued job at once, a running one at its worker's next
+    check. Returns the updated TripJob, or None if there is no such job.
+    """
+    TripJob.objects.filter(pk=job_id, status=TripJob.QUEUED).update(
+        status=TripJob.CANCELLED, cancel_requested=True, finished_at=timezone.now()
+    )
+    TripJob.objects.filter(pk=job_id, status=TripJob.RUNNING).update(cancel_requested=True)
+    return TripJob.objects.filter(pk=job_id).first()
+
+
+def claim_next(worker):
+    """
+    Claims the oldest queued job for `worker` and returns it, or None if the
+    queue is empty. Jobs whose worker stopped renewing its lease are queued
+    again first (or failed after TRIP_JOB_MAX_ATTEMPTS).
+    """
+    requeue_expired()
+    for _ in range(5):
+        job_id = (
+            TripJob.objects.filter(status=TripJob.QUEUED).order_by('created_at').values_list('pk', flat=True).first()
+        )
+        if job_id is None:
+            return None
+        now = timezone.now()
+        # Conditional update: if another worker claimed it first, nothing changes and we try the next job
+        claimed = TripJob.objects.filter(pk=job_id, status=TripJob.QUEUED).update(
+            status=TripJob.RUNNING, worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return TripJob.objects.get(pk=job_id)
+    return None
+
+
+def requeue_expired():
+    """Returns jobs of workers that died mid-job (no heartbeat for TRIP_JOB_LEASE seconds) to the queue."""
+    expired = TripJob.objects.filter(
+        status=TripJob.RUNNING, heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.TRIP_JOB_LEASE)
+    )
+    expired.filter(attempts__gte=settings.TRIP_JOB_MAX_ATTEMPTS).update(
+        status=TripJob.FAILED, result={'error': 'Trip job was abandoned by its worker.'},
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, finished_at=timezone.now()
+    )
+    return expired.update(status=TripJob.QUEUED, worker='')
+
+
+def purge_expired():
+    """Deletes jobs that finished more than TRIP_JOB_RETENTION seconds ago; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.TRIP_JOB_RETENTION)
+    deleted, _ = TripJob.objects.filter(status__in=TripJob.FINISHED, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def run_job(job):
+    """
+    Runs a claimed job through geocode -> route -> HOS and stores the trip
+    response on it. The lease is renewed (and cancellation checked) between
+    stages; upstream calls get TRIP_JOB_DEADLINE seconds in all.
+    """
+    start = time.perf_counter()
+    payload = job.payload
+    token = resilience.set_deadline(settings.TRIP_JOB_DEADLINE)
+    try:
+        _heartbeat(job)
+        coords, routes = geocode_and_route(payload['locations'])
+        _heartbeat(job)
+        if not all(coords):
+            outcome = _finish(job, TripJob.FAILED, {'error': GEOCODE_ERROR}, status.HTTP_400_BAD_REQUEST)
+        elif not all(routes):
+            outcome = _finish(job, TripJob.FAILED, {'error': ROUTING_ERROR}, status.HTTP_503_SERVICE_UNAVAILABLE)
+        else:
+            try:
+                planned = plan_trip(routes, payload['hours_used'])
+            except ValueError as e:
+                outcome = _finish(job, TripJob.FAILED, {'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+            else:
+                data = publish_trip_plan(payload['locations'], planned, payload['layout'], payload['zoom'])
+                outcome = _finish(job, TripJob.SUCCEEDED, data, status.HTTP_200_OK)
+    except JobCancelled:
+        outcome = _finish(job, TripJob.CANCELLED, None, None)
+    except Exception as e:
+        print(f"Trip job {job.id} failed: {e}")
+        outcome = _finish(job, TripJob.FAILED, {'error': 'Trip calculation failed.'},
+                          status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        resilience.reset_deadline(token)
+    JOB_SECONDS.observe(time.perf_counter() - start, status=outcome)
+    return outcome
+
+
+def _heartbeat(job):
+    renewed = TripJob.objects.filter(
+        pk=job.pk, status=TripJob.RUNNING, worker=job.worker, cancel_requested=False
+    ).update(heartbeat_at=timezone.now())
+    if not renewed:
+        raise JobCancelled()
+
+
+def _finish(job, outcome, result, status_code):
+    # Only the worker holding the lease may finish the job
+    TripJob.objects.filter(pk=job.pk, status=TripJob.RUNNING, worker=job.worker).update(
+        status=outcome, result=result, status_code=status_code, finished_at=timezone.now()
+    )
+    return outcome
+
+
+def work(worker, poll_interval=None, burst=False, stop=None):
+    """
+    Worker loop: claims and runs jobs one at a time until `stop` (a
+    threading/multiprocessing Event) is set, or, with burst, until the queue
+    is empty. Returns the number of jobs run.
+    """
+    poll_interval = settings.TRIP_JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    processed = 0
+    last_purge = 0.0
+    while stop is None or not stop.is_set():
+        if time.monotonic() - last_purge > 60:
+            purge_expired()
+            last_purge = time.monotonic()
+        job = claim_next(worker)
+        if job is None:
+            if burst:
+                break
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+        close_old_connections()
+    return processed
+
+
+def _job_metrics():
+    try:
+        counts = dict(TripJob.objects.values_list('status').annotate(count=Count('pk')))
+    except DatabaseError:
+        return []
+    return [
+        ('trucking_trip_jobs', 'gauge', 'Trip jobs by status (finished jobs until they are purged).',
+         [({'status': value}, counts.get(value, 0)) for value, _ in TripJob.STATUS_CHOICES]),
+    ]
+
+
+metrics.register_collector(_job_metrics)
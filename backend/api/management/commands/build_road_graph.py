@@ -0,0 +1,93 @@
+import csv
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.routing import RoadGraph
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the local road graph used by ROUTING_BACKEND='graph'. "
+        "The nodes CSV needs 'id', 'latitude' and 'longitude' columns; the edges CSV "
+        "needs 'source', 'target' and 'distance_miles', plus optional 'speed_mph' "
+        "and 'oneway' (edges are two-way unless oneway is true)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('nodes_csv')
+        parser.add_argument('edges_csv')
+        parser.add_argument(
+            '--output', default=settings.ROAD_GRAPH_PATH,
+            help='Where to write the .npz graph (default: ROAD_GRAPH_PATH).'
+        )
+        parser.add_argument(
+            '--default-speed', type=float, default=55.0,
+            help='Speed in mph for edges without a speed_mph value.'
+        )
+
+    def handle(self, *args, **options):
+        nodes = self._read(options['nodes_csv'], ('id', 'latitude', 'longitude'))
+        edges = self._read(options['edges_csv'], ('source', 'target', 'distance_miles'))
+
+        index = {}
+        lats, lngs = [], []
+        for row in nodes:
+            try:
+                lat, lng = float(row['latitude']), float(row['longitude'])
+            except ValueError:
+                raise CommandError(f"Invalid coordinates for node {row['id']!r}")
+            index[row['id']] = len(lats)
+            lats.append(lat)
+            lngs.append(lng)
+
+        sources, targets, miles, hours = [], [], [], []
+        skipped = 0
+        for row in edges:
+            try:
+                u, v = index[row['source']], index[row['target']]
+                distance = float(row['distance_miles'])
+                speed = float(row.get('speed_mph') or options['default_speed'])
+            except (KeyError, ValueError):
+                skipped += 1
+                continue
+            if distance <= 0 or speed <= 0:
+                skipped += 1
+                continue
+
+            directions = [(u, v)]
+            if (row.get('oneway') or '').strip().lower() not in TRUE_VALUES:
+                directions.append((v, u))
+            for a, b in directions:
+                sources.append(a)
+                targets.append(b)
+                miles.append(distance)
+                hours.append(distance / speed)
+
+        if not sources:
+            raise CommandError('No valid edges found')
+
+        graph = RoadGraph.from_edges(
+            np.array(lats), np.array(lngs), np.array(sources), np.array(targets),
+            np.array(miles), np.array(hours),
+        )
+        graph.save(options['output'])
+        if skipped:
+            self.stderr.write(f"Skipped {skipped} edges with unknown nodes or invalid values")
+        self.stdout.write(self.style.SUCCESS(
+            f"Road graph written to {options['output']}: "
+            f"{graph.node_count} nodes, {graph.edge_count} directed edges"
+        ))
+
+    def _read(self, path, columns):
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f))
+        except OSError as e:
+            raise CommandError(f"Could not read {path}: {e}")
+        if rows and not all(column in rows[0] for column in columns):
+            raise CommandError(f"{path} must have columns: {', '.join(columns)}")
+        return rows
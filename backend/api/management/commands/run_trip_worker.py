@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _worker_process(name, poll_interval, burst, stop):
+    # Runs in a spawned process: set Django up before anything imports the models
+    import django
+    django.setup()
+    from api import jobs
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops us through `stop`
+    jobs.work(name, poll_interval, burst, stop)
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued trip jobs (POST /api/trip-jobs/) on a pool of worker processes. "
+        "Each process runs one job at a time; stop with SIGINT/SIGTERM, and running jobs finish first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.TRIP_JOB_WORKERS,
+            help='Worker processes (default TRIP_JOB_WORKERS); 0 runs jobs in this process.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.TRIP_JOB_POLL_INTERVAL,
+            help='Seconds between queue checks while it is empty.'
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        from api import jobs
+
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        poll_interval, burst = options['poll_interval'], options['burst']
+        if options['processes'] < 1:
+            processed = jobs.work(name, poll_interval, burst)
+            self.stdout.write(self.style.SUCCESS(f"Trip worker {name} ran {processed} jobs"))
+            return
+
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        def start(i):
+            process = context.Process(
+                target=_worker_process, args=(f'{name}/{i}', poll_interval, burst, stop), daemon=True
+            )
+            process.start()
+            return process
+
+        workers = [start(i) for i in range(options['processes'])]
+        self.stdout.write(f"Trip worker {name} started {len(workers)} processes")
+        while any(process.is_alive() for process in workers) and not stop.is_set():
+            for i, process in enumerate(workers):
+                process.join(timeout=1.0 / len(workers))
+                # Replace crashed workers; a burst worker exits normally once the queue is empty
+                if process.exitcode not in (None, 0) and not stop.is_set():
+                    self.stderr.write(f"Trip worker {name}/{i} exited with {process.exitcode}; restarting")
+                    workers[i] = start(i)
+        for process in workers:
+            process.join()
+        self.stdout.write(self.style.SUCCESS(f"Trip worker {name} stopped"))
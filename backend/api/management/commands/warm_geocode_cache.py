@@ -0,0 +1,78 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import GeocodeCacheEntry
+from api.services import cache_geocode_result, fetch_geocode
+from api.utils import normalize_location
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-warms the geocode cache from a CSV of known locations. "
+        "Rows need a 'location' column; rows with 'latitude' and 'longitude' "
+        "are stored as-is, the rest are geocoded through Nominatim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument(
+            '--delay', type=float, default=1.0,
+            help='Seconds between Nominatim requests (usage policy: max 1/s).'
+        )
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help='Re-geocode locations that are already cached.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f))
+        except OSError as e:
+            raise CommandError(f"Could not read {options['csv_path']}: {e}")
+
+        if rows and 'location' not in rows[0]:
+            raise CommandError("CSV must have a 'location' column")
+
+        stored = skipped = failed = 0
+        last_request = 0.0
+        for row in rows:
+            location = (row.get('location') or '').strip()
+            if not location:
+                continue
+
+            lat, lng = row.get('latitude'), row.get('longitude')
+            if lat and lng:
+                try:
+                    cache_geocode_result(location, (float(lat), float(lng)))
+                    stored += 1
+                except ValueError:
+                    self.stderr.write(f"Invalid coordinates for {location!r}: {lat}, {lng}")
+                    failed += 1
+                continue
+
+            query = normalize_location(location)[:255]
+            if not options['refresh'] and GeocodeCacheEntry.objects.filter(query=query).exists():
+                skipped += 1
+                continue
+
+            wait = options['delay'] - (time.monotonic() - last_request)
+            if wait > 0:
+                time.sleep(wait)
+            last_request = time.monotonic()
+            try:
+                coords = fetch_geocode(location)
+            except Exception as e:
+                self.stderr.write(f"Geocoding failed for {location!r}: {e}")
+                failed += 1
+                continue
+            cache_geocode_result(location, coords)
+            stored += 1
+            if coords is None:
+                self.stdout.write(f"No match for {location!r} (cached as not found)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Geocode cache warmed: {stored} stored, {skipped} already cached, {failed} failed"
+        ))
@@ -0,0 +1,198 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+_metrics = []
+_collectors = []
+
+# Stage timings of the request being handled: {stage: [total_seconds, count]}
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus layout) with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(entry[:-1]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(entry) for key, entry in self._values.items()}
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket', {**labels, 'le': le}, cumulative
+            yield f'{self.name}_sum', labels, entry[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+def counter(name, help_text, labelnames=()):
+    metric = Counter(name, help_text, labelnames)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help_text, labelnames, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(collect):
+    """
+    Registers a callable run at scrape time for values kept elsewhere.
+    It returns (name, kind, help, [(labels, value), ...]) tuples.
+    """
+    _collectors.append(collect)
+
+
+REQUEST_SECONDS = histogram(
+    'trucking_http_request_seconds', 'Request latency by view.', ('view', 'method', 'status')
+)
+STAGE_SECONDS = histogram('trucking_stage_seconds', 'Time spent per request stage.', ('stage',))
+EXTERNAL_CALLS = counter(
+    'trucking_external_calls_total', 'Upstream HTTP calls by service and outcome.', ('service', 'outcome')
+)
+EXTERNAL_RETRIES = counter('trucking_external_retries_total', 'Upstream calls retried after a failure.', ('service',))
+
+
+@contextmanager
+def stage(name):
+    """Times a block as one stage of the current request (and in STAGE_SECONDS)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+def bind(fn):
+    """Wraps fn to run in a copy of the current context, so executor threads record into this request."""
+    return partial(contextvars.copy_context().run, fn)
+
+
+def start_request():
+    return _request_timings.set({})
+
+
+def finish_request(token):
+    """Ends the request started with token; returns its {stage: [seconds, count]} timings."""
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings or {}
+
+
+def server_timing(timings, total=None):
+    """Formats stage timings as a Server-Timing header value (durations in ms)."""
+    parts = []
+    for name, (seconds, count) in timings.items():
+        part = f'{name};dur={seconds * 1000:.1f}'
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    families = [(m.name, m.kind, m.help, m.samples()) for m in _metrics]
+    for collect in _collectors:
+        for name, kind, help_text, values in collect():
+            families.append((name, kind, help_text, ((name, labels, value) for labels, value in values)))
+
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample_name, labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f'{sample_name}{{{label_text}}} {value}')
+            else:
+                lines.append(f'{sample_name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Clears every metric (tests only)."""
+    for metric in _metrics:
+        metric.reset()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
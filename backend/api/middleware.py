@@ -0,0 +1,86 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+from . import metrics, resilience
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the stage timings recorded while handling a request, adds them
+    as a Server-Timing header and observes the request latency histogram.
+    Works for both sync and async views.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    def _finish(self, request, response, timings, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        metrics.REQUEST_SECONDS.observe(
+            elapsed,
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+        )
+        response['Server-Timing'] = metrics.server_timing(timings, elapsed)
+        return response
+
+
+class RequestDeadlineMiddleware:
+    """
+    Starts the REQUEST_DEADLINE clock for each request; upstream calls
+    shorten their timeouts and skip retries that can't finish in time.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = resilience.set_deadline(settings.REQUEST_DEADLINE)
+        try:
+            return self.get_response(request)
+        finally:
+            resilience.reset_deadline(token)
+
+    async def __acall__(self, request):
+        token = resilience.set_deadline(settings.REQUEST_DEADLINE)
+        try:
+            return await self.get_response(request)
+        finally:
+            resilience.reset_deadline(token)
+
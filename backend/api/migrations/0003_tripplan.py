@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-17 06:18
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_routecacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripPlan',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('locations', models.JSONField()),
+                ('hours_used', models.FloatField()),
+                ('leg_distances', models.JSONField()),
+                ('polyline_leg1', models.TextField()),
+                ('polyline_leg2', models.TextField()),
+                ('cumulative_miles', models.BinaryField()),
+                ('segments', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
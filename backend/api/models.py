@@ -1,3 +1,84 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class GeocodeCacheEntry(models.Model):
+    """
+    Persistent geocode result shared by all worker processes.
+    A row with found=False records that the geocoder had no match.
+    """
+    query = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    found = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        if not self.found:
+            return f"{self.query} (not found)"
+        return f"{self.query} ({self.latitude}, {self.longitude})"
+
+
+class RouteCacheEntry(models.Model):
+    """
+    On-disk backing store for the route cache, keyed by snapped start/end coordinates.
+    Only used when ROUTE_CACHE_PERSIST is enabled.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    distance_miles = models.FloatField()
+    duration_hours = models.FloatField()
+    polyline = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.distance_miles:.1f} mi)"
+
+
+class TripPlan(models.Model):
+    """
+    A planned trip, stored with its route geometry and distance index so it
+    can be re-planned from a driver's progress without geocoding or routing again.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    locations = models.JSONField()
+    hours_used = models.FloatField()
+    leg_distances = models.JSONField()       # Miles per leg
+    polyline_leg1 = models.TextField()
+    polyline_leg2 = models.TextField()
+    cumulative_miles = models.BinaryField()  # RouteGeometry.cumulative_bytes() of both legs
+    segments = models.JSONField()            # Segment rows of the original plan
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id} ({' -> '.join(self.locations)})"
+
+
+class TripJob(models.Model):
+    """
+    A trip calculation queued for the run_trip_worker processes. The table is
+    the queue: workers claim the oldest queued job, keep its lease alive while
+    they run it, and store the trip response (or an error) on the row.
+    """
+    QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+    STATUS_CHOICES = [(value, value) for value in (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)]
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    payload = models.JSONField()                       # Validated trip input: locations, hours_used, layout, zoom
+    result = models.JSONField(null=True, blank=True)   # Trip response, or {'error': ...}
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # HTTP status the trip would have had
+    cancel_requested = models.BooleanField(default=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
@@ -0,0 +1,21 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def pack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders responses as MessagePack when the client sends Accept: application/msgpack."""
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return pack(data)
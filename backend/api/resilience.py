@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from . import metrics
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers = []
+_budgets = []
+
+# Absolute time.monotonic() by which the current request must be answered
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+HEDGES = metrics.counter(
+    'trucking_hedged_requests_total', 'Hedged upstream requests sent, and how many won the race.',
+    ('service', 'outcome')
+)
+
+
+class CircuitBreaker:
+    """
+    Shared breaker for one upstream service.
+
+    Opens after failure_threshold consecutive failures and rejects calls
+    for recovery_timeout seconds. It then lets a single probe through
+    (half-open): success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self.reset()
+        _breakers.append(self)
+
+    def reset(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejections = 0
+        self._probing = False
+
+    def allow(self):
+        """True if a call may go out now (in half-open, only for the single probe)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejections += 1
+            return False
+
+    def release(self):
+        """Gives back a half-open probe whose call ended without an outcome (abandoned or failed locally)."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                print(f"Circuit breaker '{self.name}' opened after {self.failures} failures")
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejections': self.rejections,
+            }
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent traffic, so a failing upstream
+    is not hit with (1 + retries) times the normal load.
+    Every call deposits `ratio` tokens (up to max_tokens) and every retry spends one.
+    """
+
+    def __init__(self, name, ratio=0.2, max_tokens=10.0):
+        self.name = name
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self.reset()
+        _budgets.append(self)
+
+    def reset(self):
+        self.tokens = self.max_tokens
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+
+class LatencyTracker:
+    """Recent successful call durations, for the hedging delay."""
+
+    def __init__(self, size=200, min_samples=20):
+        self._samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        """q-th percentile (0-100) of the recent samples, or None until min_samples are seen."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+def reset():
+    """Closes every breaker and refills every retry budget (tests only)."""
+    for breaker in _breakers:
+        breaker.reset()
+    for budget in _budgets:
+        budget.reset()
+
+
+def backoff_delay(attempt, base, cap=30.0):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def set_deadline(seconds):
+    """Gives the current request `seconds` to finish; returns a token for reset_deadline."""
+    return _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def attempt_timeout(limit, minimum=0.5):
+    """
+    Timeout for the next upstream attempt: limit, shortened to the time left
+    before the request deadline. None if less than `minimum` seconds are left.
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    if left < minimum:
+        return None
+    return min(limit, left)
+
+
+def hedged(call, delay, executor, service):
+    """
+    Runs call(); if it hasn't finished after `delay` seconds, starts a second
+    identical call and returns whichever succeeds first. The error of the last
+    call to fail is raised if both fail.
+    """
+    first = executor.submit(metrics.bind(call))
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    HEDGES.inc(service=service, outcome='sent')
+    second = executor.submit(metrics.bind(call))
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is second:
+                HEDGES.inc(service=service, outcome='won')
+            return result
+    raise error
+
+
+async def ahedged(call, delay, service):
+    """Async counterpart of hedged(); call is a coroutine function."""
+    first = asyncio.ensure_future(call())
+    try:
+        done, _ = await asyncio.wait([first], timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    HEDGES.inc(service=service, outcome='sent')
+    second = asyncio.ensure_future(call())
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is second:
+                    HEDGES.inc(service=service, outcome='won')
+                return future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+    raise error
+
+
+def _resilience_metrics():
+    states = [({'name': b.name}, STATE_CODES[b.state]) for b in _breakers]
+    trips = [({'name': b.name}, b.trips) for b in _breakers]
+    rejections = [({'name': b.name}, b.rejections) for b in _breakers]
+    exhausted = [({'name': b.name}, b.exhausted) for b in _budgets]
+    return [
+        ('trucking_circuit_state', 'gauge', 'Circuit breaker state (0 closed, 1 half-open, 2 open).', states),
+        ('trucking_circuit_trips_total', 'counter', 'Times each circuit breaker opened.', trips),
+        ('trucking_circuit_rejections_total', 'counter', 'Calls rejected by an open breaker.', rejections),
+        ('trucking_retry_budget_exhausted_total', 'counter', 'Retries skipped for lack of budget.', exhausted),
+    ]
+
+
+metrics.register_collector(_resilience_metrics)
@@ -0,0 +1,89 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics, services
+from .cache import MISSING, SizedLRUCache
+from .utils import normalize_location
+
+# A rendered trip response and the geocode/route cache entries it was built from
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'dependencies'])
+
+_responses = SizedLRUCache(max_bytes=settings.TRIP_RESPONSE_CACHE_BYTES)
+_counters = {'invalidations': 0}
+_renderer = JSONRenderer()
+
+
+def trip_key(locations, hours_used, layout='rows', zoom=None, log_sheets=False):
+    """Content address of a trip request: a hash of its normalized inputs."""
+    normalized = [[normalize_location(name) for name in locations], float(hours_used), layout, zoom, log_sheets]
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+def get(key):
+    """
+    Returns the CachedResponse for a trip key, or None. Entries whose
+    geocode or route cache entries changed or expired are dropped.
+    """
+    entry = _responses.get(key)
+    if entry is MISSING:
+        return None
+    if not services.dependencies_current(entry.dependencies):
+        _responses.delete(key)
+        services._count(_counters, 'invalidations')
+        return None
+    return entry
+
+
+def put(key, data, locations, coords):
+    """
+    Renders a trip response and caches it while the geocode/route entries it
+    was built from are current. Returns the CachedResponse either way, so
+    the caller can answer with its ETag.
+    """
+    body = _renderer.render(data)
+    entry = CachedResponse(body, f'W/"{hashlib.sha256(body).hexdigest()[:32]}"', None)
+    if not settings.TRIP_RESPONSE_CACHE_BYTES:
+        return entry
+    dependencies = services.cache_dependencies(locations, coords)
+    if dependencies is not None:
+        entry = entry._replace(dependencies=dependencies)
+        _responses.set(key, entry, len(body))
+    return entry
+
+
+def not_modified(request, entry):
+    """True if the request's If-None-Match already names this response."""
+    tags = request.headers.get('If-None-Match', '')
+    return tags.strip() == '*' or entry.etag in (tag.strip() for tag in tags.split(','))
+
+
+def stats():
+    with services._counters_lock:
+        counters = dict(_counters)
+    return {'memory': _responses.stats(), **counters}
+
+
+def clear():
+    _responses.clear()
+    with services._counters_lock:
+        _counters['invalidations'] = 0
+
+
+def _response_cache_metrics():
+    memory = _responses.stats()
+    events = [({'event': event}, memory[event]) for event in ('hits', 'misses', 'evictions')]
+    with services._counters_lock:
+        events.append(({'event': 'invalidations'}, _counters['invalidations']))
+    return [
+        ('trucking_response_cache_events_total', 'counter', 'Trip response cache events since the last reset.',
+         events),
+        ('trucking_response_cache_bytes', 'gauge', 'Bytes of rendered trip responses held in memory.',
+         [({}, memory['bytes'])]),
+    ]
+
+
+metrics.register_collector(_response_cache_metrics)
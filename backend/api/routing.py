@@ -0,0 +1,278 @@
+import heapq
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .cache import MISSING
+from .utils import encode_polyline, haversine_distance, haversine_segments
+
+EARTH_RADIUS_MILES = 3958.8
+SNAP_SPEED_MPH = 30.0  # Assumed speed between a waypoint and its snapped graph node
+
+_graph = MISSING
+_graph_lock = threading.Lock()
+
+
+class RoadGraph:
+    """
+    Directed road network stored as forward and reverse CSR arrays.
+
+    Edge weights are travel times in hours; edge lengths are in miles.
+    Queries run bidirectional A* with the average of the forward and
+    reverse straight-line potentials, so both searches stay consistent.
+    """
+
+    ARRAYS = (
+        'lats', 'lngs',
+        'fwd_indptr', 'fwd_targets', 'fwd_hours', 'fwd_miles',
+        'rev_indptr', 'rev_targets', 'rev_hours', 'rev_miles',
+    )
+
+    def __init__(self, arrays, max_speed):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.max_speed = float(max_speed)  # mph; makes straight-line time a lower bound
+
+        # Memoryviews index to plain Python numbers without copying the arrays
+        self._fwd = tuple(memoryview(arrays[name]) for name in self.ARRAYS[2:6])
+        self._rev = tuple(memoryview(arrays[name]) for name in self.ARRAYS[6:10])
+        lat_rad, lng_rad = np.radians(self.lats), np.radians(self.lngs)
+        self._unit = tuple(memoryview(np.ascontiguousarray(a)) for a in (
+            np.cos(lat_rad) * np.cos(lng_rad), np.cos(lat_rad) * np.sin(lng_rad), np.sin(lat_rad)
+        ))
+        self._scaled_lngs = None
+
+    @classmethod
+    def from_edges(cls, lats, lngs, sources, targets, miles, hours):
+        """
+        Builds the graph from node coordinates and directed edge arrays.
+        Nodes without any edge are dropped so waypoints never snap to them.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        miles = np.asarray(miles, dtype=np.float64)
+        hours = np.asarray(hours, dtype=np.float64)
+        if np.any(hours <= 0):
+            raise ValueError('Edge travel times must be positive.')
+
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        used = np.zeros(lats.size, dtype=bool)
+        used[sources] = True
+        used[targets] = True
+        remap = np.cumsum(used) - 1
+        sources, targets = remap[sources], remap[targets]
+        lats, lngs = lats[used], lngs[used]
+        n = lats.size
+
+        def csr(keys, values, *columns):
+            order = np.argsort(keys, kind='stable')
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+            return [indptr, values[order].astype(np.int32)] + [column[order] for column in columns]
+
+        arrays = dict(zip(
+            cls.ARRAYS,
+            [lats, lngs] + csr(sources, targets, hours, miles) + csr(targets, sources, hours, miles),
+        ))
+
+        # Straight-line edge lengths: every other segment of the path u0, v0, u1, v1, ...
+        ends = np.column_stack([sources, targets]).ravel()
+        straight = haversine_segments(lats[ends], lngs[ends])[::2]
+        max_speed = float(np.max(straight / hours)) if straight.size else 0.0
+        # Small margin so float rounding can't make the potentials inadmissible
+        return cls(arrays, max(max_speed * (1 + 1e-9), 1e-9))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {name: np.ascontiguousarray(data[name]) for name in cls.ARRAYS}
+            return cls(arrays, data['max_speed'])
+
+    def save(self, path):
+        np.savez(path, max_speed=self.max_speed, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @property
+    def node_count(self):
+        return self.lats.size
+
+    @property
+    def edge_count(self):
+        return self.fwd_targets.size
+
+    def nearest_node(self, lat, lng):
+        """Returns (node, miles) for the graph node closest to a point."""
+        if self._scaled_lngs is None:
+            self._scaled_lngs = self.lngs * np.cos(np.radians(self.lats))
+        scale = math.cos(math.radians(lat))
+        d2 = (self.lats - lat) ** 2 + (self._scaled_lngs - lng * scale) ** 2
+        node = int(np.argmin(d2))
+        return node, haversine_distance(lat, lng, self.lats[node], self.lngs[node])
+
+    def shortest_path(self, source, target):
+        """
+        Fastest path between two nodes.
+        Returns (nodes, hours, miles), or None if target is unreachable.
+        """
+        if source == target:
+            return [source], 0.0, 0.0
+
+        # Potentials use straight-line (chord) distance through the unit sphere:
+        # it satisfies the triangle inequality and never exceeds the road
+        # distance, so the averaged potentials stay consistent.
+        xs, ys, zs = self._unit
+        sx, sy, sz = xs[source], ys[source], zs[source]
+        tx, ty, tz = xs[target], ys[target], zs[target]
+        scale = EARTH_RADIUS_MILES / (2 * self.max_speed)
+        sqrt = math.sqrt
+
+        def potential(v):
+            # Forward potential in hours; the reverse search uses its negation
+            x, y, z = xs[v], ys[v], zs[v]
+            return scale * (sqrt((x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2)
+                            - sqrt((x - sx) ** 2 + (y - sy) ** 2 + (z - sz) ** 2))
+
+        searches = (
+            (self._fwd, {source: 0.0}, {source: None}, [(potential(source), source)], set(), 1),
+            (self._rev, {target: 0.0}, {target: None}, [(-potential(target), target)], set(), -1),
+        )
+        best, meet = math.inf, None
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        while searches[0][3] and searches[1][3]:
+            top_f, top_r = searches[0][3][0][0], searches[1][3][0][0]
+            if top_f + top_r >= best:
+                break
+            side = 0 if top_f <= top_r else 1
+            (indptr, targets, hours, _), dist, parent, heap, settled, sign = searches[side]
+            other_dist = searches[1 - side][1]
+
+            u = heappop(heap)[1]
+            if u in settled:
+                continue
+            settled.add(u)
+            du = dist[u]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = targets[e]
+                dv = du + hours[e]
+                if dv < dist.get(v, math.inf):
+                    dist[v] = dv
+                    parent[v] = (u, e)
+                    heappush(heap, (dv + sign * potential(v), v))
+                    if v in other_dist and dv + other_dist[v] < best:
+                        best, meet = dv + other_dist[v], v
+
+        if meet is None:
+            return None
+
+        fwd_miles, rev_miles = self._fwd[3], self._rev[3]
+        nodes, miles = [meet], 0.0
+        step = searches[0][2][meet]
+        while step is not None:
+            u, e = step
+            nodes.append(u)
+            miles += fwd_miles[e]
+            step = searches[0][2][u]
+        nodes.reverse()
+        step = searches[1][2][meet]
+        while step is not None:
+            v, e = step
+            nodes.append(v)
+            miles += rev_miles[e]
+            step = searches[1][2][v]
+        return nodes, best, miles
+
+    def dijkstra(self, source, target):
+        """Plain one-directional Dijkstra; the reference for shortest_path."""
+        indptr, targets, hours, miles = self._fwd
+        dist = {source: 0.0}
+        parent = {source: None}
+        heap = [(0.0, source)]
+        settled = set()
+        while heap:
+            du, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in settled:
+                continue
+            settled.add(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = targets[e]
+                dv = du + hours[e]
+                if dv < dist.get(v, math.inf):
+                    dist[v] = dv
+                    parent[v] = (u, e)
+                    heapq.heappush(heap, (dv, v))
+        if target not in dist:
+            return None
+
+        nodes, total_miles = [target], 0.0
+        step = parent[target]
+        while step is not None:
+            u, e = step
+            nodes.append(u)
+            total_miles += miles[e]
+            step = parent[u]
+        nodes.reverse()
+        return nodes, dist[target], total_miles
+
+    def route(self, start_coords, end_coords, max_snap_miles=None):
+        """
+        Routes between two (lat, lng) points over the graph.
+        Returns {'distance_miles', 'duration_hours', 'polyline'} like ORS legs,
+        or None if either point is too far from the network or no path exists.
+        """
+        if max_snap_miles is None:
+            max_snap_miles = settings.ROAD_GRAPH_MAX_SNAP_MILES
+        source, source_snap = self.nearest_node(*start_coords)
+        target, target_snap = self.nearest_node(*end_coords)
+        if source_snap > max_snap_miles or target_snap > max_snap_miles:
+            return None
+
+        result = self.shortest_path(source, target)
+        if result is None:
+            return None
+        nodes, hours, miles = result
+
+        snap_miles = source_snap + target_snap
+        path = [tuple(start_coords)]
+        path.extend(zip(self.lats[nodes].tolist(), self.lngs[nodes].tolist()))
+        path.append(tuple(end_coords))
+        return {
+            'distance_miles': miles + snap_miles,
+            'duration_hours': hours + snap_miles / SNAP_SPEED_MPH,
+            'polyline': encode_polyline(path),
+        }
+
+
+def get_road_graph():
+    """Loads the graph at ROAD_GRAPH_PATH once per process; None if it is unavailable."""
+    global _graph
+    if _graph is MISSING:
+        with _graph_lock:
+            if _graph is MISSING:
+                try:
+                    _graph = RoadGraph.load(settings.ROAD_GRAPH_PATH)
+                except (OSError, KeyError, ValueError) as e:
+                    print(f"Road graph unavailable ({settings.ROAD_GRAPH_PATH}): {e}")
+                    _graph = None
+    return _graph
+
+
+def route_legs(waypoints):
+    """
+    Routes consecutive waypoints over the local road graph.
+    Returns one leg dict per pair, or None if any leg can't be routed.
+    """
+    graph = get_road_graph()
+    if graph is None:
+        return None
+    legs = []
+    for start, end in zip(waypoints, waypoints[1:]):
+        leg = graph.route(start, end)
+        if leg is None:
+            return None
+        legs.append(leg)
+    return legs
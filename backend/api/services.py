@@ -1,7 +1,24 @@
 import requests
+import math
 import os
+import threading
 import time
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+from itertools import permutations
+
+import numpy as np
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from . import gazetteer, metrics, resilience, routing, throttle
+from .cache import MISSING, TTLCache
+from .models import GeocodeCacheEntry, RouteCacheEntry
+from .utils import decode_polyline_arrays, encode_polyline, normalize_location
 
 load_dotenv()
 
@@ -10,41 +27,377 @@ ORS_MAX_RETRIES = 2     # retry up to 2 times on transient errors
 ORS_RETRY_BACKOFF = 2   # seconds (doubles each retry)
 GEOCODE_TIMEOUT = 15    # seconds
 
+NOMINATIM_URL = settings.NOMINATIM_URL
+ORS_DIRECTIONS_URL = settings.ORS_DIRECTIONS_URL
+ORS_MATRIX_URL = settings.ORS_MATRIX_URL
+USER_AGENT = 'TruckingLogisticsApp/1.0'
+
+# One keep-alive connection pool per process, so TLS handshakes aren't repeated per call
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=settings.EXTERNAL_IO_WORKERS))
+_http.headers['User-Agent'] = USER_AGENT
+
+# In-process tier of the geocode cache; misses fall through to GeocodeCacheEntry
+_geocode_cache = TTLCache(maxsize=settings.GEOCODE_CACHE_SIZE, ttl=settings.GEOCODE_CACHE_TTL)
+_geocode_counters = {
+    'gazetteer_hits': 0, 'db_hits': 0, 'db_misses': 0, 'negative_hits': 0, 'upstream_calls': 0, 'coalesced': 0,
+}
+# Concurrent lookups of one query share a Nominatim call; all calls respect the usage policy rate
+_geocode_flight = throttle.SingleFlight()
+nominatim_limiter = throttle.RateLimiter(
+    'nominatim',
+    rate=settings.NOMINATIM_RATE_LIMIT,
+    burst=settings.NOMINATIM_BURST,
+    max_queue=settings.NOMINATIM_QUEUE_SIZE,
+    max_wait=settings.NOMINATIM_MAX_WAIT,
+    state_path=settings.NOMINATIM_RATE_LIMIT_FILE,
+)
+_counters_lock = threading.Lock()
+
+# Compact in-memory route entry; the memory tier keeps stale entries for the SWR window
+CachedRoute = namedtuple('CachedRoute', ['distance_miles', 'duration_hours', 'polyline'])
+_route_cache = TTLCache(
+    maxsize=settings.ROUTE_CACHE_SIZE,
+    ttl=settings.ROUTE_CACHE_TTL + settings.ROUTE_CACHE_STALE_TTL
+)
+_route_counters = {
+    'stale_hits': 0, 'db_hits': 0, 'upstream_calls': 0, 'refreshes': 0, 'graph_routes': 0, 'graph_misses': 0,
+}
+# (miles, hours) between snapped point pairs, from ORS matrix requests
+_matrix_cache = TTLCache(maxsize=settings.MATRIX_CACHE_SIZE, ttl=settings.ROUTE_CACHE_TTL)
+_matrix_counters = {'route_hits': 0, 'upstream_calls': 0}
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='route-refresh')
+_refreshing = set()
+
+# Shared, bounded pool for fanning out geocoding/routing calls of a request
+_io_executor = ThreadPoolExecutor(
+    max_workers=settings.EXTERNAL_IO_WORKERS, thread_name_prefix='external-io'
+)
+
+# ORS resilience: one breaker, retry budget and latency window per process
+ors_breaker = resilience.CircuitBreaker('ors', settings.ORS_BREAKER_FAILURES, settings.ORS_BREAKER_RECOVERY)
+_ors_retry_budget = resilience.RetryBudget('ors', settings.ORS_RETRY_BUDGET_RATIO)
+_ors_latency = resilience.LatencyTracker()
+_hedge_executor = ThreadPoolExecutor(max_workers=settings.EXTERNAL_IO_WORKERS, thread_name_prefix='ors-hedge')
+
+
+def _io_task(fn):
+    """
+    Wraps fn for _io_executor: runs it in the request's context (metrics.bind)
+    and then closes the pool thread's DB connection if it is obsolete, as
+    _refresh_route does, so pool threads keep to CONN_MAX_AGE.
+    """
+    bound = metrics.bind(fn)
+
+    def run(*args):
+        try:
+            return bound(*args)
+        finally:
+            close_old_connections()
+    return run
+
+
+def _count(counters, name):
+    with _counters_lock:
+        counters[name] += 1
+
 
 def _get_ors_api_key():
     return os.getenv('ORS_API_KEY')
 
 
+def geocode_and_route(location_names):
+    """
+    Geocodes all locations concurrently, then routes every leg with a
+    single multi-waypoint request (or from the route cache).
+    Returns:
+        (coords, legs): coords has one (lat, lng) or None per location,
+        legs has one route dict or None per consecutive pair. If any location
+        fails to geocode, routing is skipped and legs is all None.
+    """
+    legs = [None] * max(len(location_names) - 1, 0)
+    coords = geocode_locations(location_names)
+    if not all(coords):
+        return coords, legs
+
+    with metrics.stage('route'):
+        route = get_route(coords)
+    if route:
+        legs = route['legs']
+    return coords, legs
+
+
+def geocode_locations(location_names):
+    """
+    Geocodes all locations concurrently. Returns one (lat, lng) or None per
+    location; once one fails the rest are not waited for (and stay None).
+    """
+    coords = [None] * len(location_names)
+    with metrics.stage('geocode'):
+        futures = {
+            _io_executor.submit(_io_task(geocode_location), name): i
+            for i, name in enumerate(location_names)
+        }
+        for future in as_completed(futures):
+            coords[futures[future]] = future.result()
+            if coords[futures[future]] is None:
+                break
+    return coords
+
+
+def iter_geocode_and_route(location_names):
+    """
+    Streaming counterpart of geocode_and_route. Yields ('geocode', index,
+    coords) as each location resolves and ('route', index, leg) as each leg
+    is routed. A leg whose endpoints resolve while other locations are still
+    geocoding is routed on its own straight away; the legs left when the last
+    location resolves go out in one multi-waypoint request. Stops after the
+    first None (failed geocode or leg).
+    """
+    coords = [None] * len(location_names)
+    leg_count = max(len(location_names) - 1, 0)
+    routed = set()
+    futures = {}
+    start = time.perf_counter()
+
+    def route_legs(first, last):
+        """Routes legs first..last (inclusive) in one request."""
+        routed.update(range(first, last + 1))
+        future = _io_executor.submit(_io_task(get_route), coords[first:last + 2])
+        futures[future] = ('route', first)
+
+    for i, name in enumerate(location_names):
+        futures[_io_executor.submit(_io_task(geocode_location), name)] = ('geocode', i)
+
+    geocoded_at = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            kind, i = futures.pop(future)
+            if kind == 'geocode':
+                coords[i] = future.result()
+                yield 'geocode', i, coords[i]
+                if coords[i] is None:
+                    return
+                if all(coords):
+                    geocoded_at = time.perf_counter()
+                    metrics.record_stage('geocode', geocoded_at - start)
+                    left = [leg for leg in range(leg_count) if leg not in routed]
+                    if left:
+                        route_legs(left[0], left[-1])
+                else:
+                    for leg in (i - 1, i):
+                        if 0 <= leg < leg_count and coords[leg] and coords[leg + 1]:
+                            route_legs(leg, leg)
+            else:
+                route = future.result()
+                for offset, leg in enumerate(route['legs'] if route else [None]):
+                    yield 'route', i + offset, leg
+                if route is None:
+                    return
+        pending = set(futures)
+    metrics.record_stage('route', time.perf_counter() - geocoded_at)
+
+
+def geocode_and_route_many(location_lists):
+    """
+    Batch version of geocode_and_route for many trips at once.
+    Identical location strings (after normalization) are geocoded once and
+    identical legs (after snapping) are routed once across the whole batch.
+    Returns a list of (coords, legs) tuples in input order.
+    """
+    unique_locations = {}
+    for names in location_lists:
+        for name in names:
+            unique_locations.setdefault(normalize_location(name), name)
+
+    with metrics.stage('geocode'):
+        geocode_futures = {
+            query: _io_executor.submit(_io_task(geocode_location), name)
+            for query, name in unique_locations.items()
+        }
+        geocoded = {query: future.result() for query, future in geocode_futures.items()}
+    all_coords = [[geocoded[normalize_location(name)] for name in names] for names in location_lists]
+
+    unique_legs = {}
+    for coords in all_coords:
+        if all(coords):
+            for start, end in zip(coords, coords[1:]):
+                unique_legs.setdefault(route_cache_key(start, end), (start, end))
+
+    with metrics.stage('route'):
+        leg_futures = {
+            key: _io_executor.submit(_io_task(get_route_details), start, end)
+            for key, (start, end) in unique_legs.items()
+        }
+        routed = {key: future.result() for key, future in leg_futures.items()}
+
+    results = []
+    for coords in all_coords:
+        legs = [None] * max(len(coords) - 1, 0)
+        if all(coords):
+            legs = [routed[route_cache_key(start, end)] for start, end in zip(coords, coords[1:])]
+        results.append((coords, legs))
+    return results
+
+
 def geocode_location(location_name):
     """
-    Geocodes a location name to (lat, lng) using Nominatim.
+    Geocodes a location name to (lat, lng).
+    Places in the local gazetteer are answered directly; everything else
+    goes to Nominatim, one call per query however many threads ask at once.
+    Results, including "not found", are cached in process and in the
+    GeocodeCacheEntry table shared by all workers.
+    """
+    query = normalize_location(location_name)[:255]
+    if not query:
+        return None
+
+    coords = gazetteer_lookup(query)
+    if coords is not None:
+        return coords
+
+    coords = _geocode_cache.get(query)
+    if coords is MISSING:
+        coords = _load_geocode_entry(query)
+    if coords is not MISSING:
+        if coords is None:
+            _count(_geocode_counters, 'negative_hits')
+        return coords
+
+    try:
+        coords, shared = _geocode_flight.do(query, partial(_geocode_upstream, location_name))
+    except Exception as e:
+        # Transient failures are not cached
+        print(f"Geocoding error: {e}")
+        return None
+    if shared:
+        _count(_geocode_counters, 'coalesced')
+    return coords
+
+
+def _geocode_upstream(location_name):
+    coords = fetch_geocode(location_name)
+    cache_geocode_result(location_name, coords)
+    return coords
+
+
+def gazetteer_lookup(query):
+    coords = gazetteer.lookup(query)
+    if coords is not None:
+        _count(_geocode_counters, 'gazetteer_hits')
+    return coords
+
+
+def fetch_geocode(location_name):
+    """
+    Queries Nominatim directly, waiting for a rate limiter slot first.
+    Returns (lat, lng), or None when there is no match.
+    Raises on transport/HTTP errors and throttle.RateLimitExceeded.
     """
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
+    nominatim_limiter.acquire()
+    timeout = resilience.attempt_timeout(GEOCODE_TIMEOUT)
+    if timeout is None:
+        raise requests.exceptions.Timeout('Request deadline reached before geocoding')
+    _count(_geocode_counters, 'upstream_calls')
+    try:
+        with metrics.stage('nominatim'):
+            response = _http.get(NOMINATIM_URL, params=_nominatim_params(location_name), timeout=timeout)
+            response.raise_for_status()
+    except Exception:
+        metrics.EXTERNAL_CALLS.inc(service='nominatim', outcome='error')
+        raise
+    metrics.EXTERNAL_CALLS.inc(service='nominatim', outcome='ok')
+    return _parse_geocode(response.json())
+
+
+def _nominatim_params(location_name):
+    return {
         'q': location_name,
         'format': 'json',
         'limit': 1
     }
-    headers = {
-        'User-Agent': 'TruckingLogisticsApp/1.0'
-    }
 
+
+def _parse_geocode(data):
+    if data:
+        return float(data[0]['lat']), float(data[0]['lon'])
+    return None
+
+
+def _geocode_ttl(coords):
+    return settings.GEOCODE_CACHE_TTL if coords is not None else settings.GEOCODE_NEGATIVE_CACHE_TTL
+
+
+def _load_geocode_entry(query):
+    """Reads the shared table; returns MISSING when absent or expired."""
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=GEOCODE_TIMEOUT)
-        response.raise_for_status()
-        data = response.json()
+        entry = GeocodeCacheEntry.objects.filter(query=query).first()
+    except DatabaseError as e:
+        print(f"Geocode cache read error: {e}")
+        return MISSING
 
-        if data:
-            return float(data[0]['lat']), float(data[0]['lon'])
-        return None
-    except Exception as e:
-        print(f"Geocoding error: {e}")
-        return None
+    coords = MISSING
+    if entry is not None:
+        age = (timezone.now() - entry.updated_at).total_seconds()
+        value = (entry.latitude, entry.longitude) if entry.found else None
+        ttl = _geocode_ttl(value)
+        if age < ttl:
+            coords = value
+            _geocode_cache.set(query, coords, ttl=ttl - age)
+
+    _count(_geocode_counters, 'db_misses' if coords is MISSING else 'db_hits')
+    return coords
+
+
+def cache_geocode_result(location_name, coords):
+    """Stores a geocode result (None for "not found") in both cache tiers."""
+    query = normalize_location(location_name)[:255]
+    if not query:
+        return
+    _geocode_cache.set(query, coords, ttl=_geocode_ttl(coords))
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            query=query,
+            defaults={
+                'latitude': coords[0] if coords else None,
+                'longitude': coords[1] if coords else None,
+                'found': coords is not None,
+            }
+        )
+    except DatabaseError as e:
+        print(f"Geocode cache write error: {e}")
+
+
+def geocode_cache_stats():
+    """Hit/miss counters for both geocode cache tiers."""
+    with _counters_lock:
+        counters = dict(_geocode_counters)
+    return {'memory': _geocode_cache.stats(), **counters}
+
+
+def clear_geocode_cache():
+    """Empties the in-process tier and resets counters (the shared table is kept)."""
+    _geocode_cache.clear()
+    with _counters_lock:
+        for name in _geocode_counters:
+            _geocode_counters[name] = 0
+
+
+def route_cache_key(start_coords, end_coords, precision=None):
+    """Snaps start/end coordinates to the cache grid, e.g. '41.878,-87.630;39.768,-86.158'."""
+    if precision is None:
+        precision = settings.ROUTE_CACHE_PRECISION
+    return ';'.join(
+        f"{lat:.{precision}f},{lng:.{precision}f}"
+        for lat, lng in (start_coords, end_coords)
+    )
 
 
 def get_route_details(start_coords, end_coords):
     """
-    Gets route details from OpenRouteService with retry logic.
+    Gets route details for a single leg (see get_route).
     Returns:
         dict: {
             'distance_miles': float,
@@ -53,66 +406,561 @@ def get_route_details(start_coords, end_coords):
         }
         or None on failure.
     """
-    ors_api_key = _get_ors_api_key()
-    if not ors_api_key:
-        raise ValueError("ORS_API_KEY not found in environment variables")
+    route = get_route([start_coords, end_coords])
+    return route['legs'][0] if route else None
 
-    url = "https://api.openrouteservice.org/v2/directions/driving-hgv"
-    headers = {
-        'Authorization': ors_api_key,
-        'Content-Type': 'application/json'
+
+def get_route(waypoints):
+    """
+    Routes through N waypoints in one OpenRouteService request.
+    Each leg is cached by its snapped start/end pair; when every leg is
+    cached no request is made. An expired leg is still returned immediately
+    while a background refresh fetches a new one (stale-while-revalidate).
+    Returns:
+        dict: {
+            'distance_miles': float,
+            'duration_hours': float,
+            'legs': [{'distance_miles', 'duration_hours', 'polyline'}, ...]
+        }
+        or None on failure.
+    """
+    pairs = list(zip(waypoints, waypoints[1:]))
+    keys = [route_cache_key(start, end) for start, end in pairs]
+
+    legs = []
+    for key, (start, end) in zip(keys, pairs):
+        leg = _get_cached_leg(key, start, end)
+        if leg is None:
+            break
+        legs.append(leg)
+    else:
+        return _combine_legs(legs)
+
+    legs = compute_route_legs(waypoints)
+    if not legs:
+        return None
+    for key, leg in zip(keys, legs):
+        cache_route_result(key, leg)
+    return _combine_legs(legs)
+
+
+def compute_route_legs(waypoints):
+    """
+    Routes waypoints with the configured backend, bypassing the cache.
+    With ROUTING_BACKEND = 'graph' the local road graph is tried first and
+    OpenRouteService is only called as a fallback.
+    """
+    legs = local_route_legs(waypoints)
+    if legs is not None:
+        return legs
+    if settings.ROUTING_BACKEND == 'graph' and not settings.ROUTING_ORS_FALLBACK:
+        return None
+    return fetch_route_legs(waypoints)
+
+
+def local_route_legs(waypoints):
+    """Routes over the local road graph if it is the configured backend; else None."""
+    if settings.ROUTING_BACKEND != 'graph':
+        return None
+    with metrics.stage('graph_route'):
+        legs = routing.route_legs(waypoints)
+    _count(_route_counters, 'graph_routes' if legs is not None else 'graph_misses')
+    return legs
+
+
+def _get_cached_leg(key, start_coords, end_coords):
+    """Returns a cached leg dict (scheduling a refresh if it is stale), or None."""
+    cached = _route_cache.get_with_age(key)
+    if cached is MISSING:
+        cached = _load_route_entry(key)
+    if cached is MISSING:
+        return None
+
+    route, age = cached
+    if age >= settings.ROUTE_CACHE_TTL:
+        _count(_route_counters, 'stale_hits')
+        _schedule_route_refresh(key, start_coords, end_coords)
+    return route._asdict()
+
+
+def _combine_legs(legs):
+    return {
+        'distance_miles': sum(leg['distance_miles'] for leg in legs),
+        'duration_hours': sum(leg['duration_hours'] for leg in legs),
+        'legs': legs,
     }
 
-    # ORS expects [lon, lat]
+
+def _load_route_entry(key):
+    """Reads the on-disk store; returns (CachedRoute, age) or MISSING."""
+    if not settings.ROUTE_CACHE_PERSIST:
+        return MISSING
+    try:
+        entry = RouteCacheEntry.objects.filter(key=key).first()
+    except DatabaseError as e:
+        print(f"Route cache read error: {e}")
+        return MISSING
+    if entry is None:
+        return MISSING
+
+    age = (timezone.now() - entry.updated_at).total_seconds()
+    remaining = settings.ROUTE_CACHE_TTL + settings.ROUTE_CACHE_STALE_TTL - age
+    if remaining <= 0:
+        return MISSING
+
+    route = CachedRoute(entry.distance_miles, entry.duration_hours, entry.polyline)
+    _route_cache.set(key, route, ttl=remaining, age=age)
+    _count(_route_counters, 'db_hits')
+    return route, age
+
+
+def cache_route_result(key, route):
+    """Stores a route in memory and, if enabled, in the on-disk store."""
+    cached = CachedRoute(route['distance_miles'], route['duration_hours'], route['polyline'])
+    _route_cache.set(key, cached)
+    if not settings.ROUTE_CACHE_PERSIST:
+        return
+    try:
+        RouteCacheEntry.objects.update_or_create(key=key, defaults=cached._asdict())
+    except DatabaseError as e:
+        print(f"Route cache write error: {e}")
+
+
+def _schedule_route_refresh(key, start_coords, end_coords):
+    with _counters_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresh_executor.submit(_refresh_route, key, start_coords, end_coords)
+
+
+def _refresh_route(key, start_coords, end_coords):
+    try:
+        legs = compute_route_legs([start_coords, end_coords])
+        if legs:
+            cache_route_result(key, legs[0])
+            _count(_route_counters, 'refreshes')
+    except Exception as e:
+        print(f"Route refresh error: {e}")
+    finally:
+        with _counters_lock:
+            _refreshing.discard(key)
+        close_old_connections()
+
+
+def route_cache_stats():
+    """Hit/miss counters for the route cache."""
+    with _counters_lock:
+        counters = dict(_route_counters)
+    return {'memory': _route_cache.stats(), **counters}
+
+
+def cache_dependencies(location_names, coords):
+    """
+    Snapshot of the cache entries a trip was planned from: the geocode
+    entry of each location and the route entry of each leg. Returns None if
+    any of them is not cached, since nothing would invalidate a result
+    built from it.
+    """
+    geocodes = [(normalize_location(name)[:255], coord) for name, coord in zip(location_names, coords)]
+    routes = []
+    for start, end in zip(coords, coords[1:]):
+        key = route_cache_key(start, end)
+        cached = _route_cache.peek(key)
+        if cached is MISSING or cached[1] >= settings.ROUTE_CACHE_TTL:
+            return None
+        routes.append((key, cached[0]))
+    if not all(_cached_geocode(query) == coord for query, coord in geocodes):
+        return None
+    return geocodes, routes
+
+
+def dependencies_current(dependencies):
+    """
+    True while every entry in a cache_dependencies() snapshot is still
+    cached, unchanged and fresh: a re-geocode, a route refresh, an eviction
+    or an expiry all invalidate it.
+    """
+    geocodes, routes = dependencies
+    for key, route in routes:
+        cached = _route_cache.peek(key)
+        if cached is MISSING or cached[0] is not route or cached[1] >= settings.ROUTE_CACHE_TTL:
+            return False
+    return all(_cached_geocode(query) == coord for query, coord in geocodes)
+
+
+def _cached_geocode(query):
+    """Current in-process answer for a normalized query, or MISSING."""
+    coords = gazetteer.lookup(query)
+    if coords is not None:
+        return coords
+    cached = _geocode_cache.peek(query)
+    return MISSING if cached is MISSING else cached[0]
+
+
+def clear_route_cache():
+    """Empties the in-process route cache and resets counters (the on-disk store is kept)."""
+    _route_cache.clear()
+    with _counters_lock:
+        for name in _route_counters:
+            _route_counters[name] = 0
+
+
+def get_distance_matrix(coords):
+    """
+    Road distance (miles) and driving time (hours) between every ordered
+    pair of points, as two n x n arrays; None if the matrix service fails.
+    Pairs are cached by their snapped coordinates (as routes are, and legs
+    already in the route cache are reused). Only the pairs not cached are
+    fetched, in at most two ORS matrix requests that cover them from a few
+    points, so adding one point to a known set costs O(n) lookups, not O(n^2).
+    """
+    n = len(coords)
+    distances = np.zeros((n, n))
+    durations = np.zeros((n, n))
+    missing = []
+    for i, j in permutations(range(n), 2):
+        pair = _cached_pair(route_cache_key(coords[i], coords[j]))
+        if pair is None:
+            missing.append((i, j))
+        else:
+            distances[i, j], durations[i, j] = pair
+
+    if missing:
+        new_points = _covering_points(missing)
+        everyone = list(range(n))
+        if 2 * len(new_points) >= n:
+            # Rows and columns of that many points cost as much as the full matrix
+            batches = [(everyone, everyone)]
+        else:
+            batches = [(new_points, everyone), (everyone, new_points)]
+        for sources, destinations in batches:
+            fetched = fetch_matrix(coords, sources, destinations)
+            if fetched is None:
+                return None
+            for (i, j), pair in fetched.items():
+                distances[i, j], durations[i, j] = pair
+                if i != j and pair[0] != math.inf:
+                    _matrix_cache.set(route_cache_key(coords[i], coords[j]), pair)
+    return distances, durations
+
+
+def get_distances_to(origins, destination):
+    """
+    Road distance (miles) and driving time (hours) from each origin to one
+    destination, as two arrays; None if the matrix service fails. Shares
+    the pair cache of get_distance_matrix; all uncached origins go out in
+    one matrix request.
+    """
+    miles = np.zeros(len(origins))
+    hours = np.zeros(len(origins))
+    missing = []
+    for i, origin in enumerate(origins):
+        pair = _cached_pair(route_cache_key(origin, destination))
+        if pair is None:
+            missing.append(i)
+        else:
+            miles[i], hours[i] = pair
+
+    if missing:
+        points = [origins[i] for i in missing] + [destination]
+        fetched = fetch_matrix(points, list(range(len(missing))), [len(missing)])
+        if fetched is None:
+            return None
+        for k, i in enumerate(missing):
+            miles[i], hours[i] = pair = fetched[k, len(missing)]
+            if pair[0] != math.inf:
+                _matrix_cache.set(route_cache_key(origins[i], destination), pair)
+    return miles, hours
+
+
+def _cached_pair(key):
+    """(miles, hours) for a snapped pair from the matrix or route cache, or None."""
+    pair = _matrix_cache.get(key)
+    if pair is not MISSING:
+        return pair
+    cached = _route_cache.peek(key)
+    if cached is not MISSING:
+        _count(_matrix_counters, 'route_hits')
+        route = cached[0]
+        return route.distance_miles, route.duration_hours
+    return None
+
+
+def _covering_points(pairs):
+    """
+    Few points such that each (i, j) pair has i or j among them (greedy
+    vertex cover): a new point joins every pair it is in, so a matrix that
+    gained one point only needs that point's row and column.
+    """
+    pairs = set(pairs)
+    points = []
+    while pairs:
+        counts = Counter(point for pair in pairs for point in pair)
+        point = max(sorted(counts), key=counts.__getitem__)
+        points.append(point)
+        pairs = {pair for pair in pairs if point not in pair}
+    return sorted(points)
+
+
+def fetch_matrix(coords, sources, destinations):
+    """
+    One ORS matrix request, bypassing the cache. Calls fail fast while the
+    ORS circuit breaker is open and are not retried: callers can do without
+    a matrix. Returns {(source, destination): (miles, hours)} over indices
+    into coords (math.inf for unroutable pairs), or None on failure.
+    """
+    try:
+        headers = _ors_headers()
+    except ValueError as e:
+        print(f"Matrix error: {e}")
+        return None
+    # Deadline first, so no half-open probe is taken for a call that won't be sent
+    timeout = resilience.attempt_timeout(ORS_TIMEOUT)
+    if timeout is None:
+        print("Matrix abandoned: request deadline reached")
+        return None
+    if not ors_breaker.allow():
+        print("Matrix skipped: ORS circuit breaker is open")
+        return None
     body = {
-        "coordinates": [
-            [start_coords[1], start_coords[0]],
-            [end_coords[1], end_coords[0]]
-        ]
+        'locations': [[lng, lat] for lat, lng in coords],
+        'sources': sources,
+        'destinations': destinations,
+        'metrics': ['distance', 'duration'],
+        'units': 'mi',
     }
-
-    last_error = None
-    for attempt in range(1 + ORS_MAX_RETRIES):
-        try:
-            response = requests.post(url, json=body, headers=headers, timeout=ORS_TIMEOUT)
+    _count(_matrix_counters, 'upstream_calls')
+    try:
+        with metrics.stage('ors'):
+            response = _http.post(ORS_MATRIX_URL, json=body, headers=headers, timeout=timeout)
             response.raise_for_status()
-            data = response.json()
+        data = response.json()
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        ors_breaker.record_failure()
+        metrics.EXTERNAL_CALLS.inc(service='ors_matrix', outcome='error')
+        print(f"Matrix error (timeout/connection): {e}")
+        return None
+    except requests.exceptions.HTTPError as e:
+        metrics.EXTERNAL_CALLS.inc(service='ors_matrix', outcome='error')
+        status_code = e.response.status_code if e.response is not None else None
+        if status_code in (502, 503, 504):
+            ors_breaker.record_failure()
+        else:
+            # Non-transient HTTP error (4xx, etc.) — ORS is up
+            ors_breaker.record_success()
+        print(f"Matrix error ({status_code}): {e}")
+        return None
+    except Exception as e:
+        ors_breaker.release()
+        metrics.EXTERNAL_CALLS.inc(service='ors_matrix', outcome='error')
+        print(f"Matrix error (unexpected): {e}")
+        return None
+    ors_breaker.record_success()
+    metrics.EXTERNAL_CALLS.inc(service='ors_matrix', outcome='ok')
 
-            route = data['routes'][0]
-            summary = route['summary']
+    pairs = {}
+    for i, distance_row, duration_row in zip(sources, data['distances'], data['durations']):
+        for j, miles, seconds in zip(destinations, distance_row, duration_row):
+            if miles is None or seconds is None:
+                pairs[i, j] = (math.inf, math.inf)
+            else:
+                pairs[i, j] = (float(miles), float(seconds) / 3600)
+    return pairs
 
-            # Convert distance (meters) to miles
-            distance_miles = summary['distance'] * 0.000621371
 
-            # Convert duration (seconds) to hours
-            duration_hours = summary['duration'] / 3600
+def matrix_cache_stats():
+    """Hit/miss counters of the pairwise distance cache."""
+    with _counters_lock:
+        counters = dict(_matrix_counters)
+    return {'memory': _matrix_cache.stats(), **counters}
 
-            return {
-                'distance_miles': distance_miles,
-                'duration_hours': duration_hours,
-                'polyline': route['geometry']
-            }
+
+def clear_matrix_cache():
+    """Empties the pairwise distance cache and resets counters."""
+    _matrix_cache.clear()
+    with _counters_lock:
+        for name in _matrix_counters:
+            _matrix_counters[name] = 0
+
+
+def fetch_route(start_coords, end_coords):
+    """
+    Gets route details for one leg from OpenRouteService, bypassing the cache.
+    Returns the same dict as get_route_details, or None on failure.
+    """
+    legs = fetch_route_legs([start_coords, end_coords])
+    return legs[0] if legs else None
+
+
+def fetch_route_legs(waypoints):
+    """
+    Gets a multi-waypoint route from OpenRouteService with retry logic.
+    Calls fail fast while the ORS circuit breaker is open. Retries use
+    jittered backoff, draw on a shared retry budget and stop at the
+    request deadline.
+    Returns one {'distance_miles', 'duration_hours', 'polyline'} dict per leg,
+    or None on failure.
+    """
+    try:
+        headers = _ors_headers()
+    except ValueError as e:
+        print(f"Routing error: {e}")
+        return None
+    body = _ors_body(waypoints)
+    _ors_retry_budget.deposit()
+
+    last_error = None
+    for attempt in range(1 + ORS_MAX_RETRIES):
+        # Deadline first, so no half-open probe is taken for a call that won't be sent
+        timeout = resilience.attempt_timeout(ORS_TIMEOUT)
+        if timeout is None:
+            print("Routing abandoned: request deadline reached")
+            return None
+        if not ors_breaker.allow():
+            print("Routing skipped: ORS circuit breaker is open")
+            return None
+
+        try:
+            _count(_route_counters, 'upstream_calls')
+            with metrics.stage('ors'):
+                response = _send_ors(body, headers, timeout)
+            ors_breaker.record_success()
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='ok')
+            return _parse_route_legs(response.json(), len(waypoints) - 1)
         except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            ors_breaker.record_failure()
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='error')
             last_error = e
             print(f"Routing attempt {attempt + 1}/{1 + ORS_MAX_RETRIES} failed (timeout/connection): {e}")
         except requests.exceptions.HTTPError as e:
+            metrics.EXTERNAL_CALLS.inc(service='ors', outcome='error')
             last_error = e
             status_code = e.response.status_code if e.response is not None else None
             if status_code in (502, 503, 504):
+                ors_breaker.record_failure()
                 print(f"Routing attempt {attempt + 1}/{1 + ORS_MAX_RETRIES} failed ({status_code}): {e}")
             else:
-                # Non-transient HTTP error (4xx, etc.) — don't retry
+                # Non-transient HTTP error (4xx, etc.) — ORS is up, don't retry
+                ors_breaker.record_success()
                 print(f"Routing error (non-retryable {status_code}): {e}")
                 return None
         except Exception as e:
+            ors_breaker.release()
             print(f"Routing error (unexpected): {e}")
             return None
 
         # Backoff before next retry
         if attempt < ORS_MAX_RETRIES:
-            wait = ORS_RETRY_BACKOFF * (2 ** attempt)
-            print(f"Retrying in {wait}s...")
-            time.sleep(wait)
+            delay = resilience.backoff_delay(attempt, ORS_RETRY_BACKOFF)
+            left = resilience.remaining()
+            if left is not None and left < delay + 1:
+                print("Not retrying: request deadline too close")
+                break
+            if not _ors_retry_budget.try_spend():
+                print("Not retrying: ORS retry budget exhausted")
+                break
+            print(f"Retrying in {delay:.2f}s...")
+            metrics.EXTERNAL_RETRIES.inc(service='ors')
+            with metrics.stage('ors_backoff'):
+                time.sleep(delay)
 
-    print(f"Routing failed after {1 + ORS_MAX_RETRIES} attempts. Last error: {last_error}")
+    print(f"Routing failed after {attempt + 1} attempts. Last error: {last_error}")
     return None
+
+
+def _send_ors(body, headers, timeout):
+    """
+    POSTs a directions request; raises on transport and HTTP errors.
+    With ORS_HEDGE, a second identical request is sent if the first is
+    slower than the recent p95, and the first success wins.
+    """
+    post = partial(_post_ors, body, headers, timeout)
+    if settings.ORS_HEDGE:
+        p95 = _ors_latency.percentile(95)
+        if p95 is not None and p95 < timeout:
+            return resilience.hedged(post, max(p95, settings.ORS_HEDGE_MIN_DELAY), _hedge_executor, 'ors')
+    return post()
+
+
+def _post_ors(body, headers, timeout):
+    start = time.monotonic()
+    response = _http.post(ORS_DIRECTIONS_URL, json=body, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    _ors_latency.observe(time.monotonic() - start)
+    return response
+
+
+def _ors_headers():
+    ors_api_key = _get_ors_api_key()
+    if not ors_api_key:
+        raise ValueError("ORS_API_KEY not found in environment variables")
+    return {
+        'Authorization': ors_api_key,
+        'Content-Type': 'application/json'
+    }
+
+
+def _ors_body(waypoints):
+    # ORS expects [lon, lat]
+    return {
+        "coordinates": [[lng, lat] for lat, lng in waypoints]
+    }
+
+
+def _parse_route_legs(data, leg_count):
+    """
+    Splits an ORS directions response into per-leg summaries and geometries,
+    using the route's segments and way_points (vertex indices of each waypoint).
+    Raises ValueError if they don't match leg_count, so the call is treated
+    as a routing failure instead of returning too few legs.
+    """
+    route = data['routes'][0]
+    if leg_count == 1:
+        summaries = [route['summary']]
+    else:
+        summaries = route['segments']
+        way_points = route['way_points']
+        if len(summaries) != leg_count or len(way_points) != leg_count + 1:
+            raise ValueError(
+                f'ORS returned {len(summaries)} segments and {len(way_points)} way points for {leg_count} legs'
+            )
+
+    if leg_count == 1:
+        polylines = [route['geometry']]
+    else:
+        lats, lngs = decode_polyline_arrays(route['geometry'])
+        polylines = [
+            encode_polyline(zip(lats[a:b + 1].tolist(), lngs[a:b + 1].tolist()))
+            for a, b in zip(way_points, way_points[1:])
+        ]
+
+    return [
+        {
+            # Convert distance (meters) to miles
+            'distance_miles': summary.get('distance', 0.0) * 0.000621371,
+            # Convert duration (seconds) to hours
+            'duration_hours': summary.get('duration', 0.0) / 3600,
+            'polyline': polyline
+        }
+        for summary, polyline in zip(summaries, polylines)
+    ]
+
+
+def _cache_metrics():
+    """Scrape-time view of the geocode and route cache counters."""
+    events, entries = [], []
+    caches = (('geocode', geocode_cache_stats()), ('route', route_cache_stats()), ('matrix', matrix_cache_stats()))
+    for cache, stats in caches:
+        memory = stats.pop('memory')
+        entries.append(({'cache': cache}, memory['size']))
+        for event in ('hits', 'misses', 'evictions'):
+            events.append(({'cache': cache, 'event': f'memory_{event}'}, memory[event]))
+        events.extend(({'cache': cache, 'event': event}, value) for event, value in stats.items())
+    return [
+        ('trucking_cache_events_total', 'counter', 'Geocode/route/matrix cache events since the last reset.', events),
+        ('trucking_cache_entries', 'gauge', 'Entries in the in-process caches.', entries),
+    ]
+
+
+metrics.register_collector(_cache_metrics)
@@ -0,0 +1,133 @@
+import contextvars
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import status
+
+from . import metrics, resilience, response_cache
+from .services import iter_geocode_and_route
+from .trips import (
+    GEOCODE_ERROR, ROUTING_ERROR, PlannedTrip, locate_trip_stops, plan_trip_segments, publish_trip_plan,
+    render_timeline, simplified_polyline
+)
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+SSE_MEDIA_TYPE = 'text/event-stream'
+
+
+def trip_events(locations, hours_used, layout='rows', zoom=None, log_sheets=False):
+    """
+    Plans a trip like CalculateTripView, yielding (event, data) as each stage
+    completes:
+      geocode   {index, location, latitude, longitude}, once per location
+      route     {index, distance_miles, duration_hours, polyline}, once per leg
+      segments  the HOS timeline (in `layout`), total_trip_hours, available_hours
+      stops     [{index, latitude, longitude}] for the non-driving segments
+      plan      the complete trip response (as /api/calculate-trip/ returns it)
+    or a final error {error, status}. A cached response is sent as just `plan`.
+    """
+    key = response_cache.trip_key(locations, hours_used, layout, zoom, log_sheets)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield 'plan', json.loads(cached.body)
+        return
+
+    coords = [None] * len(locations)
+    routes = [None] * (len(locations) - 1)
+    for kind, index, result in iter_geocode_and_route(locations):
+        if result is None:
+            if kind == 'geocode':
+                yield 'error', {'error': GEOCODE_ERROR, 'status': status.HTTP_400_BAD_REQUEST}
+            else:
+                yield 'error', {'error': ROUTING_ERROR, 'status': status.HTTP_503_SERVICE_UNAVAILABLE}
+            return
+        if kind == 'geocode':
+            coords[index] = result
+            yield 'geocode', {
+                'index': index, 'location': locations[index], 'latitude': result[0], 'longitude': result[1]
+            }
+        else:
+            routes[index] = result
+            polyline = result['polyline']
+            if zoom is not None:
+                with metrics.stage('simplify'):
+                    polyline = simplified_polyline(polyline, zoom)
+            yield 'route', {
+                'index': index,
+                'distance_miles': result['distance_miles'],
+                'duration_hours': result['duration_hours'],
+                'polyline': polyline,
+            }
+
+    # The stages of trips.plan_trip, with the timeline sent before stops are placed
+    try:
+        segments, cycle_hours_consumed = plan_trip_segments(routes, hours_used)
+    except ValueError as e:
+        yield 'error', {'error': str(e), 'status': status.HTTP_400_BAD_REQUEST}
+        return
+    yield 'segments', render_timeline(segments, hours_used, cycle_hours_consumed, layout)
+
+    geometry = locate_trip_stops(routes, segments)
+    yield 'stops', [
+        {'index': i, 'latitude': segment.latitude, 'longitude': segment.longitude}
+        for i, segment in enumerate(segments) if segment.latitude is not None
+    ]
+
+    planned = PlannedTrip(routes, hours_used, segments, geometry, cycle_hours_consumed)
+    plan = publish_trip_plan(locations, planned, layout, zoom, log_sheets)
+    response_cache.put(key, plan, locations, coords)
+    yield 'plan', plan
+
+
+def in_request_context(events):
+    """
+    Runs each step of an event generator in one private context with its own
+    request deadline and stage timings. A streamed body is produced after the
+    middleware has finished, possibly from other threads; this keeps the
+    deadline and timings of the stream together across yields. The final
+    event gets the stage timings as `timings` (ms per stage).
+    """
+    context = contextvars.copy_context()
+
+    def start():
+        return metrics.start_request(), resilience.set_deadline(settings.REQUEST_DEADLINE)
+
+    def finish(tokens):
+        resilience.reset_deadline(tokens[1])
+        return metrics.finish_request(tokens[0])
+
+    tokens = context.run(start)
+    try:
+        while True:
+            try:
+                event, data = context.run(next, events)
+            except StopIteration:
+                return
+            if event in ('plan', 'error'):
+                timings = context.run(finish, tokens)
+                tokens = None
+                data = dict(data, timings={name: round(seconds * 1000, 1) for name, (seconds, _) in timings.items()})
+            yield event, data
+    finally:
+        context.run(events.close)
+        if tokens is not None:
+            context.run(finish, tokens)
+
+
+def encode_ndjson(events):
+    for event, data in events:
+        yield json.dumps({'event': event, 'data': data}).encode() + b'\n'
+
+
+def encode_sse(events):
+    for event, data in events:
+        yield f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+async def aiterate(iterator):
+    """Steps a blocking iterator in worker threads, so ASGI servers can stream it without buffering."""
+    step = sync_to_async(next, thread_sensitive=False)
+    done = object()
+    while (item := await step(iterator, done)) is not done:
+        yield item
@@ -1,5 +1,37 @@
 from django.test import TestCase
-from .utils import calculate_trip_segments
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+import httpx
+import msgpack
+import numpy as np
+
+from . import (
+    async_services, dispatch, eld, gazetteer, jobs, metrics, resilience, response_cache, routing, services, throttle,
+    tour, trips
+)
+from .cache import MISSING, SizedLRUCache, TTLCache
+from .models import GeocodeCacheEntry, RouteCacheEntry, TripJob, TripPlan
+from .utils import (
+    RouteGeometry, calculate_trip_segments, calculate_trip_segments_batch, decode_polyline, decode_polyline_arrays,
+    encode_polyline, get_coordinate_at_distance, haversine_distance, haversine_segments, haversine_to,
+    HOSState, plan_multi_stop_segments, plan_segments, resume_segments, Segment, SegmentStatus, simplify_path,
+    simplify_polyline, zoom_tolerance
+)
 
 class HOSLogicTestCase(TestCase):
     def test_short_trip_no_breaks(self):
@@ -77,3 +109,2189 @@ class HOSLogicTestCase(TestCase):
         else:
             # Check if total consumed <= 2.1 (allow float variance)
             self.assertLessEqual(hours_consumed, 2.1)
+
+
+class RouteGeometryTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        lat, lng = 41.88, -87.63
+        self.path = [(lat, lng)]
+        for _ in range(500):
+            lat += rng.uniform(-0.02, 0.01)
+            lng += rng.uniform(0.0, 0.03)
+            self.path.append((round(lat, 5), round(lng, 5)))
+        # Duplicate vertex -> zero-length segment
+        self.path.insert(100, self.path[100])
+        self.geometry = RouteGeometry(self.path)
+
+    def test_matches_linear_walk(self):
+        """
+        Every lookup must return the same coordinate as get_coordinate_at_distance,
+        including before the start, on vertices and past the end.
+        """
+        total = self.geometry.total_miles
+        targets = [-5.0, 0.0, 0.001, total / 3, total / 2, total - 0.001, total, total + 10]
+        targets += self.geometry.cumulative[1:50].tolist()
+        for target in targets:
+            self.assertEqual(
+                self.geometry.coordinate_at(target),
+                get_coordinate_at_distance(self.path, target)
+            )
+
+    def test_sweep_matches_individual_lookups(self):
+        total = self.geometry.total_miles
+        distances = sorted(random.Random(7).uniform(0, total * 1.1) for _ in range(200))
+        distances = [0.0] + distances
+        expected = [get_coordinate_at_distance(self.path, d) for d in distances]
+        self.assertEqual(self.geometry.coordinates_at(distances), expected)
+
+    def test_locate_stops(self):
+        segments, _ = plan_segments(self.geometry.total_miles, 0)
+        self.geometry.locate_stops(segments)
+
+        driven_dist = 0.0
+        for segment in segments:
+            if segment.status == SegmentStatus.DRIVING:
+                driven_dist += segment.distance_miles
+                self.assertIsNone(segment.latitude)
+            else:
+                coord = get_coordinate_at_distance(self.path, driven_dist)
+                self.assertEqual((segment.latitude, segment.longitude), coord)
+
+    def test_saved_cumulative_distances(self):
+        polyline = encode_polyline(self.path)
+        geometry = RouteGeometry.from_polylines(polyline)
+        restored = RouteGeometry.from_polylines(polyline, cumulative=geometry.cumulative_bytes())
+        self.assertEqual(restored.path, geometry.path)
+        self.assertEqual(restored.total_miles, geometry.total_miles)
+        targets = [0, 1.5, 7.25, geometry.total_miles]
+        for actual, expected in zip(restored.coordinates_at(targets), geometry.coordinates_at(targets)):
+            self.assertAlmostEqual(actual[0], expected[0])
+            self.assertAlmostEqual(actual[1], expected[1])
+        with self.assertRaises(ValueError):
+            RouteGeometry.from_polylines(polyline, polyline, cumulative=geometry.cumulative_bytes())
+
+    def test_degenerate_paths(self):
+        self.assertIsNone(RouteGeometry([]).coordinate_at(10))
+        single = RouteGeometry([(40.0, -80.0)])
+        self.assertEqual(single.coordinate_at(0), (40.0, -80.0))
+        self.assertEqual(single.coordinate_at(10), (40.0, -80.0))
+        self.assertEqual(single.total_miles, 0.0)
+
+
+class PolylineKernelTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        lat, lng = 35.0, -100.0
+        self.path = []
+        for _ in range(2000):
+            lat += rng.uniform(-0.5, 0.5)
+            lng += rng.uniform(-0.5, 0.5)
+            self.path.append((round(lat, 5), round(lng, 5)))
+        self.encoded = encode_polyline(self.path)
+
+    def test_encode_round_trip(self):
+        self.assertEqual(decode_polyline(self.encoded), self.path)
+
+    def test_array_decode_matches_list_decode(self):
+        lats, lngs = decode_polyline_arrays(self.encoded)
+        self.assertEqual(lats.dtype.name, 'float64')
+        self.assertTrue(lats.flags['C_CONTIGUOUS'])
+        self.assertEqual(list(zip(lats.tolist(), lngs.tolist())), decode_polyline(self.encoded))
+
+    def test_array_decode_empty(self):
+        lats, lngs = decode_polyline_arrays('')
+        self.assertEqual(lats.size, 0)
+        self.assertEqual(lngs.size, 0)
+
+    def test_segment_lengths_match_scalar(self):
+        lats, lngs = decode_polyline_arrays(self.encoded)
+        lengths = haversine_segments(lats, lngs)
+        self.assertEqual(lengths.size, len(self.path) - 1)
+        for k, (p1, p2) in enumerate(zip(self.path, self.path[1:])):
+            self.assertAlmostEqual(lengths[k], haversine_distance(p1[0], p1[1], p2[0], p2[1]), places=9)
+
+    def test_geometry_from_polylines(self):
+        half = len(self.path) // 2
+        geometry = RouteGeometry.from_polylines(
+            encode_polyline(self.path[:half]), encode_polyline(self.path[half:])
+        )
+        reference = RouteGeometry(self.path)
+        self.assertAlmostEqual(geometry.total_miles, reference.total_miles, places=6)
+        for target in [0, 1.5, 250, reference.total_miles / 2, reference.total_miles + 1]:
+            lat, lng = geometry.coordinate_at(target)
+            ref_lat, ref_lng = get_coordinate_at_distance(self.path, target)
+            self.assertAlmostEqual(lat, ref_lat, places=6)
+            self.assertAlmostEqual(lng, ref_lng, places=6)
+
+
+class SimplificationTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(5)
+        lat, lng = 41.8781, -87.6298
+        path = []
+        for _ in range(20000):
+            lat += rng.uniform(-0.004, 0.003)
+            lng += rng.uniform(-0.001, 0.006)
+            path.append((lat, lng))
+        self.encoded = encode_polyline(path)
+        self.lats, self.lngs = decode_polyline_arrays(self.encoded)
+
+    def test_zoom_tolerance(self):
+        self.assertAlmostEqual(zoom_tolerance(0), 360 / 256)
+        self.assertAlmostEqual(zoom_tolerance(10), zoom_tolerance(9) / 2)
+        self.assertAlmostEqual(zoom_tolerance(10, pixels=2), zoom_tolerance(9))
+
+    def test_keeps_endpoints_and_stays_within_tolerance(self):
+        tolerance = zoom_tolerance(8)
+        keep = simplify_path(self.lats, self.lngs, tolerance)
+        self.assertEqual(keep[0], 0)
+        self.assertEqual(keep[-1], self.lats.size - 1)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+
+        # Every dropped vertex lies within tolerance of its simplified span
+        scale = np.cos(np.radians(self.lats.mean()))
+        x, y = self.lngs * scale, self.lats
+        for first, last in zip(keep[:-1], keep[1:]):
+            dx, dy = x[last] - x[first], y[last] - y[first]
+            px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+            distances = np.abs(px * dy - py * dx) / np.hypot(dx, dy)
+            self.assertTrue(np.all(distances <= tolerance + 1e-12))
+
+    def test_lower_zoom_drops_more_vertices(self):
+        counts = [simplify_path(self.lats, self.lngs, zoom_tolerance(z)).size for z in (4, 8, 12)]
+        self.assertLess(counts[0], counts[1])
+        self.assertLess(counts[1], counts[2])
+
+    def test_polyline_payload_shrinks(self):
+        simplified = simplify_polyline(self.encoded, zoom_tolerance(6))
+        self.assertLess(len(simplified) * 10, len(self.encoded))
+        self.assertEqual(decode_polyline(simplified)[0], decode_polyline(self.encoded)[0])
+        self.assertEqual(decode_polyline(simplified)[-1], decode_polyline(self.encoded)[-1])
+
+    def test_short_paths_unchanged(self):
+        encoded = encode_polyline([(41.0, -87.0), (41.5, -86.0)])
+        self.assertEqual(simplify_polyline(encoded, 1.0), encoded)
+
+
+class TTLCacheTestCase(TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now least recently used
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('a', None, ttl=0.01)
+        self.assertIsNone(cache.get('a'))
+        time.sleep(0.02)
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+def nominatim_response(results):
+    response = mock.Mock()
+    response.json.return_value = results
+    response.raise_for_status.return_value = None
+    return response
+
+
+@mock.patch.object(services.nominatim_limiter, 'rate', 0)
+@override_settings(GAZETTEER_PATH='')
+class GeocodeCacheTestCase(TestCase):
+    def setUp(self):
+        services.clear_geocode_cache()
+
+    def tearDown(self):
+        services.clear_geocode_cache()
+
+    @mock.patch('api.services._http.get')
+    def test_memory_and_db_tiers(self, mock_get):
+        mock_get.return_value = nominatim_response([{'lat': '41.8781', 'lon': '-87.6298'}])
+
+        self.assertEqual(services.geocode_location('Chicago, IL'), (41.8781, -87.6298))
+        # Same normalized query is served from memory
+        self.assertEqual(services.geocode_location('  chicago   il '), (41.8781, -87.6298))
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(GeocodeCacheEntry.objects.filter(query='chicago il', found=True).exists())
+        self.assertEqual(services.geocode_cache_stats()['memory']['hits'], 1)
+
+        # A fresh process (empty memory tier) is served from the shared table
+        services.clear_geocode_cache()
+        self.assertEqual(services.geocode_location('Chicago, IL'), (41.8781, -87.6298))
+        self.assertEqual(mock_get.call_count, 1)
+
+        stats = services.geocode_cache_stats()
+        self.assertEqual(stats['upstream_calls'], 0)
+        self.assertEqual(stats['db_hits'], 1)
+
+    @mock.patch('api.services._http.get')
+    def test_negative_results_are_cached(self, mock_get):
+        mock_get.return_value = nominatim_response([])
+
+        self.assertIsNone(services.geocode_location('Nowhereville'))
+        self.assertIsNone(services.geocode_location('nowhereville'))
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(GeocodeCacheEntry.objects.filter(query='nowhereville', found=False).exists())
+        self.assertEqual(services.geocode_cache_stats()['negative_hits'], 1)
+
+    @mock.patch('api.services._http.get')
+    def test_errors_are_not_cached(self, mock_get):
+        mock_get.side_effect = services.requests.exceptions.Timeout('slow')
+        self.assertIsNone(services.geocode_location('Indianapolis, IN'))
+
+        mock_get.side_effect = None
+        mock_get.return_value = nominatim_response([{'lat': '39.7684', 'lon': '-86.1581'}])
+        self.assertEqual(services.geocode_location('Indianapolis, IN'), (39.7684, -86.1581))
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch('api.services._http.get')
+    def test_warm_command(self, mock_get):
+        mock_get.return_value = nominatim_response([{'lat': '36.1627', 'lon': '-86.7816'}])
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('location,latitude,longitude\n')
+            f.write('Terminal 7 Gary IN,41.6,-87.3\n')
+            f.write('Nashville TN,,\n')
+        self.addCleanup(os.remove, f.name)
+
+        out = io.StringIO()
+        call_command('warm_geocode_cache', f.name, delay=0, stdout=out)
+        self.assertIn('2 stored, 0 already cached, 0 failed', out.getvalue())
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(services.geocode_location('terminal 7, gary, in'), (41.6, -87.3))
+        self.assertEqual(services.geocode_location('Nashville, TN'), (36.1627, -86.7816))
+        self.assertEqual(mock_get.call_count, 1)
+
+
+class GazetteerTestCase(TestCase):
+    rows = [
+        {'name': 'Chicago, IL', 'latitude': '41.8781', 'longitude': '-87.6298', 'rank': '2665',
+         'aliases': 'Chicago, Illinois'},
+        {'name': 'Chicopee, MA', 'latitude': '42.1487', 'longitude': '-72.6079', 'rank': '55'},
+        {'name': 'Acme Terminal 7, Gary, IN', 'latitude': '41.6', 'longitude': '-87.35', 'kind': 'facility'},
+    ]
+
+    def setUp(self):
+        self.gazetteer = gazetteer.Gazetteer(gazetteer.parse_place(row) for row in self.rows)
+
+    def test_lookup_is_normalized(self):
+        self.assertEqual(self.gazetteer.lookup('  chicago,  il '), (41.8781, -87.6298))
+        self.assertEqual(self.gazetteer.lookup('CHICAGO ILLINOIS'), (41.8781, -87.6298))
+        self.assertIsNone(self.gazetteer.lookup('Chicago'))
+
+    def test_suggest_ranks_and_dedupes(self):
+        names = [place.name for place in self.gazetteer.suggest('chic')]
+        self.assertEqual(names, ['Chicago, IL', 'Chicopee, MA'])
+        self.assertEqual([p.name for p in self.gazetteer.suggest('Chicago, Illin')], ['Chicago, IL'])
+        self.assertEqual([p.kind for p in self.gazetteer.suggest('acme terminal 7')], ['facility'])
+        self.assertEqual(self.gazetteer.suggest('chic', limit=1)[0].name, 'Chicago, IL')
+        self.assertEqual(self.gazetteer.suggest('zz'), [])
+        self.assertEqual(self.gazetteer.suggest(''), [])
+
+    def test_load_csv_and_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'places.sqlite')
+            connection = sqlite3.connect(db_path)
+            connection.execute('CREATE TABLE places (name TEXT, latitude REAL, longitude REAL)')
+            connection.execute("INSERT INTO places VALUES ('Gary, IN', 41.5934, -87.3464)")
+            connection.commit()
+            connection.close()
+            self.assertEqual(gazetteer.Gazetteer.load(db_path).lookup('gary in'), (41.5934, -87.3464))
+
+        bundled = gazetteer.get_gazetteer()
+        self.assertGreater(len(bundled), 40)
+        self.assertEqual(bundled.lookup('Nashville, TN'), (36.1627, -86.7816))
+
+    @mock.patch('api.services._http.get')
+    def test_geocode_skips_nominatim_for_known_places(self, mock_get):
+        services.clear_geocode_cache()
+        self.assertEqual(services.geocode_location('Indianapolis, Indiana'), (39.7684, -86.1581))
+        self.assertFalse(mock_get.called)
+        self.assertEqual(services.geocode_cache_stats()['gazetteer_hits'], 1)
+
+    def test_autocomplete_endpoint(self):
+        response = self.client.get('/api/locations/autocomplete/', {'q': 'san', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['name'] for r in results], ['San Antonio, TX', 'San Diego, CA'])
+        self.assertEqual(set(results[0]), {'name', 'latitude', 'longitude', 'kind', 'rank'})
+        self.assertEqual(self.client.get('/api/locations/autocomplete/').json(), {'results': []})
+        self.assertEqual(self.client.get('/api/locations/autocomplete/', {'limit': 'x'}).status_code, 400)
+
+
+def ors_response(distance_m=297000.0, duration_s=11000.0, geometry='_p~iF~ps|U_ulLnnqC'):
+    response = mock.Mock()
+    response.json.return_value = {
+        'routes': [{
+            'summary': {'distance': distance_m, 'duration': duration_s},
+            'geometry': geometry,
+        }]
+    }
+    response.raise_for_status.return_value = None
+    return response
+
+
+@mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+class RouteCacheTestCase(TestCase):
+    chicago = (41.8781, -87.6298)
+    indianapolis = (39.7684, -86.1581)
+
+    def setUp(self):
+        services.clear_route_cache()
+
+    def tearDown(self):
+        services.clear_route_cache()
+
+    def test_cache_key_snapping(self):
+        key = services.route_cache_key(self.chicago, self.indianapolis, precision=2)
+        self.assertEqual(key, '41.88,-87.63;39.77,-86.16')
+        nearby = (41.8779, -87.6301)
+        self.assertEqual(
+            services.route_cache_key(nearby, self.indianapolis),
+            services.route_cache_key(self.chicago, self.indianapolis)
+        )
+
+    @mock.patch('api.services._http.post')
+    def test_repeat_lane_skips_network(self, mock_post):
+        mock_post.return_value = ors_response()
+        first = services.get_route_details(self.chicago, self.indianapolis)
+        second = services.get_route_details((41.87812, -87.62978), self.indianapolis)
+
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertAlmostEqual(first['distance_miles'], 297000.0 * 0.000621371)
+        self.assertEqual(services.route_cache_stats()['memory']['hits'], 1)
+
+    @mock.patch('api.services._http.post')
+    def test_failures_are_not_cached(self, mock_post):
+        error = services.requests.exceptions.HTTPError(response=mock.Mock(status_code=400))
+        mock_post.return_value.raise_for_status.side_effect = error
+        self.assertIsNone(services.get_route_details(self.chicago, self.indianapolis))
+        self.assertEqual(len(services._route_cache), 0)
+
+    @override_settings(ROUTE_CACHE_PERSIST=True)
+    @mock.patch('api.services._http.post')
+    def test_on_disk_store(self, mock_post):
+        mock_post.return_value = ors_response()
+        services.get_route_details(self.chicago, self.indianapolis)
+        self.assertEqual(RouteCacheEntry.objects.count(), 1)
+
+        # A fresh process (empty memory tier) is served from disk
+        services.clear_route_cache()
+        route = services.get_route_details(self.chicago, self.indianapolis)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(route['polyline'], '_p~iF~ps|U_ulLnnqC')
+        self.assertEqual(services.route_cache_stats()['db_hits'], 1)
+
+    @mock.patch('api.services._http.post')
+    def test_stale_while_revalidate(self, mock_post):
+        mock_post.return_value = ors_response(distance_m=1000.0)
+        services.get_route_details(self.chicago, self.indianapolis)
+
+        mock_post.return_value = ors_response(distance_m=2000.0)
+        with override_settings(ROUTE_CACHE_TTL=0):
+            stale = services.get_route_details(self.chicago, self.indianapolis)
+        # The expired route is returned at once...
+        self.assertAlmostEqual(stale['distance_miles'], 1000.0 * 0.000621371)
+
+        # ...and replaced by the background refresh
+        deadline = time.monotonic() + 5
+        while services.route_cache_stats()['refreshes'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fresh = services.get_route_details(self.chicago, self.indianapolis)
+        self.assertAlmostEqual(fresh['distance_miles'], 2000.0 * 0.000621371)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(services.route_cache_stats()['stale_hits'], 1)
+
+
+def grid_graph(size=12, seed=1):
+    """Two-way grid of jittered nodes around Chicago with random road speeds."""
+    rng = random.Random(seed)
+    lats, lngs = [], []
+    for row in range(size):
+        for col in range(size):
+            lats.append(41.5 + row * 0.05 + rng.uniform(-0.01, 0.01))
+            lngs.append(-88.0 + col * 0.05 + rng.uniform(-0.01, 0.01))
+    sources, targets, miles, hours = [], [], [], []
+    for node in range(size * size):
+        for neighbour in (node + 1, node + size):
+            if (neighbour == node + 1 and neighbour % size == 0) or neighbour >= size * size:
+                continue
+            length = haversine_distance(lats[node], lngs[node], lats[neighbour], lngs[neighbour]) * 1.2
+            for u, v in ((node, neighbour), (neighbour, node)):
+                sources.append(u)
+                targets.append(v)
+                miles.append(length)
+                hours.append(length / rng.choice([30, 45, 65]))
+    return routing.RoadGraph.from_edges(lats, lngs, sources, targets, miles, hours)
+
+
+class RoadGraphTestCase(TestCase):
+    def setUp(self):
+        self.graph = grid_graph()
+        services.clear_route_cache()
+
+    def tearDown(self):
+        services.clear_route_cache()
+
+    def test_bidirectional_astar_matches_dijkstra(self):
+        rng = random.Random(2)
+        for _ in range(100):
+            source, target = rng.randrange(self.graph.node_count), rng.randrange(self.graph.node_count)
+            nodes, hours, miles = self.graph.shortest_path(source, target)
+            ref_nodes, ref_hours, ref_miles = self.graph.dijkstra(source, target)
+            self.assertAlmostEqual(hours, ref_hours, places=9)
+            self.assertAlmostEqual(miles, ref_miles, places=9)
+            self.assertEqual((nodes[0], nodes[-1]), (source, target))
+
+    def test_one_way_and_unreachable(self):
+        graph = routing.RoadGraph.from_edges(
+            [41.0, 41.1, 41.2, 45.0], [-87.0, -87.0, -87.0, -90.0],
+            [0, 1, 3], [1, 2, 3], [7.0, 7.0, 1.0], [0.1, 0.1, 0.02]
+        )
+        self.assertEqual(graph.shortest_path(0, 2)[0], [0, 1, 2])
+        self.assertIsNone(graph.shortest_path(2, 0))
+        self.assertIsNone(graph.shortest_path(0, 3))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.npz')
+            self.graph.save(path)
+            loaded = routing.RoadGraph.load(path)
+        self.assertEqual(loaded.edge_count, self.graph.edge_count)
+        self.assertEqual(loaded.shortest_path(0, 143), self.graph.shortest_path(0, 143))
+
+    def test_route_contract(self):
+        start, end = (41.51, -87.99), (42.03, -87.46)
+        route = self.graph.route(start, end)
+        self.assertEqual(set(route), {'distance_miles', 'duration_hours', 'polyline'})
+        path = decode_polyline(route['polyline'])
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], end)
+        self.assertGreater(route['distance_miles'], haversine_distance(*start, *end))
+        self.assertIsNone(self.graph.route(start, (35.0, -100.0)))
+
+    @override_settings(ROUTING_BACKEND='graph')
+    @mock.patch('api.services.fetch_route_legs')
+    def test_graph_backend_with_ors_fallback(self, mock_fetch):
+        mock_fetch.return_value = [{'distance_miles': 900.0, 'duration_hours': 14.0, 'polyline': ''}]
+        with mock.patch('api.routing._graph', self.graph):
+            local = services.get_route([(41.51, -87.99), (42.03, -87.46)])
+            self.assertFalse(mock_fetch.called)
+            self.assertGreater(local['distance_miles'], 0)
+
+            remote = services.get_route([(41.51, -87.99), (35.0, -100.0)])
+            self.assertEqual(remote['distance_miles'], 900.0)
+            self.assertEqual(mock_fetch.call_count, 1)
+
+            with override_settings(ROUTING_ORS_FALLBACK=False):
+                self.assertIsNone(services.get_route([(41.51, -87.99), (36.0, -100.0)]))
+            self.assertEqual(mock_fetch.call_count, 1)
+        stats = services.route_cache_stats()
+        self.assertEqual((stats['graph_routes'], stats['graph_misses']), (1, 2))
+
+    def test_build_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            nodes, edges, output = (os.path.join(tmp, name) for name in ('nodes.csv', 'edges.csv', 'g.npz'))
+            with open(nodes, 'w') as f:
+                f.write('id,latitude,longitude\na,41.0,-87.0\nb,41.1,-87.0\nc,41.2,-87.0\n')
+            with open(edges, 'w') as f:
+                f.write('source,target,distance_miles,speed_mph,oneway\n'
+                        'a,b,7,70,\nb,c,7,,yes\nb,x,1,50,\n')
+            out, err = io.StringIO(), io.StringIO()
+            call_command('build_road_graph', nodes, edges, output=output, stdout=out, stderr=err)
+            graph = routing.RoadGraph.load(output)
+        self.assertIn('3 nodes, 3 directed edges', out.getvalue())
+        self.assertIn('Skipped 1 edges', err.getvalue())
+        self.assertEqual(graph.edge_count, 3)
+        self.assertIsNone(graph.shortest_path(2, 0))
+        nodes, hours, miles = graph.shortest_path(0, 2)
+        self.assertAlmostEqual(hours, 7 / 70 + 7 / 55)
+        self.assertEqual(miles, 14.0)
+
+
+TRIP_COORDS = {
+    'Chicago, IL': (41.8781, -87.6298),
+    'Indianapolis, IN': (39.7684, -86.1581),
+    'Nashville, TN': (36.1627, -86.7816),
+}
+
+
+def fake_geocode(location_name, delay=0.0):
+    time.sleep(delay)
+    return TRIP_COORDS.get(location_name)
+
+
+def fake_route(start_coords, end_coords, delay=0.0):
+    time.sleep(delay)
+    miles = haversine_distance(*start_coords, *end_coords) * 1.2
+    return {
+        'distance_miles': miles,
+        'duration_hours': miles / 55,
+        'polyline': encode_polyline([start_coords, end_coords]),
+    }
+
+
+def fake_multi_route(waypoints, delay=0.0):
+    time.sleep(delay)
+    legs = [fake_route(start, end) for start, end in zip(waypoints, waypoints[1:])]
+    return {
+        'distance_miles': sum(leg['distance_miles'] for leg in legs),
+        'duration_hours': sum(leg['duration_hours'] for leg in legs),
+        'legs': legs,
+    }
+
+
+def ors_route_json(waypoints):
+    """ORS directions response body for a multi-waypoint request."""
+    path, way_points, segments = [], [], []
+    for leg_index, (start, end) in enumerate(zip(waypoints, waypoints[1:])):
+        leg = fake_route(start, end)
+        leg_path = decode_polyline(leg['polyline'])
+        if path:
+            leg_path = leg_path[1:]  # Legs share their joining vertex
+        else:
+            way_points.append(0)
+        path.extend(leg_path)
+        way_points.append(len(path) - 1)
+        segments.append({'distance': leg['distance_miles'] / 0.000621371, 'duration': leg['duration_hours'] * 3600})
+    return {'routes': [{
+        'summary': {
+            'distance': sum(seg['distance'] for seg in segments),
+            'duration': sum(seg['duration'] for seg in segments),
+        },
+        'segments': segments,
+        'way_points': way_points,
+        'geometry': encode_polyline(path),
+    }]}
+
+
+@mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+class MultiWaypointRouteTestCase(TestCase):
+    waypoints = [TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN'], TRIP_COORDS['Nashville, TN']]
+
+    def setUp(self):
+        services.clear_route_cache()
+
+    def tearDown(self):
+        services.clear_route_cache()
+
+    @mock.patch('api.services._http.post')
+    def test_one_request_for_all_legs(self, mock_post):
+        mock_post.return_value.json.return_value = ors_route_json(self.waypoints)
+        route = services.get_route(self.waypoints)
+
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(len(mock_post.call_args.kwargs['json']['coordinates']), 3)
+        expected = fake_multi_route(self.waypoints)
+        self.assertAlmostEqual(route['distance_miles'], expected['distance_miles'])
+        for leg, expected_leg in zip(route['legs'], expected['legs']):
+            self.assertAlmostEqual(leg['distance_miles'], expected_leg['distance_miles'])
+            self.assertAlmostEqual(leg['duration_hours'], expected_leg['duration_hours'])
+            self.assertEqual(leg['polyline'], expected_leg['polyline'])
+
+    @mock.patch('api.services._http.post')
+    def test_legs_are_cached_individually(self, mock_post):
+        mock_post.return_value.json.return_value = ors_route_json(self.waypoints)
+        services.get_route(self.waypoints)
+
+        # Both legs are now served from the cache, together or on their own
+        self.assertIsNotNone(services.get_route(self.waypoints))
+        leg2 = services.get_route_details(self.waypoints[1], self.waypoints[2])
+        self.assertEqual(leg2['polyline'], fake_route(self.waypoints[1], self.waypoints[2])['polyline'])
+        self.assertEqual(mock_post.call_count, 1)
+
+    @mock.patch('api.services._http.post')
+    def test_mismatched_segments_are_a_routing_failure(self, mock_post):
+        data = ors_route_json(self.waypoints)
+        data['routes'][0]['segments'] = data['routes'][0]['segments'][:1]
+        mock_post.return_value.json.return_value = data
+
+        self.assertIsNone(services.get_route(self.waypoints))
+        # Nothing was cached from the partial response
+        self.assertIsNone(services.get_route(self.waypoints))
+        self.assertEqual(mock_post.call_count, 2)
+
+
+class GeocodeAndRouteTestCase(TestCase):
+    locations = ['Chicago, IL', 'Indianapolis, IN', 'Nashville, TN']
+
+    def test_fan_out_is_concurrent(self):
+        with mock.patch('api.services.geocode_location', side_effect=lambda n: fake_geocode(n, 0.2)), \
+                mock.patch('api.services.get_route', side_effect=lambda w: fake_multi_route(w, 0.2)) as mock_route:
+            started = time.monotonic()
+            coords, legs = services.geocode_and_route(self.locations)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(coords, [TRIP_COORDS[name] for name in self.locations])
+        self.assertEqual(len(legs), 2)
+        self.assertTrue(all(legs))
+        mock_route.assert_called_once()
+        # Sequential would be 3 geocodes + 1 route = 0.8s
+        self.assertLess(elapsed, 0.6)
+
+    def test_geocode_failure_skips_routing(self):
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route) as mock_route:
+            coords, routes = services.geocode_and_route(['Chicago, IL', 'Atlantis'])
+
+        self.assertEqual(coords[1], None)
+        self.assertEqual(routes, [None])
+        mock_route.assert_not_called()
+
+    def test_pool_threads_close_obsolete_connections(self):
+        threads = []
+
+        def geocode(name):
+            threads.append(threading.get_ident())
+            return fake_geocode(name)
+
+        with mock.patch('api.services.geocode_location', side_effect=geocode), \
+                mock.patch('api.services.close_old_connections') as mock_close:
+            services.geocode_locations(self.locations)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(mock_close.call_count, len(self.locations))
+
+
+@mock.patch('api.services.get_route', side_effect=fake_multi_route)
+@mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+class CalculateTripViewTestCase(TestCase):
+    url = '/api/calculate-trip/'
+    payload = {
+        'current_location': 'Chicago, IL',
+        'pickup_location': 'Indianapolis, IN',
+        'dropoff_location': 'Nashville, TN',
+        'hours_used': 10,
+    }
+
+    def test_trip_response(self, mock_geocode, mock_route):
+        response = self.client.post(self.url, self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        self.assertEqual(mock_geocode.call_count, 3)
+        self.assertEqual(mock_route.call_count, 1)
+        self.assertEqual(data['trip_segments'][0]['description'], 'Pickup at Origin')
+        self.assertEqual(data['trip_segments'][0]['latitude'], TRIP_COORDS['Chicago, IL'][0])
+        self.assertIn('polyline_leg1', data['route'])
+        self.assertAlmostEqual(data['total_trip_hours'], data['route']['total_duration'])
+
+    def test_geocode_failure(self, mock_geocode, mock_route):
+        payload = dict(self.payload, dropoff_location='Atlantis')
+        response = self.client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_routing_failure(self, mock_geocode, mock_route):
+        mock_route.side_effect = None
+        mock_route.return_value = None
+        response = self.client.post(self.url, self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+    def test_invalid_hours(self, mock_geocode, mock_route):
+        payload = dict(self.payload, hours_used=75)
+        response = self.client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        mock_geocode.assert_not_called()
+
+
+@mock.patch('api.services.get_route', side_effect=fake_multi_route)
+@mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+class CalculateTripStreamViewTestCase(TestCase):
+    url = '/api/calculate-trip/stream/'
+    payload = CalculateTripViewTestCase.payload
+
+    def setUp(self):
+        response_cache.clear()
+
+    def tearDown(self):
+        response_cache.clear()
+
+    def events(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_events_arrive_stage_by_stage(self, mock_geocode, mock_route):
+        events = self.events(self.client.post(self.url, self.payload, content_type='application/json'))
+        kinds = [event['event'] for event in events]
+        self.assertEqual(kinds, ['geocode'] * 3 + ['route'] * 2 + ['segments', 'stops', 'plan'])
+        self.assertEqual({event['data']['index'] for event in events[:3]}, {0, 1, 2})
+        legs = {event['data']['index']: event['data'] for event in events[3:5]}
+        self.assertEqual(legs[0]['polyline'], encode_polyline(
+            [TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN']]
+        ))
+
+        plan = events[-1]['data']
+        self.assertIn('hos', plan.pop('timings'))
+        self.assertEqual(plan['trip_segments'][0]['latitude'], TRIP_COORDS['Chicago, IL'][0])
+        self.assertEqual(events[5]['data']['total_trip_hours'], plan['total_trip_hours'])
+        self.assertEqual(len(events[6]['data']), sum('latitude' in row for row in plan['trip_segments']))
+        self.assertTrue(TripPlan.objects.filter(pk=plan.pop('trip_plan_id')).exists())
+
+        # The finished plan matches the plain endpoint
+        expected = self.client.post(CalculateTripViewTestCase.url, self.payload, content_type='application/json')
+        expected = expected.json()
+        expected.pop('trip_plan_id', None)
+        self.assertEqual(plan, expected)
+
+    def test_leg_is_routed_while_last_location_geocodes(self, mock_geocode, mock_route):
+        mock_geocode.side_effect = lambda name: fake_geocode(name, delay=0.2 if name == 'Nashville, TN' else 0.0)
+        events = self.events(self.client.post(self.url, self.payload, content_type='application/json'))
+        kinds = [(event['event'], event['data'].get('index')) for event in events[:5]]
+        self.assertLess(kinds.index(('route', 0)), kinds.index(('geocode', 2)))
+        self.assertEqual([len(call.args[0]) for call in mock_route.call_args_list], [2, 2])
+
+    def test_server_sent_events_over_get(self, mock_geocode, mock_route):
+        response = self.client.get(self.url, self.payload, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('event: geocode\ndata: {'))
+        self.assertIn('event: plan\n', body)
+
+    def test_errors(self, mock_geocode, mock_route):
+        response = self.client.post(self.url, dict(self.payload, hours_used=75), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        for body in ('not json', '[]', '"x"'):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.json(), {'error': 'Invalid JSON body.'}, body)
+
+        events = self.events(self.client.post(self.url, dict(self.payload, dropoff_location='Atlantis'),
+                                              content_type='application/json'))
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertEqual(events[-1]['data']['status'], 400)
+
+        mock_route.side_effect = None
+        mock_route.return_value = None
+        events = self.events(self.client.post(self.url, self.payload, content_type='application/json'))
+        self.assertEqual(events[-1]['data']['status'], 503)
+
+    @override_settings(TRIP_PLAN_PERSIST=False)
+    def test_streams_under_asgi(self, mock_geocode, mock_route):
+        async def stream():
+            response = await self.async_client.post(self.url, self.payload, content_type='application/json')
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = asyncio.run(stream()).splitlines()
+        self.assertEqual(json.loads(lines[-1])['event'], 'plan')
+
+
+@mock.patch('api.services.get_route', side_effect=fake_multi_route)
+@mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+class TripJobTestCase(TestCase):
+    url = '/api/trip-jobs/'
+    payload = CalculateTripViewTestCase.payload
+
+    def submit(self, payload=None):
+        return self.client.post(self.url, payload or self.payload, content_type='application/json')
+
+    def test_submit_returns_before_running(self, mock_geocode, mock_route):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual(data['status'], 'queued')
+        self.assertEqual(response['Location'], data['status_url'])
+        mock_geocode.assert_not_called()
+
+        status_response = self.client.get(data['status_url'])
+        self.assertEqual(status_response.json()['status'], 'queued')
+        self.assertEqual(status_response['Retry-After'], '1')
+
+    def test_worker_runs_job(self, mock_geocode, mock_route):
+        job_url = self.submit().json()['status_url']
+        self.assertEqual(jobs.work('test', burst=True), 1)
+
+        data = self.client.get(job_url).json()
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual(data['attempts'], 1)
+        expected = self.client.post(CalculateTripViewTestCase.url, self.payload, content_type='application/json')
+        result, expected = data['result'], expected.json()
+        self.assertTrue(TripPlan.objects.filter(pk=result.pop('trip_plan_id')).exists())
+        expected.pop('trip_plan_id')
+        self.assertEqual(result, expected)
+
+    def test_failed_job_keeps_error(self, mock_geocode, mock_route):
+        job_url = self.submit(dict(self.payload, dropoff_location='Atlantis')).json()['status_url']
+        out = io.StringIO()
+        call_command('run_trip_worker', processes=0, burst=True, stdout=out)
+        self.assertIn('ran 1 jobs', out.getvalue())
+        data = self.client.get(job_url).json()
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(data['status_code'], 400)
+        self.assertIn('geocode', data['error'])
+
+    def test_cancel(self, mock_geocode, mock_route):
+        queued = self.submit().json()
+        response = self.client.post(f"{queued['status_url']}cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'cancelled')
+        self.assertEqual(jobs.work('test', burst=True), 0)
+        mock_geocode.assert_not_called()
+
+        # A running job stops at its next heartbeat
+        running = self.submit().json()
+        job = jobs.claim_next('test')
+        response = self.client.post(f"{running['status_url']}cancel/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(jobs.run_job(job), 'cancelled')
+        mock_geocode.assert_not_called()
+        self.assertEqual(self.client.post(f"{running['status_url']}cancel/").json()['status'], 'cancelled')
+
+        jobs.work('test', burst=True)
+        done = self.submit().json()
+        jobs.work('test', burst=True)
+        self.assertEqual(self.client.post(f"{done['status_url']}cancel/").status_code, 409)
+
+    def test_abandoned_job_is_requeued(self, mock_geocode, mock_route):
+        job_id = self.submit().json()['job_id']
+        jobs.claim_next('crashed')
+        self.assertIsNone(jobs.claim_next('other'))
+
+        TripJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        job = jobs.claim_next('other')
+        self.assertEqual((str(job.id), job.attempts), (job_id, 2))
+        # The old worker no longer holds the lease and can't overwrite the result
+        self.assertEqual(jobs._finish(TripJob(pk=job.pk, worker='crashed'), 'failed', {'error': 'x'}, 500), 'failed')
+        self.assertEqual(TripJob.objects.get(pk=job_id).status, 'running')
+
+        with override_settings(TRIP_JOB_MAX_ATTEMPTS=2):
+            TripJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            self.assertIsNone(jobs.claim_next('third'))
+        self.assertEqual(TripJob.objects.get(pk=job_id).status, 'failed')
+
+    def test_finished_jobs_are_purged(self, mock_geocode, mock_route):
+        self.submit()
+        jobs.work('test', burst=True)
+        self.assertEqual(jobs.purge_expired(), 0)
+        TripJob.objects.update(finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(jobs.purge_expired(), 1)
+
+    def test_errors(self, mock_geocode, mock_route):
+        self.assertEqual(self.submit(dict(self.payload, hours_used=75)).status_code, 400)
+        with override_settings(TRIP_JOB_MAX_QUEUED=1):
+            self.assertEqual(self.submit().status_code, 202)
+            self.assertEqual(self.submit().status_code, 503)
+        unknown = '/api/trip-jobs/00000000-0000-0000-0000-000000000000/'
+        self.assertEqual(self.client.get(unknown).status_code, 404)
+        self.assertEqual(self.client.post(f'{unknown}cancel/').status_code, 404)
+
+
+def fake_upstream(request):
+    """httpx transport handler standing in for Nominatim and ORS."""
+    if request.url.path.endswith('/search'):
+        coords = TRIP_COORDS.get(request.url.params['q'])
+        results = [{'lat': str(coords[0]), 'lon': str(coords[1])}] if coords else []
+        return httpx.Response(200, json=results)
+    waypoints = [(lat, lng) for lng, lat in json.loads(request.content)['coordinates']]
+    return httpx.Response(200, json=ors_route_json(waypoints))
+
+
+class AsyncClientLifetimeTestCase(TestCase):
+    def test_clients_close_with_their_loop(self):
+        clients = []
+
+        async def fake_geocode_and_route(locations):
+            clients.append(async_services.get_async_client())
+            self.assertIs(async_services.get_async_client(), clients[-1])
+            return [None] * len(locations), [None] * (len(locations) - 1)
+
+        # Through the WSGI stack each call runs on a new async_to_sync loop
+        with mock.patch('api.views.ageocode_and_route', side_effect=fake_geocode_and_route):
+            for _ in range(2):
+                response = self.client.post(
+                    AsyncCalculateTripViewTestCase.url, CalculateTripViewTestCase.payload,
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(len(clients), 2)
+        self.assertIsNot(clients[0], clients[1])
+        self.assertTrue(all(client.is_closed for client in clients))
+
+    def test_one_client_per_running_loop(self):
+        async def twice():
+            return async_services.get_async_client(), async_services.get_async_client()
+
+        first, second = asyncio.run(twice())
+        self.assertIs(first, second)
+        self.assertTrue(first.is_closed)
+
+
+@mock.patch.object(services.nominatim_limiter, 'rate', 0)
+@override_settings(GAZETTEER_PATH='')
+@mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+class AsyncCalculateTripViewTestCase(TestCase):
+    url = '/api/calculate-trip-async/'
+
+    def setUp(self):
+        services.clear_geocode_cache()
+        services.clear_route_cache()
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            return fake_upstream(request)
+
+        self.client_patch = mock.patch(
+            'api.async_services.get_async_client',
+            side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+        self.client_patch.start()
+
+    def tearDown(self):
+        self.client_patch.stop()
+        services.clear_geocode_cache()
+        services.clear_route_cache()
+
+    async def test_trip_response_matches_sync_view(self):
+        payload = dict(CalculateTripViewTestCase.payload)
+        response = await self.async_client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Three geocodes and one multi-waypoint route
+        self.assertEqual(len(self.requests), 4)
+        self.assertIn('nominatim;dur=', response['Server-Timing'])
+        self.assertIn('ors;dur=', response['Server-Timing'])
+
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            expected = await self.async_client.post(
+                CalculateTripViewTestCase.url, payload, content_type='application/json'
+            )
+        data, expected = response.json(), expected.json()
+        self.assertEqual(len(data['trip_segments']), len(expected['trip_segments']))
+        self.assertAlmostEqual(data['total_trip_hours'], expected['total_trip_hours'], places=6)
+        self.assertEqual(data['route']['polyline_leg2'], expected['route']['polyline_leg2'])
+
+    async def test_repeat_request_is_served_from_cache(self):
+        payload = dict(CalculateTripViewTestCase.payload)
+        await self.async_client.post(self.url, payload, content_type='application/json')
+        response = await self.async_client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.requests), 4)
+
+    async def test_msgpack_columnar(self):
+        payload = dict(CalculateTripViewTestCase.payload, layout='columnar')
+        response = await self.async_client.post(self.url, payload, content_type='application/json',
+                                                headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content)
+        self.assertIn('status_codes', data['segments'])
+
+    async def test_errors(self):
+        payload = dict(CalculateTripViewTestCase.payload, pickup_location='Atlantis')
+        response = await self.async_client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        for body in ('not json', '[]', '"x"'):
+            response = await self.async_client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(json.loads(response.content), {'error': 'Invalid JSON body.'})
+
+
+@mock.patch('api.services.compute_route_legs', side_effect=lambda waypoints: fake_multi_route(waypoints)['legs'])
+class TripResponseCacheTestCase(TestCase):
+    """Locations come from the bundled gazetteer, so both cache tiers the responses depend on are filled."""
+    url = CalculateTripViewTestCase.url
+    payload = CalculateTripViewTestCase.payload
+
+    def setUp(self):
+        response_cache.clear()
+        services.clear_route_cache()
+
+    def tearDown(self):
+        response_cache.clear()
+        services.clear_route_cache()
+
+    def post(self, payload=None, **headers):
+        return self.client.post(self.url, payload or self.payload, content_type='application/json', **headers)
+
+    def test_identical_requests_are_served_from_cache(self, mock_compute):
+        first = self.post()
+        respelled = dict(self.payload, current_location='  chicago il', hours_used='10.0')
+        second = self.post(respelled)
+
+        self.assertEqual(mock_compute.call_count, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertEqual(response_cache.stats()['memory']['hits'], 1)
+
+        # Layout and zoom are part of the key
+        self.post(dict(self.payload, layout='columnar'))
+        self.assertEqual(mock_compute.call_count, 1)  # Legs come from the route cache
+        self.assertEqual(len(response_cache._responses), 2)
+
+    def test_conditional_request(self, mock_compute):
+        etag = self.post()['ETag']
+        response = self.post(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.post(HTTP_IF_NONE_MATCH='W/"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_msgpack_from_cache(self, mock_compute):
+        data = self.post().json()
+        response = self.post(HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), data)
+
+    def test_invalidated_with_route_entries(self, mock_compute):
+        first = self.post().json()
+        services.clear_route_cache()
+        second = self.post().json()
+        self.assertEqual(mock_compute.call_count, 2)
+        self.assertEqual(response_cache.stats()['invalidations'], 1)
+        self.assertNotEqual(second.get('trip_plan_id'), first.get('trip_plan_id'))
+
+        # A refreshed (replaced) leg also invalidates
+        key = services.route_cache_key(TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN'])
+        services.cache_route_result(key, fake_route(TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN']))
+        self.post()
+        self.assertEqual(response_cache.stats()['invalidations'], 2)
+
+    def test_stale_route_is_not_served_from_cache(self, mock_compute):
+        self.post()
+        with override_settings(ROUTE_CACHE_TTL=0):
+            self.assertIsNone(response_cache.get(response_cache.trip_key(
+                [self.payload[name] for name in ('current_location', 'pickup_location', 'dropoff_location')],
+                self.payload['hours_used'], 'rows', None
+            )))
+
+    def test_uncached_dependencies_are_not_stored(self, mock_compute):
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            response = self.post()
+        self.assertIn('ETag', response)
+        self.assertEqual(len(response_cache._responses), 0)
+
+    def test_sized_lru(self, mock_compute):
+        cache = SizedLRUCache(max_bytes=10)
+        self.assertTrue(cache.set('a', 'A', 4))
+        self.assertTrue(cache.set('b', 'B', 4))
+        cache.get('a')
+        self.assertTrue(cache.set('c', 'C', 4))   # Evicts b, the least recently used
+        self.assertEqual(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertFalse(cache.set('d', 'D', 11))
+        self.assertEqual(cache.stats()['bytes'], 8)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TripPlanTestCase(TestCase):
+    def setUp(self):
+        trips._stored_trips.clear()
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            response = self.client.post(CalculateTripViewTestCase.url, CalculateTripViewTestCase.payload,
+                                        content_type='application/json')
+        self.plan = response.json()
+        self.url = f"/api/trip-plans/{self.plan['trip_plan_id']}/replan/"
+
+    def tearDown(self):
+        trips._stored_trips.clear()
+
+    def checkpoint(self, index):
+        """Progress body for a driver who has just finished segment `index` of the plan."""
+        done = self.plan['trip_segments'][:index + 1]
+        driving = sum(seg['duration'] for seg in done if seg['status'] == 'driving')
+        return {
+            'miles_driven': sum(seg['distance_miles'] for seg in done),
+            'hours_used': CalculateTripViewTestCase.payload['hours_used'] + 1 + driving,
+            'elapsed_hours': done[-1]['start_time'] + done[-1]['duration'],
+            'driving_since_break': 0,
+            'driving_today': driving,
+            'on_duty_today': sum(seg['duration'] for seg in done),
+        }
+
+    def test_resume_matches_full_plan(self):
+        segments, consumed = plan_segments(2500, 30)
+        state = HOSState(2500, trip_time=1.0, on_duty_daily=1.0, cycle_hours_consumed=1.0)
+        resumed = resume_segments(state, 40)
+        self.assertEqual([repr(segment) for segment in resumed], [repr(segment) for segment in segments[1:]])
+        self.assertEqual(state.cycle_hours_consumed, consumed)
+        self.assertEqual(state.trip_time, segments[-1].end_time)
+
+    def test_plan_is_stored(self):
+        trip_plan = TripPlan.objects.get(pk=self.plan['trip_plan_id'])
+        self.assertEqual(trip_plan.locations[0], 'Chicago, IL')
+        self.assertEqual(trip_plan.segments, self.plan['trip_segments'])
+        self.assertEqual(trip_plan.polyline_leg2, self.plan['route']['polyline_leg2'])
+
+    @mock.patch('api.services.get_route')
+    @mock.patch('api.services.geocode_location')
+    def test_replan_from_checkpoint(self, mock_geocode, mock_route):
+        rows = self.plan['trip_segments']
+        index = next(i for i, seg in enumerate(rows) if seg['description'] == '30-minute Mandatory Break')
+        trips._stored_trips.clear()  # Loaded from the database this time
+        response = self.client.post(self.url, self.checkpoint(index), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        mock_geocode.assert_not_called()
+        mock_route.assert_not_called()
+        self.assertEqual(data['trip_plan_id'], self.plan['trip_plan_id'])
+        self.assertEqual(len(data['trip_segments']), len(rows) - index - 1)
+        for actual, expected in zip(data['trip_segments'], rows[index + 1:]):
+            self.assertEqual(actual['description'], expected['description'])
+            self.assertAlmostEqual(actual['start_time'], expected['start_time'])
+            if 'latitude' in expected:
+                self.assertAlmostEqual(actual['latitude'], expected['latitude'])
+                self.assertAlmostEqual(actual['longitude'], expected['longitude'])
+        self.assertAlmostEqual(data['total_trip_hours'], self.plan['total_trip_hours'])
+        self.assertAlmostEqual(data['available_hours'], self.plan['available_hours'])
+
+    def test_replan_with_new_hours(self):
+        progress = dict(self.checkpoint(0), hours_used=69.5)
+        data = self.client.post(self.url, progress, content_type='application/json').json()
+        self.assertEqual(data['trip_segments'][-1]['description'], 'REACHED 70-HOUR LIMIT')
+
+    def test_replan_with_fuel_stop_due(self):
+        for miles_since_fuel in (999.95, 1000, 1500):
+            body = {'miles_driven': 100, 'hours_used': 20, 'miles_since_fuel': miles_since_fuel}
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 200, miles_since_fuel)
+            segments = response.json()['trip_segments']
+            self.assertEqual(segments[0]['description'], 'Fuel Stop')
+            self.assertEqual(segments[-1]['description'], 'Dropoff at Destination')
+
+    def test_replan_errors(self):
+        unknown = '/api/trip-plans/00000000-0000-0000-0000-000000000000/replan/'
+        self.assertEqual(self.client.post(unknown, {'miles_driven': 0, 'hours_used': 0},
+                                          content_type='application/json').status_code, 404)
+        for body in ({'hours_used': 10}, {'miles_driven': 10}, {'miles_driven': 1e6, 'hours_used': 10},
+                     {'miles_driven': 10, 'hours_used': 70}, {'miles_driven': 10, 'hours_used': 5, 'driving_today': -1},
+                     {'miles_driven': 'far', 'hours_used': 5}, {'miles_driven': 10, 'hours_used': 69.9995}):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+@override_settings(ELD_RENDER_PROCESSES=0)
+class ELDLogSheetTestCase(TestCase):
+    def setUp(self):
+        trips._stored_trips.clear()
+        eld.clear_render_cache()
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            response = self.client.post(f'{CalculateTripViewTestCase.url}?log_sheets=true',
+                                        CalculateTripViewTestCase.payload, content_type='application/json')
+        self.plan = response.json()
+        self.url = f"/api/trip-plans/{self.plan['trip_plan_id']}/logs"
+
+    def tearDown(self):
+        trips._stored_trips.clear()
+        eld.clear_render_cache()
+
+    def test_daily_sheets(self):
+        segments, _ = plan_segments(2500, 30)
+        sheets = eld.daily_sheets(segments)
+        self.assertEqual([sheet['day'] for sheet in sheets], [1, 2, 3])
+        for sheet in sheets:
+            self.assertEqual(len(sheet['grid']), eld.SLOTS_PER_DAY)
+            self.assertAlmostEqual(sum(sheet['totals'].values()), 24.0)
+            # Every stop here starts and ends on a quarter hour, so the grid matches the totals exactly
+            for status in SegmentStatus:
+                self.assertAlmostEqual(sheet['grid'].count(status) / 4, sheet['totals'][status.label])
+        driven = sum(segment.distance_miles for segment in segments if segment.status == SegmentStatus.DRIVING)
+        self.assertAlmostEqual(sum(sheet['miles_driven'] for sheet in sheets), driven)
+        self.assertEqual(sheets[0]['grid'][:4], [SegmentStatus.ON_DUTY] * 4)
+        self.assertEqual(sheets[0]['remarks'][0]['description'], 'Pickup at Origin')
+        # After the trip ends the driver is off duty
+        self.assertEqual(sheets[-1]['grid'][-1], SegmentStatus.OFF_DUTY)
+
+    def test_sheets_of_a_resumed_plan_start_on_its_day(self):
+        state = HOSState(300, trip_time=30.0)
+        segments = resume_segments(state, 40)
+        sheets = eld.daily_sheets(segments)
+        self.assertEqual(sheets[0]['day'], 2)
+        self.assertEqual(sheets[0]['start_hour'], 24.0)
+        self.assertEqual(set(sheets[0]['grid'][:24]), {SegmentStatus.OFF_DUTY})
+        self.assertAlmostEqual(
+            sheets[0]['totals']['driving'],
+            sum(segment.duration for segment in segments if segment.status == SegmentStatus.DRIVING)
+        )
+        self.assertEqual(eld.daily_sheets([]), [])
+
+    def test_trip_response_and_stored_plan_sheets(self):
+        self.assertEqual(len(self.plan['log_sheets']), math.ceil(self.plan['total_trip_hours'] / 24))
+        trips._stored_trips.clear()  # Segments are rebuilt from the database
+        response = self.client.get(f'{self.url}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['log_sheets'], self.plan['log_sheets'])
+
+    def test_sheets_are_opt_in(self):
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            response = self.client.post(CalculateTripViewTestCase.url, CalculateTripViewTestCase.payload,
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('log_sheets', response.json())
+        self.assertNotIn('log_sheets', response['Server-Timing'])
+
+    def test_render_png_is_cached(self):
+        with mock.patch('api.eld.render_sheets', wraps=eld.render_sheets) as render:
+            first = self.client.get(f'{self.url}/1.png')
+            second = self.client.get(f'{self.url}/1.png')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'image/png')
+        self.assertTrue(first.content.startswith(b'\x89PNG'))
+        self.assertEqual(second.content, first.content)
+        render.assert_called_once()
+        self.assertEqual(eld.render_cache_stats()['hits'], 1)
+
+    def test_render_log_book_pdf(self):
+        response = self.client.get(f'{self.url}.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content.count(b'/Type /Page\n'), len(self.plan['log_sheets']))
+
+    def test_render_errors(self):
+        self.assertEqual(self.client.get(f'{self.url}/99.png').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.url}/1.gif').status_code, 400)
+        unknown = '/api/trip-plans/00000000-0000-0000-0000-000000000000/logs'
+        self.assertEqual(self.client.get(f'{unknown}/1.png').status_code, 404)
+        self.assertEqual(self.client.get(f'{unknown}/').status_code, 404)
+
+    @override_settings(ELD_RENDER_PROCESSES=1)
+    def test_render_on_process_pool(self):
+        try:
+            data = eld.rendered_sheets('pooled', self.plan['log_sheets'], 1, 'png')
+        finally:
+            if eld._render_pool is not None:
+                eld._render_pool.shutdown()
+                eld._render_pool = None
+        self.assertTrue(data.startswith(b'\x89PNG'))
+
+
+STOP_COORDS = dict(TRIP_COORDS, **{
+    'Louisville, KY': (38.2527, -85.7585),
+    'Columbus, OH': (39.9612, -82.9988),
+    'Cincinnati, OH': (39.1031, -84.5120),
+    'Dayton, OH': (39.7589, -84.1916),
+    'Lexington, KY': (38.0406, -84.5037),
+})
+
+
+def fake_matrix(coords, sources, destinations):
+    pairs = {}
+    for i in sources:
+        for j in destinations:
+            miles = haversine_distance(*coords[i], *coords[j]) * 1.2
+            pairs[i, j] = (miles, miles / 55)
+    return pairs
+
+
+class MultiStopTripTestCase(TestCase):
+    url = '/api/calculate-trip/multi-stop/'
+    # Zig-zags across the Ohio valley when driven in the given order
+    locations = ['Chicago, IL', 'Columbus, OH', 'Indianapolis, IN', 'Dayton, OH', 'Louisville, KY',
+                 'Cincinnati, OH', 'Nashville, TN']
+
+    def setUp(self):
+        services.clear_matrix_cache()
+        services.clear_route_cache()
+
+    def post(self, payload):
+        with mock.patch('api.services.geocode_location', side_effect=STOP_COORDS.get), \
+                mock.patch('api.services.compute_route_legs', side_effect=lambda w: fake_multi_route(w)['legs']), \
+                mock.patch('api.services.fetch_matrix', side_effect=fake_matrix) as fetch:
+            response = self.client.post(self.url, payload, content_type='application/json')
+        self.matrix_requests = fetch.call_count
+        return response
+
+    def test_dwell_times_at_stops(self):
+        legs = [120.0, 300.0, 200.0]
+        segments, consumed = plan_multi_stop_segments(legs, [0.5, 2.0, 0.0, 1.5], 10, ['A', 'B', 'C', 'D'])
+
+        on_duty = [s for s in segments if s.status == SegmentStatus.ON_DUTY]
+        self.assertEqual([s.description for s in on_duty], ['On duty at A', 'Stop at B', 'Dropoff at D'])
+        self.assertEqual([s.duration for s in on_duty], [0.5, 2.0, 1.5])
+        # The stop at B comes once the first leg has been driven
+        stop = segments.index(on_duty[1])
+        self.assertAlmostEqual(sum(s.distance_miles for s in segments[:stop]), 120.0)
+        self.assertAlmostEqual(sum(s.distance_miles for s in segments), 620.0)
+        self.assertAlmostEqual(consumed, sum(s.duration for s in segments if s.status in (
+            SegmentStatus.ON_DUTY, SegmentStatus.DRIVING)))
+
+    def test_two_stops_match_single_trip(self):
+        single, single_consumed = plan_segments(900.0, 20)
+        multi, multi_consumed = plan_multi_stop_segments([900.0], [1.0, 1.0], 20, ['Origin', 'Destination'])
+        self.assertEqual([s.to_dict() for s in multi][1:], [s.to_dict() for s in single][1:])
+        self.assertAlmostEqual(multi_consumed, single_consumed)
+
+    def test_optimize_order(self):
+        rng = np.random.default_rng(3)
+        points = rng.uniform(0, 100, size=(12, 2))
+        matrix = np.linalg.norm(points[:, None] - points[None], axis=2)
+        order = tour.optimize_order(matrix)
+
+        self.assertEqual((order[0], order[-1]), (0, 11))
+        self.assertEqual(sorted(order), list(range(12)))
+        self.assertLessEqual(tour.route_cost(matrix, order), tour.route_cost(matrix, tour.nearest_neighbour(matrix)))
+        self.assertLess(tour.route_cost(matrix, order), tour.route_cost(matrix, range(12)))
+
+        # Points on a line are visited in line order
+        line = np.abs(np.subtract.outer([0, 7, 3, 5, 1, 9], [0, 7, 3, 5, 1, 9])).astype(float)
+        self.assertEqual(tour.optimize_order(line), [0, 4, 2, 3, 1, 5])
+
+    def test_matrix_growth_is_linear(self):
+        coords = [STOP_COORDS[name] for name in self.locations]
+        with mock.patch('api.services.fetch_matrix', side_effect=fake_matrix) as fetch:
+            distances, durations = services.get_distance_matrix(coords[:6])
+            self.assertEqual(fetch.call_count, 1)
+            self.assertEqual(len(fetch.call_args.args[1]) * len(fetch.call_args.args[2]), 36)
+
+            distances, _ = services.get_distance_matrix(coords)
+            # Only the new point's row and column are fetched
+            self.assertEqual(fetch.call_count, 3)
+            self.assertEqual([call.args[1:] for call in fetch.call_args_list[1:]],
+                             [([6], list(range(7))), (list(range(7)), [6])])
+
+            services.get_distance_matrix(coords[::-1])
+            self.assertEqual(fetch.call_count, 3)
+        self.assertAlmostEqual(distances[0, 6], fake_matrix(coords, [0], [6])[0, 6][0])
+        self.assertEqual(distances[3, 3], 0.0)
+
+    def test_multi_stop_trip(self):
+        stops = [{'location': name} for name in self.locations]
+        stops[2]['dwell_hours'] = 3
+        response = self.post({'stops': stops, 'hours_used': 10})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        self.assertFalse(data['optimized'])
+        self.assertEqual(self.matrix_requests, 0)
+        self.assertEqual([stop['location'] for stop in data['stops']], self.locations)
+        self.assertEqual([stop['dwell_hours'] for stop in data['stops']], [0, 1, 3, 1, 1, 1, 1])
+        self.assertEqual(sorted(key for key in data['route'] if key.startswith('polyline_leg')),
+                         [f'polyline_leg{i}' for i in range(1, 7)])
+        descriptions = [segment['description'] for segment in data['trip_segments']]
+        self.assertEqual([d for d in descriptions if d.startswith(('Stop at', 'Dropoff'))],
+                         [f'Stop at {name}' for name in self.locations[1:-1]] + ['Dropoff at Nashville, TN'])
+        self.assertEqual(data['trip_segments'][0]['type'], 'driving')
+
+    def test_optimized_trip_is_shorter(self):
+        stops = [{'location': name} for name in self.locations]
+        given = self.post({'stops': stops, 'hours_used': 10}).json()
+        optimized = self.post({'stops': stops, 'hours_used': 10, 'optimize': True}).json()
+
+        self.assertTrue(optimized['optimized'])
+        order = [stop['index'] for stop in optimized['stops']]
+        self.assertEqual((order[0], order[-1]), (0, 6))
+        self.assertEqual(sorted(order), list(range(7)))
+        self.assertLess(optimized['route']['total_distance'], given['route']['total_distance'])
+
+    def test_matrix_failure_keeps_given_order(self):
+        stops = [{'location': name} for name in self.locations]
+        with mock.patch('api.services.geocode_location', side_effect=STOP_COORDS.get), \
+                mock.patch('api.services.compute_route_legs', side_effect=lambda w: fake_multi_route(w)['legs']), \
+                mock.patch('api.services.fetch_matrix', return_value=None):
+            data = self.client.post(self.url, {'stops': stops, 'hours_used': 10, 'optimize': True},
+                                    content_type='application/json').json()
+        self.assertFalse(data['optimized'])
+        self.assertEqual([stop['index'] for stop in data['stops']], list(range(7)))
+
+    def test_invalid_input(self):
+        self.assertEqual(self.post({'stops': [{'location': 'Chicago, IL'}], 'hours_used': 10}).status_code, 400)
+        stops = [{'location': 'Chicago, IL'}, {'location': 'Nashville, TN', 'dwell_hours': -1}]
+        self.assertEqual(self.post({'stops': stops, 'hours_used': 10}).status_code, 400)
+        stops = [{'location': 'Chicago, IL'}, {'location': 'Atlantis'}]
+        self.assertEqual(self.post({'stops': stops, 'hours_used': 10}).status_code, 400)
+        with override_settings(MULTI_STOP_MAX_STOPS=3):
+            stops = [{'location': name} for name in self.locations]
+            self.assertEqual(self.post({'stops': stops, 'hours_used': 10}).status_code, 400)
+
+
+class DispatchTestCase(TestCase):
+    url = '/api/dispatch/'
+
+    def setUp(self):
+        services.clear_matrix_cache()
+        services.clear_route_cache()
+        rng = np.random.default_rng(11)
+        self.fleet = [
+            {'id': f'T{i:03d}', 'latitude': lat, 'longitude': lng, 'hours_used': hours}
+            for i, (lat, lng, hours) in enumerate(zip(
+                rng.uniform(30, 47, 300), rng.uniform(-120, -75, 300), rng.uniform(0, 60, 300)
+            ))
+        ]
+        # At the pickup but almost out of cycle hours, and 5 miles out but mid-shift
+        pickup = TRIP_COORDS['Indianapolis, IN']
+        self.fleet.append({'id': 'tired', 'latitude': pickup[0], 'longitude': pickup[1], 'hours_used': 69.5})
+        self.fleet.append({'id': 'busy', 'latitude': pickup[0] + 0.07, 'longitude': pickup[1], 'hours_used': 0,
+                           'driving_today': 10.5, 'on_duty_today': 12, 'driving_since_break': 6})
+
+    def post(self, payload):
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route), \
+                mock.patch('api.services.fetch_matrix', side_effect=fake_matrix) as fetch:
+            response = self.client.post(self.url, payload, content_type='application/json')
+        self.fetch = fetch
+        return response
+
+    def payload(self, **extra):
+        return dict({
+            'pickup_location': 'Indianapolis, IN', 'dropoff_location': 'Nashville, TN', 'fleet': self.fleet,
+        }, **extra)
+
+    def test_grid_index_matches_brute_force(self):
+        rng = np.random.default_rng(5)
+        lats = np.concatenate([rng.uniform(25, 50, 2000), rng.uniform(-60, 80, 500)])
+        lngs = np.concatenate([rng.uniform(-125, -65, 2000), rng.uniform(-180, 180, 500)])
+        index = dispatch.GridIndex(lats, lngs, cell_degrees=0.5)
+        for lat, lng, radius in ((39.8, -86.2, 300), (45, 179.9, 800), (78, 10, 900), (0, 0, 50)):
+            indices, miles = index.within(lat, lng, radius)
+            expected = np.flatnonzero(haversine_to(lat, lng, lats, lngs) <= radius)
+            self.assertEqual(sorted(indices.tolist()), expected.tolist())
+            self.assertTrue(np.all(np.diff(miles) >= 0))
+
+    def test_ranked_list(self):
+        response = self.post(self.payload(top_k=8, max_deadhead_miles=400))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        pickup = TRIP_COORDS['Indianapolis, IN']
+        lats = np.array([truck['latitude'] for truck in self.fleet])
+        lngs = np.array([truck['longitude'] for truck in self.fleet])
+        self.assertEqual(data['fleet_size'], 302)
+        self.assertEqual(data['in_range'], int((haversine_to(*pickup, lats, lngs) <= 400).sum()))
+
+        ranking = data['ranking']
+        self.assertEqual([truck['rank'] for truck in ranking], list(range(1, 9)))
+        # Only the top_k get real deadhead routing, in one matrix request
+        self.fetch.assert_called_once()
+        self.assertEqual(len(self.fetch.call_args.args[1]), 8)
+        feasible = [truck for truck in ranking if truck['feasible']]
+        self.assertEqual(ranking[:len(feasible)], feasible)
+        self.assertEqual([truck['eta_hours'] for truck in feasible], sorted(truck['eta_hours'] for truck in feasible))
+        self.assertTrue(all(truck['straight_line_miles'] <= 400 for truck in ranking))
+        self.assertNotIn('tired', [truck['truck_id'] for truck in feasible])
+
+        # The mid-shift truck 5 miles out rests first, so it is not the best one
+        best = ranking[0]
+        self.assertNotEqual(best['truck_id'], 'busy')
+        truck = next(truck for truck in self.fleet if truck['id'] == best['truck_id'])
+        segments, _ = calculate_trip_segments(best['deadhead_miles'] + data['loaded_miles'], truck['hours_used'])
+        self.assertAlmostEqual(best['eta_hours'], segments[-1]['start_time'] + segments[-1]['duration'])
+        self.assertFalse(best['deadhead_estimated'])
+
+    def test_matrix_failure_falls_back_to_estimates(self):
+        with mock.patch('api.services.geocode_location', side_effect=fake_geocode), \
+                mock.patch('api.services.get_route', side_effect=fake_multi_route), \
+                mock.patch('api.services.fetch_matrix', return_value=None):
+            ranking = self.client.post(self.url, self.payload(), content_type='application/json').json()['ranking']
+        self.assertTrue(all(truck['deadhead_estimated'] for truck in ranking))
+        self.assertAlmostEqual(ranking[0]['deadhead_miles'], ranking[0]['straight_line_miles'] * 1.25)
+
+    def test_no_trucks_in_range(self):
+        data = self.post(self.payload(fleet=self.fleet[:2], max_deadhead_miles=1)).json()
+        self.assertEqual((data['in_range'], data['ranking']), (0, []))
+
+    def test_invalid_input(self):
+        self.assertEqual(self.post(self.payload(fleet=[])).status_code, 400)
+        self.assertEqual(self.post(self.payload(top_k=0)).status_code, 400)
+        fleet = [dict(self.fleet[0], hours_used=71)]
+        self.assertEqual(self.post(self.payload(fleet=fleet)).status_code, 400)
+        fleet = [dict(self.fleet[0], latitude='north')]
+        self.assertEqual(self.post(self.payload(fleet=fleet)).status_code, 400)
+        self.assertEqual(self.post(self.payload(pickup_location='Atlantis')).status_code, 400)
+
+
+@mock.patch('api.services.get_route_details', side_effect=fake_route)
+@mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+class BatchCalculateTripViewTestCase(TestCase):
+    url = '/api/calculate-trip/batch/'
+
+    def post(self, trips):
+        return self.client.post(self.url, {'trips': trips}, content_type='application/json')
+
+    def test_results_in_order_with_errors(self, mock_geocode, mock_route):
+        base = CalculateTripViewTestCase.payload
+        reverse = dict(base, current_location='Nashville, TN', dropoff_location='Chicago, IL')
+        response = self.post([
+            base,
+            dict(base, hours_used=80),
+            reverse,
+            dict(base, pickup_location='Atlantis'),
+            dict(base, current_location='chicago  il'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[1]['status'], 400)
+        self.assertEqual(results[3]['status'], 400)
+        self.assertNotIn('error', results[0])
+        self.assertEqual(results[0]['route'], results[4]['route'])
+        self.assertNotEqual(results[0]['route'], results[2]['route'])
+
+        with mock.patch('api.services.get_route', side_effect=fake_multi_route):
+            single = self.client.post(CalculateTripViewTestCase.url, base, content_type='application/json').json()
+        self.assertEqual(results[0]['trip_segments'], single['trip_segments'])
+
+    def test_deduplicates_locations_and_legs(self, mock_geocode, mock_route):
+        base = CalculateTripViewTestCase.payload
+        self.post([base] * 20 + [dict(base, current_location='CHICAGO, IL')] * 5)
+        self.assertEqual(mock_geocode.call_count, 3)
+        self.assertEqual(mock_route.call_count, 2)
+
+    def test_routing_failure(self, mock_geocode, mock_route):
+        mock_route.side_effect = None
+        mock_route.return_value = None
+        results = self.post([CalculateTripViewTestCase.payload]).json()['results']
+        self.assertEqual(results[0]['status'], 503)
+
+    @mock.patch.dict(os.environ, {'ORS_API_KEY': ''})
+    def test_missing_api_key_is_a_routing_failure(self, mock_geocode, mock_route):
+        services.clear_route_cache()
+        mock_route.side_effect = lambda start, end: (services.get_route([start, end]) or {'legs': [None]})['legs'][0]
+        response = self.post([CalculateTripViewTestCase.payload] * 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['results']], [503, 503])
+
+        waypoints = [TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN']]
+        self.assertIsNone(asyncio.run(async_services.afetch_route_legs(waypoints)))
+
+    def test_invalid_body(self, mock_geocode, mock_route):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post(['not a trip']).json()['results'][0]['status'], 400)
+        with override_settings(TRIP_BATCH_MAX_SIZE=2):
+            self.assertEqual(self.post([CalculateTripViewTestCase.payload] * 3).status_code, 400)
+
+
+class PlanTripsTestCase(TestCase):
+    @override_settings(TRIP_BATCH_PROCESSES=2, TRIP_BATCH_PROCESS_THRESHOLD=1)
+    def test_process_pool_matches_inline(self):
+        waypoints = [TRIP_COORDS['Chicago, IL'], TRIP_COORDS['Indianapolis, IN'], TRIP_COORDS['Nashville, TN']]
+        legs = fake_multi_route(waypoints)['legs']
+        jobs = [(legs, hours) for hours in (0, 10, 35.5, 69.5, 70)]
+
+        pooled = trips.plan_trips(jobs)
+        inline = [trips._plan_or_error(job) for job in jobs]
+        self.assertEqual(pooled, inline)
+        self.assertIn('error', pooled[-1])
+
+
+class HOSBatchTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(2024)
+        self.distances = [rng.uniform(0, 6000) for _ in range(1500)]
+        self.hours = [rng.uniform(0, 69.99) for _ in range(1500)]
+        # Edge cases: zero distance, exact fuel/break boundaries, nearly exhausted cycle
+        for distance in (0, 0.05, 480, 500, 660, 1000, 2000, 3000.0):
+            for hours in (0, 10, 55, 68, 69.5, 69.999):
+                self.distances.append(distance)
+                self.hours.append(hours)
+
+    def test_matches_scalar_planner(self):
+        result = calculate_trip_segments_batch(self.distances, self.hours, with_segments=True)
+        self.assertFalse(result['stalled'].any())
+
+        for i, (distance, hours) in enumerate(zip(self.distances, self.hours)):
+            segments, consumed = calculate_trip_segments(distance, hours)
+            descriptions = [s['description'] for s in segments]
+            drives = [s for s in segments if s['type'] == 'driving']
+
+            self.assertEqual(result['segments'][i], segments)
+            self.assertEqual(result['segment_count'][i], len(segments))
+            self.assertEqual(result['driving_segments'][i], len(drives))
+            self.assertEqual(result['break_count'][i], descriptions.count('30-minute Mandatory Break'))
+            self.assertEqual(result['sleeper_count'][i], descriptions.count('10-hour Mandatory Rest'))
+            self.assertEqual(result['fuel_stop_count'][i], descriptions.count('Fuel Stop'))
+            self.assertEqual(result['limit_reached'][i], 'REACHED 70-HOUR LIMIT' in descriptions)
+            self.assertEqual(result['completed'][i], descriptions[-1] == 'Dropoff at Destination')
+            self.assertEqual(result['cycle_hours_consumed'][i], consumed)
+            self.assertEqual(result['total_trip_hours'][i], segments[-1]['start_time'] + segments[-1]['duration'])
+            self.assertAlmostEqual(result['driving_miles'][i], sum(s['distance_miles'] for s in drives), places=6)
+
+    def test_starting_clocks_match_resume_segments(self):
+        rng = random.Random(7)
+        distances, hours, clocks = [], [], []
+        for _ in range(300):
+            driving = rng.uniform(0, 11)
+            clocks.append((rng.uniform(0, min(driving, 8)), driving, rng.uniform(driving, 14)))
+            distances.append(rng.uniform(0, 3000))
+            hours.append(rng.uniform(0, 69))
+        since_break, driving_daily, on_duty_daily = (np.array(column) for column in zip(*clocks))
+        result = calculate_trip_segments_batch(
+            distances, hours, driving_since_break=since_break, driving_daily=driving_daily,
+            on_duty_daily=on_duty_daily
+        )
+
+        for i in np.flatnonzero(~result['stalled']):
+            # The batch planner starts with the 1-hour pickup
+            state = HOSState(distances[i], trip_time=1.0, driving_since_break=since_break[i],
+                             driving_daily=driving_daily[i], on_duty_daily=on_duty_daily[i] + 1.0,
+                             cycle_hours_consumed=1.0)
+            segments = resume_segments(state, 70.0 - hours[i])
+            self.assertAlmostEqual(result['total_trip_hours'][i], segments[-1].end_time, places=9)
+            self.assertEqual(result['completed'][i], segments[-1].description == 'Dropoff at Destination')
+
+    def test_summary_only_by_default(self):
+        result = calculate_trip_segments_batch(self.distances[:10], self.hours[:10])
+        self.assertNotIn('segments', result)
+        self.assertEqual(result['segment_count'].shape, (10,))
+
+    def test_exhausted_cycle_is_invalid(self):
+        result = calculate_trip_segments_batch([500, 500], [70, 20])
+        self.assertEqual(result['valid'].tolist(), [False, True])
+        self.assertTrue(np.isnan(result['total_trip_hours'][0]))
+        with self.assertRaises(ValueError):
+            calculate_trip_segments(500, 70)
+
+
+class CompactSegmentTestCase(TestCase):
+    def test_dicts_match_segments(self):
+        segments, consumed = plan_segments(2500, 30)
+        rows, rows_consumed = calculate_trip_segments(2500, 30)
+        self.assertEqual(consumed, rows_consumed)
+        self.assertEqual([segment.to_dict() for segment in segments], rows)
+        self.assertFalse(hasattr(segments[0], '__dict__'))
+
+    def test_location_is_serialized_once_set(self):
+        segment = Segment(SegmentStatus.ON_DUTY, 0.0, 1.0, 'Pickup at Origin')
+        self.assertNotIn('latitude', segment.to_dict())
+        segment.latitude, segment.longitude = 41.0, -87.0
+        self.assertEqual(segment.to_dict()['latitude'], 41.0)
+        self.assertEqual(segment.to_dict()['type'], 'on_duty')
+
+
+@mock.patch('api.services.get_route', side_effect=fake_multi_route)
+@mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+class ResponseFormatTestCase(TestCase):
+    url = '/api/calculate-trip/'
+
+    def test_columnar_layout(self, mock_geocode, mock_route):
+        rows = self.client.post(self.url, CalculateTripViewTestCase.payload, content_type='application/json').json()
+        response = self.client.post(self.url + '?layout=columnar', CalculateTripViewTestCase.payload,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        self.assertNotIn('trip_segments', data)
+        self.assertNotIn('eld_logs', data)
+        columns = data['segments']
+        codes = columns['status_codes']
+        self.assertEqual(len(columns['start_time']), len(rows['trip_segments']))
+        for i, row in enumerate(rows['trip_segments']):
+            self.assertEqual(columns['status'][i], codes[row['status']])
+            self.assertEqual(columns['description'][i], row['description'])
+            self.assertEqual(columns['latitude'][i], row.get('latitude'))
+        self.assertLess(len(response.content), len(json.dumps(rows)))
+
+    def test_zoom_simplifies_geometry_only(self, mock_geocode, mock_route):
+        full = self.client.post(self.url, CalculateTripViewTestCase.payload, content_type='application/json').json()
+        trips._simplified_cache.clear()
+        with mock.patch('api.trips.simplify_polyline', wraps=trips.simplify_polyline) as simplify:
+            for _ in range(2):
+                response = self.client.post(self.url + '?zoom=5', CalculateTripViewTestCase.payload,
+                                            content_type='application/json')
+        self.assertEqual(simplify.call_count, 2)  # One per leg; the second request hits the cache
+        data = response.json()
+        self.assertEqual(data['route']['zoom'], 5)
+        self.assertEqual(data['trip_segments'], full['trip_segments'])
+
+    def test_invalid_zoom(self, mock_geocode, mock_route):
+        for zoom in ('x', '21', '-1'):
+            payload = dict(CalculateTripViewTestCase.payload, zoom=zoom)
+            response = self.client.post(self.url, payload, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_layout(self, mock_geocode, mock_route):
+        payload = dict(CalculateTripViewTestCase.payload, layout='xml')
+        response = self.client.post(self.url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(TRIP_PLAN_PERSIST=False)
+    def test_msgpack_negotiation(self, mock_geocode, mock_route):
+        json_data = self.client.post(self.url, CalculateTripViewTestCase.payload,
+                                     content_type='application/json').json()
+        response = self.client.post(self.url, CalculateTripViewTestCase.payload, content_type='application/json',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json_data)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_histogram_exposition(self):
+        hist = metrics.Histogram('test_seconds', 'Test.', ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            hist.observe(value, stage='x')
+        samples = {(name, labels.get('le')): value for name, labels, value in hist.samples()}
+        self.assertEqual(samples[('test_seconds_bucket', '0.1')], 1)
+        self.assertEqual(samples[('test_seconds_bucket', '1.0')], 3)
+        self.assertEqual(samples[('test_seconds_bucket', '+Inf')], 4)
+        self.assertEqual(samples[('test_seconds_count', None)], 4)
+        self.assertAlmostEqual(samples[('test_seconds_sum', None)], 4.05)
+
+    def test_stages_follow_request_context_into_threads(self):
+        metrics.record_stage('outside', 0.5)
+        token = metrics.start_request()
+        with metrics.stage('outer'):
+            with services.ThreadPoolExecutor(max_workers=2) as executor:
+                for future in [executor.submit(metrics.bind(metrics.record_stage), 'worker', 0.01) for _ in range(3)]:
+                    future.result()
+        timings = metrics.finish_request(token)
+
+        self.assertEqual(set(timings), {'outer', 'worker'})
+        self.assertEqual(timings['worker'][1], 3)
+        header = metrics.server_timing(timings, total=0.1)
+        self.assertIn('worker;dur=30.0;desc="x3"', header)
+        self.assertTrue(header.endswith('total;dur=100.0'))
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage='outside'), 1)
+
+    @mock.patch('api.services.get_route', side_effect=fake_multi_route)
+    @mock.patch('api.services.geocode_location', side_effect=fake_geocode)
+    def test_server_timing_header_and_scrape(self, mock_geocode, mock_route):
+        response = self.client.post(CalculateTripViewTestCase.url, CalculateTripViewTestCase.payload,
+                                    content_type='application/json')
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['geocode', 'route', 'hos', 'interpolate', 'persist', 'total'])
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('trucking_stage_seconds_count{stage="hos"} 1', body)
+        self.assertIn('trucking_http_request_seconds_count{view="calculate-trip",method="POST",status="200"} 1', body)
+        self.assertIn('# TYPE trucking_cache_events_total counter', body)
+        self.assertIn('trucking_cache_entries{cache="route"}', body)
+
+    @mock.patch('api.services.time.sleep')
+    @mock.patch('api.services._http.post')
+    @mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+    def test_external_calls_and_retries(self, mock_post, mock_sleep):
+        services.clear_route_cache()
+        timeout = services.requests.exceptions.Timeout('slow')
+        mock_post.side_effect = [timeout, ors_response()]
+        self.assertIsNotNone(services.get_route_details((41.0, -87.0), (40.0, -86.0)))
+        self.assertEqual(metrics.EXTERNAL_CALLS.value(service='ors', outcome='error'), 1)
+        self.assertEqual(metrics.EXTERNAL_CALLS.value(service='ors', outcome='ok'), 1)
+        self.assertEqual(metrics.EXTERNAL_RETRIES.value(service='ors'), 1)
+        services.clear_route_cache()
+
+
+@mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+class ResilienceTestCase(TestCase):
+    route = ((41.0, -87.0), (40.0, -86.0))
+
+    def setUp(self):
+        resilience.reset()
+        services.clear_route_cache()
+
+    def tearDown(self):
+        resilience.reset()
+        services.clear_route_cache()
+        services._ors_latency.clear()
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = resilience.CircuitBreaker('test', failure_threshold=2, recovery_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, resilience.OPEN)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())    # The half-open probe
+        self.assertFalse(breaker.allow())   # Only one probe at a time
+        breaker.record_failure()
+        self.assertEqual(breaker.state, resilience.OPEN)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, resilience.CLOSED)
+        self.assertEqual(breaker.stats()['trips'], 2)
+
+    def test_retry_budget(self):
+        budget = resilience.RetryBudget('test', ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.try_spend())
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.try_spend())
+        self.assertEqual(budget.exhausted, 1)
+
+    def test_attempt_timeout_follows_deadline(self):
+        self.assertEqual(resilience.attempt_timeout(10), 10)
+        token = resilience.set_deadline(2)
+        try:
+            self.assertLessEqual(resilience.attempt_timeout(10), 2)
+            self.assertEqual(resilience.attempt_timeout(1), 1)
+        finally:
+            resilience.reset_deadline(token)
+        token = resilience.set_deadline(0.1)
+        try:
+            self.assertIsNone(resilience.attempt_timeout(10))
+        finally:
+            resilience.reset_deadline(token)
+        self.assertIsNone(resilience.remaining())
+
+    def test_hedged_returns_first_success(self):
+        calls = []
+
+        def call():
+            calls.append(None)
+            time.sleep(0.3 if len(calls) == 1 else 0.0)
+            return len(calls)
+
+        with mock.patch.object(resilience.HEDGES, 'inc') as mock_inc:
+            result = resilience.hedged(call, 0.05, services._hedge_executor, 'test')
+        self.assertEqual(result, 2)
+        mock_inc.assert_any_call(service='test', outcome='won')
+
+    def test_hedged_fast_call_is_not_duplicated(self):
+        call = mock.Mock(return_value='ok')
+        self.assertEqual(resilience.hedged(call, 1.0, services._hedge_executor, 'test'), 'ok')
+        call.assert_called_once()
+
+    @mock.patch('api.services.time.sleep')
+    @mock.patch('api.services._http.post')
+    def test_open_breaker_fails_fast(self, mock_post, mock_sleep):
+        mock_post.side_effect = services.requests.exceptions.ConnectionError('down')
+        for _ in range(services.ors_breaker.failure_threshold):
+            services.fetch_route_legs(list(self.route))
+        self.assertEqual(services.ors_breaker.state, resilience.OPEN)
+
+        mock_post.reset_mock()
+        self.assertIsNone(services.get_route_details(*self.route))
+        mock_post.assert_not_called()
+
+    @mock.patch('api.services.time.sleep')
+    @mock.patch('api.services._http.post')
+    def test_abandoned_probe_is_released(self, mock_post, mock_sleep):
+        mock_post.side_effect = services.requests.exceptions.ConnectionError('down')
+        for _ in range(services.ors_breaker.failure_threshold):
+            services.fetch_route_legs(list(self.route))
+        self.assertEqual(services.ors_breaker.state, resilience.OPEN)
+
+        with mock.patch.object(services.ors_breaker, 'recovery_timeout', 0.0):
+            # Ready to probe, but the request deadline has passed: no call and no probe taken
+            mock_post.reset_mock()
+            token = resilience.set_deadline(0.001)
+            try:
+                time.sleep(0.01)
+                self.assertIsNone(services.fetch_route_legs(list(self.route)))
+            finally:
+                resilience.reset_deadline(token)
+            mock_post.assert_not_called()
+
+            # A probe that fails locally hands the slot back
+            mock_post.side_effect = RuntimeError('bad response')
+            self.assertIsNone(services.fetch_route_legs(list(self.route)))
+            mock_post.assert_called_once()
+
+            mock_post.reset_mock()
+            mock_post.side_effect = None
+            mock_post.return_value.json.return_value = ors_route_json(list(self.route))
+            self.assertIsNotNone(services.fetch_route_legs(list(self.route)))
+            mock_post.assert_called_once()
+        self.assertEqual(services.ors_breaker.state, resilience.CLOSED)
+
+    def test_cancelled_async_probe_is_released(self):
+        async def hang(request):
+            await asyncio.sleep(10)
+
+        async def cancel_probe():
+            with mock.patch.object(async_services, 'get_async_client',
+                                   side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(hang))):
+                task = asyncio.ensure_future(async_services.afetch_route_legs(list(self.route)))
+                await asyncio.sleep(0.05)
+                self.assertTrue(services.ors_breaker._probing)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        for hedge in (False, True):
+            with self.subTest(hedge=hedge), override_settings(ORS_HEDGE=hedge, ORS_HEDGE_MIN_DELAY=0.01), \
+                    mock.patch.object(services.ors_breaker, 'recovery_timeout', 0.0):
+                resilience.reset()
+                services._ors_latency.clear()
+                for _ in range(services._ors_latency.min_samples):
+                    services._ors_latency.observe(0.01)
+                for _ in range(services.ors_breaker.failure_threshold):
+                    services.ors_breaker.record_failure()
+
+                asyncio.run(cancel_probe())
+                self.assertEqual(services.ors_breaker.state, resilience.HALF_OPEN)
+                self.assertTrue(services.ors_breaker.allow())
+
+    @mock.patch('api.services._http.post')
+    def test_matrix_calls_settle_the_probe(self, mock_post):
+        breaker = services.ors_breaker
+        coords = list(self.route)
+        for error, state in ((RuntimeError('bad body'), resilience.HALF_OPEN),
+                             (services.requests.exceptions.HTTPError(response=mock.Mock(status_code=400)),
+                              resilience.CLOSED),
+                             (services.requests.exceptions.HTTPError(response=mock.Mock(status_code=503)),
+                              resilience.OPEN)):
+            breaker.reset()
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+            with mock.patch.object(breaker, 'recovery_timeout', 0.0):
+                mock_post.side_effect = error
+                self.assertIsNone(services.fetch_matrix(coords, [0], [1]))
+                self.assertEqual(breaker.state, state)
+                if state == resilience.HALF_OPEN:
+                    # The probe slot is free again
+                    self.assertTrue(breaker.allow())
+
+        breaker.reset()
+        with mock.patch.dict(os.environ, {'ORS_API_KEY': ''}), mock.patch.object(breaker, 'allow') as allow:
+            self.assertIsNone(services.fetch_matrix(coords, [0], [1]))
+        allow.assert_not_called()
+
+    @mock.patch('api.services.time.sleep')
+    @mock.patch('api.services._http.post')
+    def test_retries_stop_when_budget_is_spent(self, mock_post, mock_sleep):
+        mock_post.side_effect = services.requests.exceptions.Timeout('slow')
+        services._ors_retry_budget.tokens = 1
+        self.assertIsNone(services.fetch_route_legs(list(self.route)))
+        # One retry paid for by the budget, then no more
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @mock.patch('api.resilience.backoff_delay', return_value=1.0)
+    @mock.patch('api.services.time.sleep')
+    @mock.patch('api.services._http.post')
+    def test_no_retry_past_deadline(self, mock_post, mock_sleep, mock_backoff):
+        mock_post.side_effect = services.requests.exceptions.Timeout('slow')
+        token = resilience.set_deadline(1.2)
+        try:
+            self.assertIsNone(services.fetch_route_legs(list(self.route)))
+        finally:
+            resilience.reset_deadline(token)
+        self.assertLessEqual(mock_post.call_args.kwargs['timeout'], 1.2)
+        mock_post.assert_called_once()
+        mock_sleep.assert_not_called()
+
+
+@override_settings(GAZETTEER_PATH='')
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        services.clear_geocode_cache()
+
+    def tearDown(self):
+        services.clear_geocode_cache()
+
+    @mock.patch.object(services.nominatim_limiter, 'rate', 0)
+    @mock.patch('api.services._http.get')
+    def test_concurrent_lookups_share_one_call(self, mock_get):
+        def slow_search(*args, **kwargs):
+            time.sleep(0.2)
+            return nominatim_response([{'lat': '41.8781', 'lon': '-87.6298'}])
+        mock_get.side_effect = slow_search
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(services.geocode_location('Chicago, IL')))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [(41.8781, -87.6298)] * 8)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(services.geocode_cache_stats()['coalesced'], 7)
+
+    def test_single_flight_shares_errors(self):
+        flight = throttle.SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('upstream down')
+
+        def follower():
+            started.wait()
+            try:
+                flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=follower)
+        thread.start()
+        with self.assertRaises(ValueError):
+            flight.do('key', fail)
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(flight), 0)
+
+    def test_async_single_flight(self):
+        flight = throttle.AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return 'coords'
+
+        async def main():
+            return await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in results], [False] + [True] * 4)
+
+    def test_async_single_flight_survives_a_cancelled_leader(self):
+        flight = throttle.AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return 'coords'
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do('key', fetch))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(flight.do('key', fetch)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(*followers)
+
+        results = asyncio.run(main())
+        # One follower takes over as leader; the others share its call
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True])
+        self.assertEqual({result for result, _ in results}, {'coords'})
+        self.assertEqual(len(flight._calls), 0)
+
+    def test_limiter_spaces_calls(self):
+        limiter = throttle.RateLimiter('test', rate=50, burst=2)
+        started = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        # Two go out at once, the other four wait 20ms each
+        self.assertGreaterEqual(time.monotonic() - started, 0.075)
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_limiter_rejects_long_waits_and_full_queue(self):
+        limiter = throttle.RateLimiter('test', rate=1, max_wait=0.5)
+        limiter.acquire()
+        with self.assertRaises(throttle.RateLimitExceeded):
+            limiter.acquire()
+
+        # With no queue, only calls that needn't wait get through
+        limiter = throttle.RateLimiter('test', rate=1, max_queue=0, max_wait=5)
+        limiter.acquire()
+        with self.assertRaises(throttle.RateLimitExceeded):
+            limiter.acquire()
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_shared_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'nominatim.bucket')
+            worker_a = throttle.RateLimiter('test', rate=1, max_wait=0.5, state_path=path)
+            worker_b = throttle.RateLimiter('test', rate=1, max_wait=0.5, state_path=path)
+            worker_a.acquire()
+            # The other "worker" sees the slot as taken
+            with self.assertRaises(throttle.RateLimitExceeded):
+                worker_b.acquire()
+
+    @mock.patch('api.services._http.get')
+    def test_rate_limited_geocode_is_not_cached(self, mock_get):
+        mock_get.return_value = nominatim_response([{'lat': '41.8781', 'lon': '-87.6298'}])
+        limiter = throttle.RateLimiter('nominatim-test', rate=1, max_wait=0.1)
+        with mock.patch('api.services.nominatim_limiter', limiter):
+            self.assertIsNotNone(services.geocode_location('Chicago, IL'))
+            self.assertIsNone(services.geocode_location('Indianapolis, IN'))
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(services._geocode_cache.get('indianapolis in'), MISSING)
+
+    def test_queue_metrics_exposed(self):
+        body = metrics.render()
+        self.assertIn('trucking_ratelimit_queue_depth{service="nominatim"} 0', body)
+        self.assertIn('# TYPE trucking_ratelimit_wait_seconds histogram', body)
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    def test_regressions_need_min_and_median(self):
+        from benchmarks.suite import compare
+        baseline = {'a': {'min': 1.0, 'median': 1.0}, 'b': {'min': 1.0, 'median': 1.0}}
+        results = {
+            'a': {'min': 1.5, 'median': 1.6},
+            'b': {'min': 1.5, 'median': 1.1},   # One noisy repeat
+            'new': {'min': 9.0, 'median': 9.0},  # Not in the baseline
+        }
+        self.assertEqual(compare(results, baseline, 0.3), [('a', 1.5)])
+
+    def test_fixtures_match_upstream_format(self):
+        from benchmarks.suite import load_fixture
+        legs = services._parse_route_legs(load_fixture('ors_directions.json'), 2)
+        self.assertEqual(len(legs), 2)
+        self.assertTrue(all(leg['distance_miles'] > 100 for leg in legs))
+        searches = load_fixture('nominatim_search.json')
+        self.assertAlmostEqual(services._parse_geocode(searches['Chicago, IL'])[0], 41.8781, places=3)
+
+
+@mock.patch.object(services.nominatim_limiter, 'rate', 0)
+@override_settings(GAZETTEER_PATH='')
+@mock.patch.dict(os.environ, {'ORS_API_KEY': 'test-key'})
+class LoadTestToolsTestCase(TestCase):
+    def setUp(self):
+        from loadtest import fake_upstream
+        config = fake_upstream.build_parser().parse_args([
+            '--port', '0', '--geocode-latency', 'fixed:0', '--route-latency', 'fixed:0', '--vertices', '50',
+        ])
+        self.server = fake_upstream.make_server(config)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = 'http://%s:%s' % self.server.server_address[:2]
+        patcher = mock.patch.multiple(
+            services, NOMINATIM_URL=f'{base}/search', ORS_DIRECTIONS_URL=f'{base}/v2/directions/driving-hgv',
+            ORS_MATRIX_URL=f'{base}/v2/matrix/driving-hgv'
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        services.clear_geocode_cache()
+        services.clear_route_cache()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        services.clear_geocode_cache()
+        services.clear_route_cache()
+
+    def test_app_runs_against_fake_upstream(self):
+        coords, legs = services.geocode_and_route(['Depot A', 'Depot B', 'Depot C'])
+        self.assertTrue(all(coords))
+        self.assertEqual(len(legs), 2)
+        for (start, end), leg in zip(zip(coords, coords[1:]), legs):
+            path = decode_polyline(leg['polyline'])
+            self.assertEqual(len(path), 51)
+            self.assertAlmostEqual(path[0][0], start[0], places=4)
+            self.assertAlmostEqual(path[-1][1], end[1], places=4)
+            self.assertAlmostEqual(leg['distance_miles'], haversine_distance(*start, *end) * 1.25, places=3)
+
+    def test_matrix_against_fake_upstream(self):
+        coords = services.geocode_locations(['Depot A', 'Depot B', 'Depot C'])
+        distances, durations = services.get_distance_matrix(coords)
+        self.assertEqual(distances.shape, (3, 3))
+        self.assertAlmostEqual(distances[0, 2], haversine_distance(*coords[0], *coords[2]) * 1.25, places=3)
+        self.assertAlmostEqual(durations[2, 0], distances[2, 0] / 55, places=6)
+
+    def test_latency_specs_and_percentiles(self):
+        from loadtest.fake_upstream import parse_latency
+        from loadtest.run import percentile
+        self.assertEqual(parse_latency('fixed:250')(), 0.25)
+        self.assertTrue(0.1 <= parse_latency('uniform:100,200')() <= 0.2)
+        with self.assertRaises(Exception):
+            parse_latency('gaussian:1')
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+        self.assertEqual(percentile([7], 99), 7)
+
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter stays per process
+    fcntl = None
+
+from . import metrics, resilience
+
+_limiters = []
+
+WAIT_SECONDS = metrics.histogram(
+    'trucking_ratelimit_wait_seconds', 'Time calls waited for a rate limiter slot.', ('service',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the wait queue is full or a slot is further away than the caller can wait."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function and everyone who arrives while it runs gets its result (or its
+    exception) instead of making the same call again.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> [event, result, error]
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Returns (result, shared): shared is True if another caller's result was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+
+        try:
+            call[1] = fn()
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1], False
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. If the leader is
+    cancelled (its client went away), one waiting caller makes the call
+    again and the rest share that.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> asyncio.Future
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        while (future := self._calls.get(key)) is not None and future.get_loop() is loop:
+            try:
+                # shield(): a cancelled follower must not cancel the leader's call
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # The leader was cancelled, not us: make the call again (or follow whoever does)
+
+        future = self._calls[key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved, in case nobody was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+class RateLimiter:
+    """
+    Token bucket for one upstream service: `rate` calls per second on
+    average and at most `burst` back to back. Callers over the rate wait
+    for their slot in arrival order (recorded as the `<name>_queue` stage);
+    at most `max_queue` may wait at once, and no one waits longer than
+    `max_wait` or past the request deadline.
+
+    With `state_path`, the bucket is kept in that file under an fcntl lock,
+    so every worker process on the host shares one budget. A rate of 0
+    disables the limiter.
+    """
+
+    def __init__(self, name, rate, burst=1, max_queue=50, max_wait=10.0, state_path=''):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.state_path = state_path if fcntl is not None else ''
+        self._lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+        self.reset()
+        _limiters.append(self)
+
+    def reset(self):
+        self._tat = 0.0  # Time (time.time()) at which the bucket is full again
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Blocks until a call may go out; raises RateLimitExceeded instead of queueing too long."""
+        wait = self._reserve()
+        if wait:
+            try:
+                time.sleep(wait)
+            finally:
+                self._release()
+            metrics.record_stage(f'{self.name}_queue', wait)
+        WAIT_SECONDS.observe(wait, service=self.name)
+
+    async def aacquire(self):
+        """Async counterpart of acquire(); waits without blocking the event loop."""
+        wait = self._reserve()
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._release()
+            metrics.record_stage(f'{self.name}_queue', wait)
+        WAIT_SECONDS.observe(wait, service=self.name)
+
+    def _reserve(self):
+        """Books the next free slot and returns the seconds until it starts."""
+        if not self.rate:
+            return 0.0
+        max_wait = self.max_wait
+        left = resilience.remaining()
+        if left is not None:
+            max_wait = min(max_wait, left)
+
+        with self._lock:
+            with self._shared_state():
+                now = time.time()
+                interval = 1.0 / self.rate
+                tat = max(self._tat, now)
+                wait = max(tat - (self.burst - 1) * interval - now, 0.0)
+                if wait and self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise RateLimitExceeded(f'{self.name}: {self.waiting} calls already waiting')
+                if wait > max_wait:
+                    self.rejected += 1
+                    raise RateLimitExceeded(f'{self.name}: next slot is {wait:.1f}s away')
+                self._tat = tat + interval
+            if wait:
+                self.waiting += 1
+        return wait
+
+    def _release(self):
+        with self._lock:
+            self.waiting -= 1
+
+    @contextmanager
+    def _shared_state(self):
+        """Loads _tat from the state file and writes it back, under an exclusive lock."""
+        if not self.state_path:
+            yield
+            return
+        fd = self._state_fd()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            data = os.pread(fd, 8, 0)
+            self._tat = struct.unpack('<d', data)[0] if len(data) == 8 else 0.0
+            yield
+            os.pwrite(fd, struct.pack('<d', self._tat), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _state_fd(self):
+        # flock() locks are shared by forked copies of a descriptor, so each process opens its own
+        if self._fd_pid != os.getpid():
+            self._fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'waiting': self.waiting,
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+                'shared': bool(self.state_path),
+            }
+
+
+def _throttle_metrics():
+    depth = [({'service': limiter.name}, limiter.waiting) for limiter in _limiters]
+    rejected = [({'service': limiter.name}, limiter.rejected) for limiter in _limiters]
+    return [
+        ('trucking_ratelimit_queue_depth', 'gauge', 'Calls waiting for a rate limiter slot.', depth),
+        ('trucking_ratelimit_rejected_total', 'counter', 'Calls refused by a full or too-slow rate limiter.',
+         rejected),
+    ]
+
+
+metrics.register_collector(_throttle_metrics)
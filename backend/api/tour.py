@@ -0,0 +1,88 @@
+"""
+Stop-order heuristics for multi-stop trips. The first and last stops are
+fixed; the stops in between are reordered to shorten the route under a
+pairwise cost matrix (which need not be symmetric).
+"""
+import numpy as np
+
+
+def route_cost(matrix, order):
+    """Total cost of visiting stops in `order` (a sequence of matrix indices)."""
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbour(matrix):
+    """Order that always drives to the closest unvisited intermediate stop next."""
+    n = len(matrix)
+    order = [0]
+    unvisited = set(range(1, n - 1))
+    while unvisited:
+        here = order[-1]
+        nearest = min(unvisited, key=lambda stop: (matrix[here, stop], stop))
+        order.append(nearest)
+        unvisited.remove(nearest)
+    order.append(n - 1)
+    return order
+
+
+def two_opt(matrix, order):
+    """
+    Reverses runs of intermediate stops while that shortens the route
+    (first improvement). Reversal costs are recomputed in full because the
+    matrix may be asymmetric.
+    """
+    order = list(order)
+    best = route_cost(matrix, order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(order) - 2):
+            for j in range(i + 1, len(order) - 1):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = route_cost(matrix, candidate)
+                if cost < best - 1e-9:
+                    order, best, improved = candidate, cost, True
+    return order
+
+
+def or_opt(matrix, order, max_run=3):
+    """Moves runs of up to max_run consecutive intermediate stops to a cheaper place in the route."""
+    order = list(order)
+    best = route_cost(matrix, order)
+    improved = True
+    while improved:
+        improved = False
+        for run in range(1, max_run + 1):
+            for i in range(1, len(order) - run):
+                moved = order[i:i + run]
+                rest = order[:i] + order[i + run:]
+                for j in range(1, len(rest)):
+                    if j == i:
+                        continue
+                    candidate = rest[:j] + moved + rest[j:]
+                    cost = route_cost(matrix, candidate)
+                    if cost < best - 1e-9:
+                        order, best, improved = candidate, cost, True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return order
+
+
+def optimize_order(matrix):
+    """
+    Nearest-neighbour order improved with 2-opt and Or-opt until neither
+    helps. Returns a list of matrix indices starting at 0 and ending at n - 1.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if len(matrix) <= 3:
+        return list(range(len(matrix)))
+    order = nearest_neighbour(matrix)
+    while True:
+        cost = route_cost(matrix, order)
+        order = or_opt(matrix, two_opt(matrix, order))
+        if route_cost(matrix, order) >= cost - 1e-9:
+            return order
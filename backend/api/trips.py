@@ -0,0 +1,395 @@
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import metrics
+from .eld import daily_sheets
+from .cache import MISSING, TTLCache
+from .utils import (
+    HOSState, RouteGeometry, Segment, plan_multi_stop_segments, plan_segments, resume_segments, segments_to_columns,
+    simplify_polyline, zoom_tolerance
+)
+
+_process_pool = None
+
+GEOCODE_ERROR = 'Could not geocode one or more locations.'
+ROUTING_ERROR = 'Routing service is temporarily unavailable. Please try again in a moment.'
+
+# Simplified geometries keyed by (encoded polyline, tolerance)
+_simplified_cache = TTLCache(maxsize=settings.SIMPLIFY_CACHE_SIZE, ttl=settings.ROUTE_CACHE_TTL)
+
+# Result of the HOS simulation over routed legs, before it is serialized
+PlannedTrip = namedtuple('PlannedTrip', ['routes', 'hours_used', 'segments', 'geometry', 'cycle_hours_consumed'])
+
+# Stored trip plans never change, so their routes, geometry and segments are kept in memory once loaded
+StoredTrip = namedtuple('StoredTrip', ['routes', 'geometry', 'segments'])
+_stored_trips = TTLCache(maxsize=settings.TRIP_PLAN_CACHE_SIZE, ttl=settings.ROUTE_CACHE_TTL)
+
+
+def parse_trip_input(data):
+    """
+    Validates a trip request body.
+    Returns ([current, pickup, dropoff], hours_used) or raises ValueError
+    with a message suitable for a 400 response.
+    """
+    current_loc = data.get('current_location')
+    pickup_loc = data.get('pickup_location')
+    dropoff_loc = data.get('dropoff_location')
+    hours_used = data.get('hours_used')
+
+    if not all([current_loc, pickup_loc, dropoff_loc]):
+        raise ValueError('All locations are required.')
+
+    return [current_loc, pickup_loc, dropoff_loc], parse_hours_used(hours_used)
+
+
+def parse_hours_used(value):
+    """Validates the 70-hour cycle hours already used."""
+    try:
+        hours_used = float(value)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid hours_used value.')
+    if hours_used < 0 or hours_used > 70:
+        raise ValueError('Hours used must be between 0 and 70.')
+    if hours_used >= 70:
+        raise ValueError('No driving hours available (>= 70 used).')
+    return hours_used
+
+
+DEFAULT_DWELL_HOURS = 1.0
+
+def parse_multi_stop_input(data):
+    """
+    Validates a multi-stop trip body: stops (a list of {location,
+    dwell_hours}, from the driver's current location to the final stop),
+    hours_used and an optional optimize flag. dwell_hours is the time on
+    duty at a stop; it defaults to 0 at the first stop and 1 elsewhere.
+    Returns (locations, dwell_hours, hours_used, optimize) or raises
+    ValueError with a message suitable for a 400 response.
+    """
+    stops = data.get('stops')
+    max_stops = settings.MULTI_STOP_MAX_STOPS
+    if not isinstance(stops, list) or not 2 <= len(stops) <= max_stops:
+        raise ValueError(f'stops must be a list of 2 to {max_stops} stops.')
+
+    locations, dwell_hours = [], []
+    for i, stop in enumerate(stops):
+        if not isinstance(stop, dict) or not stop.get('location'):
+            raise ValueError('Each stop needs a location.')
+        dwell = stop.get('dwell_hours')
+        if dwell in (None, ''):
+            dwell = 0.0 if i == 0 else DEFAULT_DWELL_HOURS
+        try:
+            dwell = float(dwell)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid dwell_hours value.')
+        if not 0 <= dwell <= 24:
+            raise ValueError('dwell_hours must be between 0 and 24.')
+        locations.append(str(stop['location']))
+        dwell_hours.append(dwell)
+
+    hours_used = parse_hours_used(data.get('hours_used'))
+    optimize = str(data.get('optimize', False)).lower() in ('true', '1', 'yes')
+    return locations, dwell_hours, hours_used, optimize
+
+
+LAYOUTS = ('rows', 'columnar')
+
+def parse_layout(value):
+    """Validates the optional response layout ('rows' by default)."""
+    layout = value or 'rows'
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of: {', '.join(LAYOUTS)}.")
+    return layout
+
+
+MAX_ZOOM = 20
+
+def parse_zoom(value):
+    """Validates the optional map zoom level used to simplify returned geometry."""
+    if value in (None, ''):
+        return None
+    try:
+        zoom = int(value)
+    except (ValueError, TypeError):
+        raise ValueError('zoom must be an integer.')
+    if zoom < 0 or zoom > MAX_ZOOM:
+        raise ValueError(f'zoom must be between 0 and {MAX_ZOOM}.')
+    return zoom
+
+
+def parse_log_sheets(value):
+    """Whether the trip response should include log_sheets (off by default)."""
+    return str(value).lower() in ('true', '1', 'yes')
+
+
+def simplified_polyline(polyline, zoom):
+    """Cached Douglas-Peucker simplification of a leg for a map zoom level."""
+    tolerance = zoom_tolerance(zoom, settings.SIMPLIFY_PIXEL_TOLERANCE)
+    key = (polyline, tolerance)
+    simplified = _simplified_cache.get(key)
+    if simplified is MISSING:
+        simplified = simplify_polyline(polyline, tolerance)
+        _simplified_cache.set(key, simplified)
+    return simplified
+
+
+def build_trip_plan(routes, hours_used, layout='rows', zoom=None):
+    """
+    Runs the HOS simulation over the routed legs and places stops on the map.
+    routes: [current -> pickup, pickup -> dropoff] route dicts
+    layout: 'rows' returns segment dicts (as trip_segments and eld_logs);
+            'columnar' returns one array per field under 'segments' instead
+    zoom: if given, the returned leg polylines are simplified for that map
+          zoom level; stops are always placed on the full-resolution path
+    Returns the trip response dict; raises ValueError if no cycle hours are left.
+    """
+    return render_trip_plan(plan_trip(routes, hours_used), layout, zoom)
+
+
+def plan_trip(routes, hours_used):
+    """Runs the HOS simulation and stop placement; returns a PlannedTrip."""
+    segments, cycle_hours_consumed = plan_trip_segments(routes, hours_used)
+    geometry = locate_trip_stops(routes, segments)
+    return PlannedTrip(routes, hours_used, segments, geometry, cycle_hours_consumed)
+
+
+def plan_trip_segments(routes, hours_used):
+    """
+    First stage of plan_trip: the HOS timeline over the routed legs.
+    Returns (segments, cycle_hours_consumed); raises ValueError if no cycle
+    hours are left.
+    """
+    total_dist = sum(route['distance_miles'] for route in routes)
+
+    # Following the spec's worked example, the plan starts with the 1h pickup
+    # and then drives the combined distance of both legs (Current -> Pickup -> Dropoff).
+    with metrics.stage('hos'):
+        return plan_segments(total_dist, hours_used)
+
+
+def locate_trip_stops(routes, segments):
+    """
+    Second stage of plan_trip: decodes the legs into one array-backed path
+    and assigns coordinates to the stops in one lookup along it. Returns the
+    RouteGeometry.
+    """
+    with metrics.stage('interpolate'):
+        geometry = RouteGeometry.from_polylines(*(route['polyline'] for route in routes))
+        geometry.locate_stops(segments)
+    return geometry
+
+
+def plan_multi_stop_trip(routes, dwell_hours, hours_used, locations):
+    """
+    plan_trip for a route through len(routes) + 1 stops, with dwell_hours
+    on duty at each stop (see utils.plan_multi_stop_segments).
+    """
+    with metrics.stage('hos'):
+        segments, cycle_hours_consumed = plan_multi_stop_segments(
+            [route['distance_miles'] for route in routes], dwell_hours, hours_used, locations
+        )
+    geometry = locate_trip_stops(routes, segments)
+    return PlannedTrip(routes, hours_used, segments, geometry, cycle_hours_consumed)
+
+
+def render_timeline(segments, hours_used, cycle_hours_consumed, layout='rows'):
+    """
+    The HOS part of the trip response: total_trip_hours, available_hours
+    and the segments, as trip_segments rows or columnar 'segments'.
+    """
+    timeline = {
+        'available_hours': 70 - (float(hours_used) + cycle_hours_consumed),
+        'total_trip_hours': segments[-1].end_time,
+    }
+    if layout == 'columnar':
+        timeline['segments'] = segments_to_columns(segments)
+    else:
+        timeline['trip_segments'] = [segment.to_dict() for segment in segments]
+    return timeline
+
+
+def render_trip_plan(planned, layout='rows', zoom=None, log_sheets=False):
+    """
+    Serializes a PlannedTrip as the trip response dict (see build_trip_plan).
+    Leg k's polyline is route.polyline_leg<k> (polyline_leg1 and
+    polyline_leg2 for a single trip). The daily ELD sheets are added as
+    log_sheets only if asked for; otherwise clients fetch them from the
+    stored plan's logs endpoint.
+    """
+    segments = planned.segments
+    plan = {
+        'route': {
+            'total_distance': sum(route['distance_miles'] for route in planned.routes),
+            'total_duration': segments[-1].end_time,
+            **{f'polyline_leg{i}': route['polyline'] for i, route in enumerate(planned.routes, 1)},
+        },
+        **render_timeline(segments, planned.hours_used, planned.cycle_hours_consumed, layout),
+    }
+    if zoom is not None:
+        with metrics.stage('simplify'):
+            for i, route in enumerate(planned.routes, 1):
+                plan['route'][f'polyline_leg{i}'] = simplified_polyline(route['polyline'], zoom)
+        plan['route']['zoom'] = zoom
+
+    if layout != 'columnar':
+        plan['eld_logs'] = plan['trip_segments']
+    if log_sheets:
+        with metrics.stage('log_sheets'):
+            plan['log_sheets'] = daily_sheets(segments)
+    return plan
+
+
+def publish_trip_plan(locations, planned, layout='rows', zoom=None, log_sheets=False):
+    """render_trip_plan, plus the stored plan's trip_plan_id when TRIP_PLAN_PERSIST is on."""
+    plan = render_trip_plan(planned, layout, zoom, log_sheets)
+    if settings.TRIP_PLAN_PERSIST:
+        plan['trip_plan_id'] = save_trip_plan(locations, planned)
+    return plan
+
+
+def save_trip_plan(locations, planned):
+    """Stores a PlannedTrip for later re-planning; returns its id as a string, or None on a DB error."""
+    # Imported here: batch planning processes import this module without setting up Django
+    from .models import TripPlan
+
+    route1, route2 = planned.routes
+    try:
+        with metrics.stage('persist'):
+            trip_plan = TripPlan.objects.create(
+                locations=list(locations),
+                hours_used=float(planned.hours_used),
+                leg_distances=[route['distance_miles'] for route in planned.routes],
+                polyline_leg1=route1['polyline'],
+                polyline_leg2=route2['polyline'],
+                cumulative_miles=planned.geometry.cumulative_bytes(),
+                segments=[segment.to_dict() for segment in planned.segments],
+            )
+    except DatabaseError as e:
+        print(f"Trip plan save error: {e}")
+        return None
+    _stored_trips.set(str(trip_plan.id), StoredTrip(planned.routes, planned.geometry, planned.segments))
+    return str(trip_plan.id)
+
+
+def load_stored_trip(plan_id):
+    """Returns the StoredTrip for a saved plan id, or None if there is no such plan."""
+    from .models import TripPlan
+
+    plan_id = str(plan_id)
+    stored = _stored_trips.get(plan_id)
+    if stored is not MISSING:
+        return stored
+    trip_plan = TripPlan.objects.filter(pk=plan_id).first()
+    if trip_plan is None:
+        return None
+    routes = [
+        {'distance_miles': distance, 'polyline': polyline}
+        for distance, polyline in zip(trip_plan.leg_distances, (trip_plan.polyline_leg1, trip_plan.polyline_leg2))
+    ]
+    geometry = RouteGeometry.from_polylines(
+        *(route['polyline'] for route in routes), cumulative=bytes(trip_plan.cumulative_miles)
+    )
+    stored = StoredTrip(routes, geometry, [Segment.from_dict(row) for row in trip_plan.segments])
+    _stored_trips.set(plan_id, stored)
+    return stored
+
+
+PROGRESS_CLOCKS = ('elapsed_hours', 'driving_since_break', 'driving_today', 'on_duty_today', 'miles_since_fuel')
+
+def parse_progress(data, total_distance):
+    """
+    Validates a re-plan body: miles_driven and hours_used (the 70-hour cycle
+    hours used so far), plus optional clock counters (PROGRESS_CLOCKS).
+    Returns (HOSState, hours_used) or raises ValueError with a message
+    suitable for a 400 response.
+    """
+    values = {}
+    for name in ('miles_driven', 'hours_used') + PROGRESS_CLOCKS:
+        value = data.get(name)
+        if value in (None, ''):
+            if name in ('miles_driven', 'hours_used'):
+                raise ValueError(f'{name} is required.')
+            continue
+        try:
+            values[name] = float(value)
+        except (ValueError, TypeError):
+            raise ValueError(f'Invalid {name} value.')
+        if values[name] < 0:
+            raise ValueError(f'{name} must not be negative.')
+
+    if values['miles_driven'] > total_distance:
+        raise ValueError(f'miles_driven must be at most the trip distance ({total_distance:.1f}).')
+    if values['hours_used'] >= 70:
+        raise ValueError('No driving hours available (>= 70 used).')
+
+    state = HOSState(
+        total_distance - values['miles_driven'],
+        trip_time=values.get('elapsed_hours', 0.0),
+        driving_since_break=values.get('driving_since_break', 0.0),
+        driving_daily=values.get('driving_today', 0.0),
+        on_duty_daily=values.get('on_duty_today', 0.0),
+        # Fuel stops fall every 1000 miles from the origin unless the driver says otherwise
+        miles_since_fuel=values.get('miles_since_fuel', values['miles_driven'] % 1000.0),
+    )
+    return state, values['hours_used']
+
+
+def replan_trip(stored, data):
+    """
+    Re-plans the rest of a stored trip from the driver's progress (see
+    parse_progress) using the stored geometry: no geocoding or routing.
+    Returns a PlannedTrip whose segments start at the checkpoint.
+    """
+    total_distance = sum(route['distance_miles'] for route in stored.routes)
+    state, hours_used = parse_progress(data, total_distance)
+    miles_driven = total_distance - state.remaining_distance
+
+    with metrics.stage('hos'):
+        segments = resume_segments(state, 70.0 - hours_used)
+    if not segments:
+        raise ValueError('Not enough driving hours left to re-plan the trip.')
+    with metrics.stage('interpolate'):
+        stored.geometry.locate_stops(segments, start_miles=miles_driven)
+    return PlannedTrip(stored.routes, hours_used, segments, stored.geometry, state.cycle_hours_consumed)
+
+
+def plan_trips(jobs, layout='rows', zoom=None):
+    """
+    Runs build_trip_plan for many trips.
+    jobs: list of (routes, hours_used)
+    Returns one trip response dict, or {'error': ...}, per job in input order.
+    Batches of at least TRIP_BATCH_PROCESS_THRESHOLD trips are spread over a
+    process pool so CPU-bound planning scales with cores.
+    """
+    plan = partial(_plan_or_error, layout=layout, zoom=zoom)
+    if len(jobs) < settings.TRIP_BATCH_PROCESS_THRESHOLD or settings.TRIP_BATCH_PROCESSES < 2:
+        return [plan(job) for job in jobs]
+
+    pool = _get_process_pool()
+    chunksize = max(1, len(jobs) // (settings.TRIP_BATCH_PROCESSES * 4))
+    return list(pool.map(plan, jobs, chunksize=chunksize))
+
+
+def _plan_or_error(job, layout='rows', zoom=None):
+    routes, hours_used = job
+    try:
+        return build_trip_plan(routes, hours_used, layout, zoom)
+    except ValueError as e:
+        return {'error': str(e)}
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: workers only import api.trips, and don't inherit the web
+        # worker's threads or open connections
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.TRIP_BATCH_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _process_pool
@@ -1,6 +1,25 @@
 from django.urls import path
-from .views import CalculateTripView
+from .views import (
+    AsyncCalculateTripView, BatchCalculateTripView, CacheStatsView, CalculateTripStreamView, CalculateTripView,
+    DispatchView, LocationAutocompleteView, MultiStopTripView, ReplanTripView, TripJobCancelView, TripJobView,
+    TripJobsView, TripLogSheetRenderView, TripLogSheetsView
+)
 
 urlpatterns = [
     path('calculate-trip/', CalculateTripView.as_view(), name='calculate-trip'),
+    path('calculate-trip/batch/', BatchCalculateTripView.as_view(), name='calculate-trip-batch'),
+    path('calculate-trip/multi-stop/', MultiStopTripView.as_view(), name='calculate-trip-multi-stop'),
+    path('calculate-trip/stream/', CalculateTripStreamView.as_view(), name='calculate-trip-stream'),
+    path('calculate-trip-async/', AsyncCalculateTripView.as_view(), name='calculate-trip-async'),
+    path('dispatch/', DispatchView.as_view(), name='dispatch'),
+    path('trip-jobs/', TripJobsView.as_view(), name='trip-jobs'),
+    path('trip-jobs/<uuid:job_id>/', TripJobView.as_view(), name='trip-job'),
+    path('trip-jobs/<uuid:job_id>/cancel/', TripJobCancelView.as_view(), name='trip-job-cancel'),
+    path('trip-plans/<uuid:plan_id>/replan/', ReplanTripView.as_view(), name='trip-plan-replan'),
+    path('trip-plans/<uuid:plan_id>/logs/', TripLogSheetsView.as_view(), name='trip-plan-logs'),
+    path('trip-plans/<uuid:plan_id>/logs/<int:day>.<str:fmt>', TripLogSheetRenderView.as_view(),
+         name='trip-plan-log-sheet'),
+    path('trip-plans/<uuid:plan_id>/logs.<str:fmt>', TripLogSheetRenderView.as_view(), name='trip-plan-log-book'),
+    path('locations/autocomplete/', LocationAutocompleteView.as_view(), name='location-autocomplete'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
 ]
@@ -1,4 +1,13 @@
 import math
+import re
+from enum import IntEnum
+from itertools import accumulate
+
+import numpy as np
+
+def normalize_location(location_name):
+    """Normalizes a free-text location for use as a lookup key (case, punctuation, spacing)."""
+    return ' '.join(re.sub(r'[^\w]+', ' ', str(location_name).lower()).split())
 
 def decode_polyline(polyline_str):
     """Decodes a Google-encoded polyline string into a list of (lat, lng) tuples."""
@@ -42,6 +51,122 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
 
+def encode_polyline(coordinates):
+    """Encodes a sequence of (lat, lng) tuples as a Google-encoded polyline string."""
+    chunks = []
+    prev_lat, prev_lng = 0, 0
+    for lat, lng in coordinates:
+        lat_e5 = int(round(lat * 100000))
+        lng_e5 = int(round(lng * 100000))
+        for delta in (lat_e5 - prev_lat, lng_e5 - prev_lng):
+            value = ~(delta << 1) if delta < 0 else (delta << 1)
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lng = lat_e5, lng_e5
+    return ''.join(chunks)
+
+def decode_polyline_arrays(polyline_str):
+    """
+    Decodes a Google-encoded polyline into contiguous float64 (lats, lngs) arrays.
+    Vectorized equivalent of decode_polyline for long routes.
+    """
+    data = np.frombuffer(polyline_str.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    # Each value ends on a byte without the continuation bit
+    ends = np.flatnonzero(data < 0x20)
+    if ends.size < 2:
+        return np.empty(0), np.empty(0)
+    # Drop a trailing unpaired value
+    ends = ends[:ends.size - ends.size % 2]
+    data = data[:ends[-1] + 1]
+
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    position = np.arange(data.size) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((data & 0x1f) << (5 * position), starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1).reshape(-1, 2)
+
+    coords = np.cumsum(deltas, axis=0) / 100000.0
+    return np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1])
+
+def haversine_to(lat, lng, lats, lngs):
+    """Distances in miles from one point to each point of lat/lng arrays."""
+    R = 3958.8  # Earth radius in miles
+    lat_rad = np.radians(lats)
+    dlat = lat_rad - math.radians(lat)
+    dlon = np.radians(np.asarray(lngs) - lng)
+    a = np.sin(dlat / 2)**2 + math.cos(math.radians(lat)) * np.cos(lat_rad) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+def haversine_segments(lats, lngs):
+    """Calculates the length in miles of every segment of a path given as lat/lng arrays."""
+    R = 3958.8  # Earth radius in miles
+    lat_rad = np.radians(lats)
+    dlat = np.radians(np.diff(lats))
+    dlon = np.radians(np.diff(lngs))
+    a = np.sin(dlat / 2)**2 + np.cos(lat_rad[:-1]) * np.cos(lat_rad[1:]) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+def zoom_tolerance(zoom, pixels=1.0):
+    """
+    Simplification tolerance in degrees for a Web Mercator zoom level:
+    the width of `pixels` screen pixels at that zoom (256px tiles).
+    """
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+def simplify_path(lats, lngs, tolerance):
+    """
+    Douglas-Peucker simplification of a lat/lng path.
+    tolerance: max deviation in degrees (longitudes are scaled by cos(latitude)
+    so the tolerance is roughly the same in both directions).
+    Returns the sorted indices of the vertices to keep; the first and last
+    vertex are always kept.
+    """
+    n = lats.size
+    if n < 3 or tolerance <= 0:
+        return np.arange(n)
+
+    x = lngs * math.cos(math.radians(float(np.mean(lats))))
+    y = lats
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            split = first + 1 + k
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return np.flatnonzero(keep)
+
+def simplify_polyline(polyline_str, tolerance):
+    """Returns the encoded polyline simplified to the given tolerance in degrees."""
+    lats, lngs = decode_polyline_arrays(polyline_str)
+    keep = simplify_path(lats, lngs, tolerance)
+    if keep.size == lats.size:
+        return polyline_str
+    return encode_polyline(zip(lats[keep].tolist(), lngs[keep].tolist()))
+
 def get_coordinate_at_distance(path, target_miles):
     """
     Interpolates a coordinate along a path at a specific distance from the start.
@@ -73,59 +198,345 @@ def get_coordinate_at_distance(path, target_miles):
         
     return path[-1] # Return end if target > total length
 
+
+class RouteGeometry:
+    """
+    Cumulative-distance index over a decoded path.
+
+    Segment lengths are computed once and stored as a prefix sum of miles,
+    so each "coordinate at distance X" lookup is a binary search instead of
+    a walk from the start of the path. Results match get_coordinate_at_distance.
+    """
+
+    def __init__(self, path=()):
+        path = list(path)
+        lengths = [
+            haversine_distance(p1[0], p1[1], p2[0], p2[1])
+            for p1, p2 in zip(path, path[1:])
+        ]
+        self._set_arrays(
+            [p[0] for p in path],
+            [p[1] for p in path],
+            list(accumulate(lengths, initial=0.0)),
+            lengths
+        )
+
+    @classmethod
+    def from_arrays(cls, lats, lngs):
+        """Builds the index from lat/lng arrays using the vectorized haversine kernel."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        lengths = haversine_segments(lats, lngs) if lats.size > 1 else np.empty(0)
+        geometry = cls.__new__(cls)
+        geometry._set_arrays(lats, lngs, np.concatenate(([0.0], np.cumsum(lengths))), lengths)
+        return geometry
+
+    @classmethod
+    def from_polylines(cls, *polylines, cumulative=None):
+        """
+        Decodes and concatenates one or more encoded polylines into a single index.
+        cumulative: prefix-sum miles saved from an earlier index of the same
+        polylines (see cumulative_bytes), so distances aren't recomputed.
+        """
+        decoded = [decode_polyline_arrays(p) for p in polylines]
+        lats = np.concatenate([d[0] for d in decoded]) if decoded else np.empty(0)
+        lngs = np.concatenate([d[1] for d in decoded]) if decoded else np.empty(0)
+        if cumulative is None:
+            return cls.from_arrays(lats, lngs)
+        cumulative = np.frombuffer(cumulative, dtype='<f8') if isinstance(cumulative, bytes) else cumulative
+        if len(cumulative) != lats.size:
+            raise ValueError('Cumulative distances do not match the polylines.')
+        geometry = cls.__new__(cls)
+        geometry._set_arrays(lats, lngs, cumulative, np.diff(cumulative))
+        return geometry
+
+    def cumulative_bytes(self):
+        """Prefix-sum miles as little-endian float64, for storage next to the polylines."""
+        return self.cumulative.astype('<f8').tobytes()
+
+    def _set_arrays(self, lats, lngs, cumulative, lengths):
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lngs = np.ascontiguousarray(lngs, dtype=np.float64)
+        self.cumulative = np.ascontiguousarray(cumulative, dtype=np.float64)
+        self.lengths = np.ascontiguousarray(lengths, dtype=np.float64)
+
+    @property
+    def path(self):
+        return list(zip(self.lats.tolist(), self.lngs.tolist()))
+
+    @property
+    def total_miles(self):
+        return float(self.cumulative[-1])
+
+    def coordinate_at(self, target_miles):
+        """Returns the (lat, lng) at target_miles from the start of the path."""
+        return self.coordinates_at([target_miles])[0]
+
+    def coordinates_at(self, distances):
+        """
+        Returns coordinates for a sequence of distances from the start of the path,
+        resolved together with one vectorized binary search.
+        """
+        targets = np.asarray(distances, dtype=np.float64)
+        if not self.lats.size:
+            return [None] * targets.size
+        if not targets.size:
+            return []
+
+        # First vertex whose cumulative distance reaches each target
+        j = np.searchsorted(self.cumulative, targets, side='left')
+        j = np.clip(j, 1, max(self.lats.size - 1, 1))
+        i = j - 1
+
+        if self.lengths.size:
+            dist_segment = self.lengths[i]
+            moving = dist_segment != 0
+            ratio = np.zeros_like(targets)
+            np.divide(targets - self.cumulative[i], dist_segment, out=ratio, where=moving)
+            lats = self.lats[i] + (self.lats[j] - self.lats[i]) * ratio
+            lngs = self.lngs[i] + (self.lngs[j] - self.lngs[i]) * ratio
+            lats = np.where(moving, lats, self.lats[i])
+            lngs = np.where(moving, lngs, self.lngs[i])
+        else:
+            lats = np.full(targets.size, self.lats[0])
+            lngs = np.full(targets.size, self.lngs[0])
+
+        # Before the start / past the end of the path
+        before = targets <= 0
+        past = targets > self.cumulative[-1]
+        lats = np.where(before, self.lats[0], np.where(past, self.lats[-1], lats))
+        lngs = np.where(before, self.lngs[0], np.where(past, self.lngs[-1], lngs))
+        return list(zip(lats.tolist(), lngs.tolist()))
+
+    def locate_stops(self, segments, start_miles=0.0):
+        """
+        Assigns latitude/longitude to every non-driving Segment of a plan
+        in one pass over the segments and one lookup over the path.
+        start_miles is where on the path the first segment begins.
+        """
+        stops = []
+        distances = []
+        driven_dist = float(start_miles)
+        for segment in segments:
+            if segment.status == SegmentStatus.DRIVING:
+                driven_dist += segment.distance_miles
+            else:
+                stops.append(segment)
+                distances.append(driven_dist)
+
+        for segment, coord in zip(stops, self.coordinates_at(distances)):
+            if coord:
+                segment.latitude, segment.longitude = coord
+        return segments
+
+class SegmentStatus(IntEnum):
+    """Duty status codes, in ELD grid row order."""
+    OFF_DUTY = 0
+    SLEEPER = 1
+    DRIVING = 2
+    ON_DUTY = 3
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+
+class Segment:
+    """
+    Compact trip segment. Serializes to the same dict the API has always
+    returned via to_dict(), or to parallel arrays via segments_to_columns().
+    """
+    __slots__ = ('status', 'start_time', 'duration', 'description', 'distance_miles', 'latitude', 'longitude')
+
+    def __init__(self, status, start_time, duration, description, distance_miles=0.0):
+        self.status = status
+        self.start_time = start_time
+        self.duration = duration
+        self.description = description
+        self.distance_miles = distance_miles
+        self.latitude = None
+        self.longitude = None
+
+    def __repr__(self):
+        return f"Segment({self.status.label}, {self.start_time:.2f}h +{self.duration}h, {self.description!r})"
+
+    @property
+    def end_time(self):
+        return self.start_time + self.duration
+
+    def to_dict(self):
+        data = {
+            'type': self.status.label,
+            'status': self.status.label,
+            'start_time': self.start_time,
+            'duration': self.duration,
+            'description': self.description,
+            'distance_miles': self.distance_miles
+        }
+        if self.latitude is not None:
+            data['latitude'] = self.latitude
+            data['longitude'] = self.longitude
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds a Segment from its to_dict() form (e.g. a stored TripPlan)."""
+        segment = cls(
+            SegmentStatus[data['status'].upper()], data['start_time'], data['duration'], data['description'],
+            data.get('distance_miles', 0.0)
+        )
+        segment.latitude = data.get('latitude')
+        segment.longitude = data.get('longitude')
+        return segment
+
+
+SEGMENT_COLUMNS = ('status', 'start_time', 'duration', 'description', 'distance_miles', 'latitude', 'longitude')
+
+def segments_to_columns(segments):
+    """
+    Serializes segments as parallel arrays, one per field; statuses are
+    SegmentStatus codes (see status_codes).
+    """
+    columns = {name: [getattr(segment, name) for segment in segments] for name in SEGMENT_COLUMNS}
+    columns['status'] = [int(code) for code in columns['status']]
+    columns['status_codes'] = {status.label: int(status) for status in SegmentStatus}
+    return columns
+
 def calculate_trip_segments(distance_miles, hours_already_used):
     """
     Calculate trip segments with HOS compliance and fuel stops.
-    Returns segments list and updated cycle hours used.
+    Returns segments list (of dicts) and updated cycle hours used.
+    """
+    segments, cycle_hours_consumed = plan_segments(distance_miles, hours_already_used)
+    return [segment.to_dict() for segment in segments], cycle_hours_consumed
+
+class HOSState:
+    """
+    Clock counters of the HOS simulation at one point of a trip.
+    plan_segments() starts from a fresh state; resume_segments() continues
+    from any state, e.g. a driver's progress reported mid-trip.
+    """
+    __slots__ = (
+        'trip_time', 'remaining_distance', 'driving_since_break', 'driving_daily', 'on_duty_daily',
+        'cycle_hours_consumed', 'miles_since_fuel'
+    )
+
+    def __init__(self, remaining_distance, trip_time=0.0, driving_since_break=0.0, driving_daily=0.0,
+                 on_duty_daily=0.0, cycle_hours_consumed=0.0, miles_since_fuel=0.0):
+        self.remaining_distance = float(remaining_distance)
+        self.trip_time = trip_time
+        self.driving_since_break = driving_since_break
+        self.driving_daily = driving_daily
+        self.on_duty_daily = on_duty_daily
+        self.cycle_hours_consumed = cycle_hours_consumed
+        self.miles_since_fuel = miles_since_fuel
+
+    def __repr__(self):
+        return f"HOSState({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+def plan_segments(distance_miles, hours_already_used):
+    """
+    Same as calculate_trip_segments, but returns compact Segment objects.
     """
-    segments = []
-    
     # 70-hour / 8-day limit check
     available_cycle_hours = 70.0 - float(hours_already_used)
     if available_cycle_hours <= 0:
         raise ValueError("No hours available in 70-hour cycle")
 
-    remaining_distance = float(distance_miles)
-    avg_speed = 60.0  # mph
-    
-    current_trip_time = 0.0
-    
-    # Duration tracking
-    driving_since_break = 0.0
-    driving_daily = 0.0
-    on_duty_daily = 0.0
-    cycle_hours_consumed = 0.0
-    
-    miles_since_fuel = 0.0
-    
+    state = HOSState(distance_miles)
+
     # --- 1. PICKUP (1 Hour On Duty) ---
-    segments.append({
-        'type': 'on_duty',
-        'status': 'on_duty',
-        'start_time': current_trip_time,
-        'duration': 1.0,
-        'description': 'Pickup at Origin',
-        'distance_miles': 0.0
-    })
-    current_trip_time += 1.0
-    on_duty_daily += 1.0
-    cycle_hours_consumed += 1.0
-    
+    segments = [Segment(SegmentStatus.ON_DUTY, state.trip_time, 1.0, 'Pickup at Origin', 0.0)]
+    state.trip_time += 1.0
+    state.on_duty_daily += 1.0
+    state.cycle_hours_consumed += 1.0
+
+    segments.extend(resume_segments(state, available_cycle_hours))
+    return segments, state.cycle_hours_consumed
+
+
+def plan_multi_stop_segments(leg_distances, dwell_hours, hours_already_used, names):
+    """
+    Generalized plan_segments for a route through len(leg_distances) + 1
+    stops. The driver is on duty for dwell_hours[k] at stop k: before
+    departing the origin, on arrival at each intermediate stop, and at the
+    destination in place of the 1-hour dropoff. names label the stops.
+    Returns (segments, cycle_hours_consumed).
+    """
+    available_cycle_hours = 70.0 - float(hours_already_used)
+    if available_cycle_hours <= 0:
+        raise ValueError("No hours available in 70-hour cycle")
+
+    total_distance = float(sum(leg_distances))
+    state = HOSState(total_distance)
+    segments = []
+    if dwell_hours[0] > 0:
+        segments.append(Segment(SegmentStatus.ON_DUTY, 0.0, dwell_hours[0], f'On duty at {names[0]}', 0.0))
+        state.trip_time += dwell_hours[0]
+        state.on_duty_daily += dwell_hours[0]
+        state.cycle_hours_consumed += dwell_hours[0]
+
+    arrivals = list(accumulate(leg_distances))[:-1]
+    stops = [
+        (total_distance - arrived, dwell, f'Stop at {name}')
+        for arrived, dwell, name in zip(arrivals, dwell_hours[1:-1], names[1:-1])
+    ]
+    segments.extend(resume_segments(
+        state, available_cycle_hours, stops, dropoff=(dwell_hours[-1], f'Dropoff at {names[-1]}')
+    ))
+    return segments, state.cycle_hours_consumed
+
+
+def resume_segments(state, available_cycle_hours, stops=(), dropoff=(1.0, 'Dropoff at Destination')):
+    """
+    Runs the driving loop and the dropoff from an HOSState, which is
+    updated in place. Returns the new Segments; their times continue from
+    state.trip_time.
+    stops: intermediate (remaining_miles, dwell_hours, description) stops,
+           farthest from the destination first; the driver stops on duty
+           for dwell_hours once remaining_distance is down to remaining_miles
+    dropoff: (dwell_hours, description) of the on-duty stop at the destination
+    """
+    segments = []
+    avg_speed = 60.0  # mph
+    stops = list(stops)
+
+    # Counters live in locals while the loop runs
+    current_trip_time = state.trip_time
+    remaining_distance = state.remaining_distance
+    driving_since_break = state.driving_since_break
+    driving_daily = state.driving_daily
+    on_duty_daily = state.on_duty_daily
+    cycle_hours_consumed = state.cycle_hours_consumed
+    miles_since_fuel = state.miles_since_fuel
+
     # --- 2. MAIN DRIVING LOOP ---
     while remaining_distance > 0:
-        
+
+        # Intermediate stops reached (several at once if they share a location)
+        while stops and remaining_distance - stops[0][0] < 0.1:
+            _, dwell, description = stops.pop(0)
+            if dwell > 0:
+                segments.append(Segment(SegmentStatus.ON_DUTY, current_trip_time, dwell, description, 0.0))
+                current_trip_time += dwell
+                on_duty_daily += dwell
+                cycle_hours_consumed += dwell
+
         # Check if we hit 70-hour limit usage
         if cycle_hours_consumed >= available_cycle_hours:
-            segments.append({
-                'type': 'off_duty', 
-                'status': 'off_duty',
-                'start_time': current_trip_time,
-                'duration': 0, 
-                'description': 'REACHED 70-HOUR LIMIT',
-                'distance_miles': 0.0
-            })
+            segments.append(Segment(SegmentStatus.OFF_DUTY, current_trip_time, 0, 'REACHED 70-HOUR LIMIT', 0.0))
             break
 
+        # A resumed trip can start at or past its fuel stop; refuel before driving on
+        if miles_since_fuel >= 1000.0 - 0.1:
+            segments.append(Segment(SegmentStatus.ON_DUTY, current_trip_time, 0.5, 'Fuel Stop', 0.0))
+            current_trip_time += 0.5
+            on_duty_daily += 0.5
+            cycle_hours_consumed += 0.5
+            miles_since_fuel = 0.0
+            continue
+
         # Calculate limits based on constraints
         
         # 1. Distance constraint (how long to drive to finish?)
@@ -150,6 +561,9 @@ def calculate_trip_segments(distance_miles, hours_already_used):
         # 6. 70-Hour Cycle Limit
         time_to_cycle_limit = available_cycle_hours - cycle_hours_consumed
 
+        # 7. Next intermediate stop
+        time_to_stop = (remaining_distance - stops[0][0]) / avg_speed if stops else math.inf
+
         # Determine the limiting factor
         # We want to drive as much as possible, but limited by the MIN of all these.
         
@@ -158,14 +572,7 @@ def calculate_trip_segments(distance_miles, hours_already_used):
         # Priority Actions:
         # A. 10-Hour Rest (Resets 11h and 14h)
         if time_to_daily_limit <= 0.001 or time_to_window_limit <= 0.001:
-            segments.append({
-                'type': 'sleeper',
-                'status': 'sleeper',
-                'start_time': current_trip_time,
-                'duration': 10.0,
-                'description': '10-hour Mandatory Rest',
-                'distance_miles': 0.0
-            })
+            segments.append(Segment(SegmentStatus.SLEEPER, current_trip_time, 10.0, '10-hour Mandatory Rest', 0.0))
             current_trip_time += 10.0
             # Reset daily counters
             driving_daily = 0.0
@@ -176,14 +583,7 @@ def calculate_trip_segments(distance_miles, hours_already_used):
             
         # B. 30-Minute Break (Resets 8h clock)
         if time_to_break <= 0.001:
-            segments.append({
-                'type': 'off_duty',
-                'status': 'off_duty', 
-                'start_time': current_trip_time,
-                'duration': 0.5,
-                'description': '30-minute Mandatory Break',
-                'distance_miles': 0.0
-            })
+            segments.append(Segment(SegmentStatus.OFF_DUTY, current_trip_time, 0.5, '30-minute Mandatory Break', 0.0))
             current_trip_time += 0.5
             on_duty_daily += 0.5 # 14h window keeps ticking during break!
             driving_since_break = 0.0
@@ -197,7 +597,8 @@ def calculate_trip_segments(distance_miles, hours_already_used):
             time_to_daily_limit,
             time_to_window_limit,
             time_to_fuel,
-            time_to_cycle_limit
+            time_to_cycle_limit,
+            time_to_stop
         )
         
         # If drive_duration is tiny (floating point error), force action
@@ -217,14 +618,10 @@ def calculate_trip_segments(distance_miles, hours_already_used):
         # Execute Drive Segment
         dist_driven = drive_duration * avg_speed
         
-        segments.append({
-            'type': 'driving',
-            'status': 'driving',
-            'start_time': current_trip_time,
-            'duration': drive_duration,
-            'description': f'Driving {dist_driven:.1f} miles',
-            'distance_miles': dist_driven
-        })
+        segments.append(Segment(
+            SegmentStatus.DRIVING, current_trip_time, drive_duration,
+            f'Driving {dist_driven:.1f} miles', dist_driven
+        ))
         
         # Update State
         current_trip_time += drive_duration
@@ -239,29 +636,233 @@ def calculate_trip_segments(distance_miles, hours_already_used):
         # Check Fuel (If we stopped BECAUSE of fuel)
         # Using fuzzy comparison
         if abs(miles_since_fuel - 1000.0) < 0.1:
-            segments.append({
-                'type': 'on_duty',
-                'status': 'on_duty',
-                'start_time': current_trip_time,
-                'duration': 0.5,
-                'description': 'Fuel Stop',
-                'distance_miles': 0.0
-            })
+            segments.append(Segment(SegmentStatus.ON_DUTY, current_trip_time, 0.5, 'Fuel Stop', 0.0))
             current_trip_time += 0.5
             on_duty_daily += 0.5
             cycle_hours_consumed += 0.5
             miles_since_fuel = 0.0
             
-    # --- 3. DROPOFF (1 Hour On Duty) ---
+    # --- 3. DROPOFF (1 Hour On Duty by default) ---
     if remaining_distance <= 0.1:
-        segments.append({
-            'type': 'on_duty',
-            'status': 'on_duty',
-            'start_time': current_trip_time,
-            'duration': 1.0,
-            'description': 'Dropoff at Destination',
-            'distance_miles': 0.0
-        })
-        cycle_hours_consumed += 1.0
+        dwell, description = dropoff
+        # Stops at the destination itself come before the dropoff
+        for _, stop_dwell, stop_description in stops:
+            if stop_dwell > 0:
+                segments.append(Segment(SegmentStatus.ON_DUTY, current_trip_time, stop_dwell, stop_description, 0.0))
+                current_trip_time += stop_dwell
+                on_duty_daily += stop_dwell
+                cycle_hours_consumed += stop_dwell
+        if dwell > 0:
+            segments.append(Segment(SegmentStatus.ON_DUTY, current_trip_time, dwell, description, 0.0))
+            current_trip_time += dwell
+            on_duty_daily += dwell
+            cycle_hours_consumed += dwell
         
-    return segments, cycle_hours_consumed
+    state.trip_time = current_trip_time
+    state.remaining_distance = remaining_distance
+    state.driving_since_break = driving_since_break
+    state.driving_daily = driving_daily
+    state.on_duty_daily = on_duty_daily
+    state.cycle_hours_consumed = cycle_hours_consumed
+    state.miles_since_fuel = miles_since_fuel
+    return segments
+
+
+# Segment type codes used by calculate_trip_segments_batch
+SEGMENT_PICKUP, SEGMENT_DRIVING, SEGMENT_BREAK, SEGMENT_SLEEPER, SEGMENT_FUEL, SEGMENT_LIMIT, SEGMENT_DROPOFF = range(7)
+
+
+def calculate_trip_segments_batch(distances_miles, hours_already_used, with_segments=False,
+                                  driving_since_break=0.0, driving_daily=0.0, on_duty_daily=0.0):
+    """
+    Vectorized calculate_trip_segments for many trips at once.
+
+    Every trip steps through the same HOS state machine in lockstep; each
+    iteration applies one action (70h limit, 10h rest, 30m break or drive +
+    optional fuel stop) to all trips still driving, using the same float
+    operations as the scalar planner.
+
+    distances_miles, hours_already_used: array-likes of equal length
+    with_segments: also build the per-trip segment dict lists
+    driving_since_break, driving_daily, on_duty_daily: the drivers' clocks
+        at the start of the trip (as in HOSState), scalars or arrays;
+        all 0 for a fresh day, like the scalar planner
+
+    Returns a dict of arrays:
+        valid                 False where the cycle is already used up (scalar raises)
+        stalled               True where the scalar planner would never terminate
+        segment_count, driving_segments, break_count, sleeper_count, fuel_stop_count
+        driving_hours, driving_miles, total_trip_hours, cycle_hours_consumed
+        limit_reached         True where the 70-hour limit truncated the trip
+        completed             True where the trip ends with the dropoff
+        segments              list of segment lists (only with with_segments)
+    """
+    distances = np.asarray(distances_miles, dtype=np.float64).ravel()
+    used = np.broadcast_to(np.asarray(hours_already_used, dtype=np.float64), distances.shape)
+    n = distances.size
+    avg_speed = 60.0  # mph
+
+    available_cycle_hours = 70.0 - used
+    valid = available_cycle_hours > 0
+
+    remaining = distances.copy()
+    current_trip_time = np.zeros(n)
+    driving_since_break, driving_daily, on_duty_daily = (
+        np.broadcast_to(np.asarray(clock, dtype=np.float64), distances.shape).copy()
+        for clock in (driving_since_break, driving_daily, on_duty_daily)
+    )
+    cycle_hours_consumed = np.zeros(n)
+    miles_since_fuel = np.zeros(n)
+
+    segment_count = np.zeros(n, dtype=np.int64)
+    driving_segments = np.zeros(n, dtype=np.int64)
+    break_count = np.zeros(n, dtype=np.int64)
+    sleeper_count = np.zeros(n, dtype=np.int64)
+    fuel_stop_count = np.zeros(n, dtype=np.int64)
+    driving_hours = np.zeros(n)
+    driving_miles = np.zeros(n)
+    limit_reached = np.zeros(n, dtype=bool)
+    stalled = np.zeros(n, dtype=bool)
+
+    segments = [[] for _ in range(n)] if with_segments else None
+
+    def record(mask, seg_type, starts, durations, miles=None):
+        if not with_segments:
+            return
+        for i in np.flatnonzero(mask):
+            segments[i].append(_batch_segment(
+                seg_type, float(starts[i]), float(durations[i]), 0.0 if miles is None else float(miles[i])
+            ))
+
+    # --- 1. PICKUP (1 Hour On Duty) ---
+    record(valid, SEGMENT_PICKUP, current_trip_time, np.ones(n))
+    segment_count += valid
+    current_trip_time = np.where(valid, current_trip_time + 1.0, current_trip_time)
+    on_duty_daily = np.where(valid, on_duty_daily + 1.0, on_duty_daily)
+    cycle_hours_consumed = np.where(valid, cycle_hours_consumed + 1.0, cycle_hours_consumed)
+
+    # --- 2. MAIN DRIVING LOOP (one action per trip per iteration) ---
+    active = valid & (remaining > 0)
+    while active.any():
+        limit = active & (cycle_hours_consumed >= available_cycle_hours)
+        record(limit, SEGMENT_LIMIT, current_trip_time, np.zeros(n))
+        segment_count += limit
+        limit_reached |= limit
+        active &= ~limit
+
+        time_to_finish = remaining / avg_speed
+        time_to_break = 8.0 - driving_since_break
+        time_to_break = np.where(time_to_break <= 0, 0.0, time_to_break)
+        time_to_daily_limit = 11.0 - driving_daily
+        time_to_window_limit = 14.0 - on_duty_daily
+        time_to_fuel = (1000.0 - miles_since_fuel) / avg_speed
+        time_to_cycle_limit = available_cycle_hours - cycle_hours_consumed
+
+        # A. 10-Hour Rest (Resets 11h and 14h)
+        rest = active & ((time_to_daily_limit <= 0.001) | (time_to_window_limit <= 0.001))
+        record(rest, SEGMENT_SLEEPER, current_trip_time, np.full(n, 10.0))
+        segment_count += rest
+        sleeper_count += rest
+        current_trip_time = np.where(rest, current_trip_time + 10.0, current_trip_time)
+        driving_daily = np.where(rest, 0.0, driving_daily)
+        on_duty_daily = np.where(rest, 0.0, on_duty_daily)
+        driving_since_break = np.where(rest, 0.0, driving_since_break)
+
+        # B. 30-Minute Break (Resets 8h clock)
+        brk = active & ~rest & (time_to_break <= 0.001)
+        record(brk, SEGMENT_BREAK, current_trip_time, np.full(n, 0.5))
+        segment_count += brk
+        break_count += brk
+        current_trip_time = np.where(brk, current_trip_time + 0.5, current_trip_time)
+        on_duty_daily = np.where(brk, on_duty_daily + 0.5, on_duty_daily)
+        driving_since_break = np.where(brk, 0.0, driving_since_break)
+
+        # C. Drive!
+        drive = active & ~rest & ~brk
+        drive_duration = np.minimum.reduce([
+            time_to_finish, time_to_break, time_to_daily_limit,
+            time_to_window_limit, time_to_fuel, time_to_cycle_limit
+        ])
+        tiny = drive & (drive_duration <= 0.001)
+        # The scalar loop retries forever when a tiny drive coincides with a nearly-hit limit
+        stuck = tiny & (
+            (time_to_daily_limit < 0.01) | (time_to_break < 0.01) | (time_to_window_limit < 0.01)
+        )
+        stalled |= stuck
+        drive &= ~tiny
+
+        dist_driven = drive_duration * avg_speed
+        record(drive, SEGMENT_DRIVING, current_trip_time, drive_duration, dist_driven)
+        segment_count += drive
+        driving_segments += drive
+        driving_hours = np.where(drive, driving_hours + drive_duration, driving_hours)
+        driving_miles = np.where(drive, driving_miles + dist_driven, driving_miles)
+        current_trip_time = np.where(drive, current_trip_time + drive_duration, current_trip_time)
+        remaining = np.where(drive, remaining - dist_driven, remaining)
+        driving_since_break = np.where(drive, driving_since_break + drive_duration, driving_since_break)
+        driving_daily = np.where(drive, driving_daily + drive_duration, driving_daily)
+        on_duty_daily = np.where(drive, on_duty_daily + drive_duration, on_duty_daily)
+        cycle_hours_consumed = np.where(drive, cycle_hours_consumed + drive_duration, cycle_hours_consumed)
+        miles_since_fuel = np.where(drive, miles_since_fuel + dist_driven, miles_since_fuel)
+
+        # Fuel stop if we stopped because of fuel
+        fuel = drive & (np.abs(miles_since_fuel - 1000.0) < 0.1)
+        record(fuel, SEGMENT_FUEL, current_trip_time, np.full(n, 0.5))
+        segment_count += fuel
+        fuel_stop_count += fuel
+        current_trip_time = np.where(fuel, current_trip_time + 0.5, current_trip_time)
+        on_duty_daily = np.where(fuel, on_duty_daily + 0.5, on_duty_daily)
+        cycle_hours_consumed = np.where(fuel, cycle_hours_consumed + 0.5, cycle_hours_consumed)
+        miles_since_fuel = np.where(fuel, 0.0, miles_since_fuel)
+
+        active &= ~tiny & (remaining > 0)
+
+    # --- 3. DROPOFF (1 Hour On Duty) ---
+    completed = valid & ~stalled & (remaining <= 0.1)
+    record(completed, SEGMENT_DROPOFF, current_trip_time, np.ones(n))
+    segment_count += completed
+    cycle_hours_consumed = np.where(completed, cycle_hours_consumed + 1.0, cycle_hours_consumed)
+    total_trip_hours = np.where(completed, current_trip_time + 1.0, current_trip_time)
+
+    invalid = ~valid
+    result = {
+        'valid': valid,
+        'stalled': stalled,
+        'segment_count': segment_count,
+        'driving_segments': driving_segments,
+        'break_count': break_count,
+        'sleeper_count': sleeper_count,
+        'fuel_stop_count': fuel_stop_count,
+        'driving_hours': driving_hours,
+        'driving_miles': driving_miles,
+        'total_trip_hours': np.where(invalid, np.nan, total_trip_hours),
+        'cycle_hours_consumed': np.where(invalid, np.nan, cycle_hours_consumed),
+        'limit_reached': limit_reached,
+        'completed': completed,
+    }
+    if with_segments:
+        result['segments'] = segments
+    return result
+
+
+def _batch_segment(seg_type, start_time, duration, distance_miles):
+    """Builds a segment dict identical to the ones calculate_trip_segments emits."""
+    status, description = {
+        SEGMENT_PICKUP: ('on_duty', 'Pickup at Origin'),
+        SEGMENT_DRIVING: ('driving', None),
+        SEGMENT_BREAK: ('off_duty', '30-minute Mandatory Break'),
+        SEGMENT_SLEEPER: ('sleeper', '10-hour Mandatory Rest'),
+        SEGMENT_FUEL: ('on_duty', 'Fuel Stop'),
+        SEGMENT_LIMIT: ('off_duty', 'REACHED 70-HOUR LIMIT'),
+        SEGMENT_DROPOFF: ('on_duty', 'Dropoff at Destination'),
+    }[seg_type]
+    if seg_type == SEGMENT_DRIVING:
+        description = f'Driving {distance_miles:.1f} miles'
+    return {
+        'type': status,
+        'status': status,
+        'start_time': start_time,
+        'duration': 0 if seg_type == SEGMENT_LIMIT else duration,
+        'description': description,
+        'distance_miles': distance_miles
+    }
@@ -1,156 +1,478 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .services import geocode_location, get_route_details
-from .utils import calculate_trip_segments, decode_polyline, get_coordinate_at_distance
+from . import eld, jobs, metrics, response_cache
+from .dispatch import parse_dispatch_input, rank_fleet
+from .async_services import ageocode_and_route
+from .gazetteer import MAX_SUGGESTIONS, suggest
+from .models import TripJob
+from .renderers import MSGPACK_MEDIA_TYPE, pack
+from .services import (
+    geocode_and_route, geocode_and_route_many, geocode_cache_stats, geocode_locations, get_distance_matrix, get_route,
+    matrix_cache_stats, route_cache_stats
+)
+from .streaming import (
+    NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, aiterate, encode_ndjson, encode_sse, in_request_context, trip_events
+)
+from .tour import optimize_order
+from .trips import (
+    GEOCODE_ERROR, ROUTING_ERROR, load_stored_trip, parse_layout, parse_log_sheets, parse_multi_stop_input,
+    parse_trip_input, parse_zoom, plan_multi_stop_trip, plan_trip, plan_trips, publish_trip_plan, render_trip_plan,
+    replan_trip
+)
+
+
+def negotiated_response(request, data, status_code=status.HTTP_200_OK):
+    """JSON or MessagePack response for plain Django views, following the Accept header."""
+    if MSGPACK_MEDIA_TYPE in request.headers.get('Accept', ''):
+        return HttpResponse(pack(data), content_type=MSGPACK_MEDIA_TYPE, status=status_code)
+    return JsonResponse(data, status=status_code)
+
+
+def cached_trip_response(request, entry):
+    """
+    Answers with a rendered trip response (see response_cache): 304 if the
+    client's If-None-Match already names it, else the cached JSON body, or
+    MessagePack / the browsable API when the request asks for them.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if response_cache.not_modified(request, entry):
+        response = HttpResponseNotModified()
+    elif MSGPACK_MEDIA_TYPE in request.headers.get('Accept', ''):
+        response = HttpResponse(pack(json.loads(entry.body)), content_type=MSGPACK_MEDIA_TYPE)
+    elif renderer is not None and renderer.format == 'api':
+        response = Response(json.loads(entry.body))
+    else:
+        response = HttpResponse(entry.body, content_type='application/json')
+    response['ETag'] = entry.etag
+    response['Vary'] = 'Accept'
+    return response
+
 
 class CalculateTripView(APIView):
+    """
+    Plans a trip. Identical requests (same normalized locations, hours_used,
+    layout, zoom and log_sheets) are answered from the trip response cache, with an
+    ETag for conditional requests.
+    """
+
+    def post(self, request):
+        try:
+            locations, hours_used = parse_trip_input(request.data)
+            layout = parse_layout(request.query_params.get('layout') or request.data.get('layout'))
+            zoom = parse_zoom(request.query_params.get('zoom') or request.data.get('zoom'))
+            log_sheets = parse_log_sheets(request.query_params.get('log_sheets') or request.data.get('log_sheets'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = response_cache.trip_key(locations, hours_used, layout, zoom, log_sheets)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached_trip_response(request, cached)
+
+        # Geocoding + Routing (Current -> Pickup -> Dropoff)
+        # All three geocodes run concurrently, then both legs are routed with
+        # one multi-waypoint request.
+        coords, routes = geocode_and_route(locations)
+
+        if not all(coords):
+            return Response({'error': GEOCODE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(routes):
+            return Response({'error': ROUTING_ERROR}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            planned = plan_trip(routes, hours_used)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_data = publish_trip_plan(locations, planned, layout, zoom, log_sheets)
+        return cached_trip_response(request, response_cache.put(key, response_data, locations, coords))
+
+
+class BatchCalculateTripView(APIView):
+    """
+    Plans a list of trips in one request.
+    Body: {"trips": [<calculate-trip body>, ...]}
+    Returns {"results": [...]} in input order; a failed trip yields
+    {"error": ..., "status": <HTTP status it would have returned alone>}.
+    """
+
+    def post(self, request):
+        trips = request.data.get('trips')
+        if not isinstance(trips, list) or not trips:
+            return Response({'error': 'trips must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            layout = parse_layout(request.query_params.get('layout') or request.data.get('layout'))
+            zoom = parse_zoom(request.query_params.get('zoom') or request.data.get('zoom'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if len(trips) > settings.TRIP_BATCH_MAX_SIZE:
+            return Response(
+                {'error': f'At most {settings.TRIP_BATCH_MAX_SIZE} trips per batch.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(trips)
+        valid = []  # (index, locations, hours_used)
+        for i, trip in enumerate(trips):
+            try:
+                if not isinstance(trip, dict):
+                    raise ValueError('Each trip must be an object.')
+                locations, hours_used = parse_trip_input(trip)
+            except ValueError as e:
+                results[i] = {'error': str(e), 'status': status.HTTP_400_BAD_REQUEST}
+                continue
+            valid.append((i, locations, hours_used))
+
+        resolved = geocode_and_route_many([locations for _, locations, _ in valid])
+
+        jobs, job_indices = [], []
+        for (i, _, hours_used), (coords, routes) in zip(valid, resolved):
+            if not all(coords):
+                results[i] = {'error': GEOCODE_ERROR, 'status': status.HTTP_400_BAD_REQUEST}
+            elif not all(routes):
+                results[i] = {'error': ROUTING_ERROR, 'status': status.HTTP_503_SERVICE_UNAVAILABLE}
+            else:
+                jobs.append((routes, hours_used))
+                job_indices.append(i)
+
+        with metrics.stage('plan'):
+            plans = plan_trips(jobs, layout, zoom)
+        for i, plan in zip(job_indices, plans):
+            if 'error' in plan:
+                plan['status'] = status.HTTP_400_BAD_REQUEST
+            results[i] = plan
+
+        return Response({'results': results})
+
+
+class MultiStopTripView(APIView):
+    """
+    Plans a trip through several stops, each with its own time on duty.
+    Body: {"stops": [{"location": ..., "dwell_hours": ...}, ...],
+    "hours_used": ..., optional "optimize"}
+    With optimize, the stops between the first and the last are reordered
+    to shorten the drive (pairwise distances from the matrix service; the
+    given order is kept if it is unavailable). The trip response gets the
+    stops in driving order (`index` is a stop's place in the request) and
+    whether that order was optimized.
+    """
+
     def post(self, request):
-        current_loc = request.data.get('current_location')
-        pickup_loc = request.data.get('pickup_location')
-        dropoff_loc = request.data.get('dropoff_location')
-        hours_used = request.data.get('hours_used')
-        
-        # Validation
-        if not all([current_loc, pickup_loc, dropoff_loc]):
-            return Response({'error': 'All locations are required.'}, status=status.HTTP_400_BAD_REQUEST)
-            
         try:
-            hours_used = float(hours_used)
-            if hours_used < 0 or hours_used > 70:
-                return Response({'error': 'Hours used must be between 0 and 70.'}, status=status.HTTP_400_BAD_REQUEST)
-        except (ValueError, TypeError):
-             return Response({'error': 'Invalid hours_used value.'}, status=status.HTTP_400_BAD_REQUEST)
-             
-        if hours_used >= 70:
-             return Response({'error': 'No driving hours available (>= 70 used).'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Geocoding
-        curr_coords = geocode_location(current_loc)
-        pickup_coords = geocode_location(pickup_loc)
-        dropoff_coords = geocode_location(dropoff_loc)
-        
-        if not all([curr_coords, pickup_coords, dropoff_coords]):
-             return Response({'error': 'Could not geocode one or more locations.'}, status=status.HTTP_400_BAD_REQUEST)
-             
-        # Routing (Current -> Pickup -> Dropoff)
-        # Leg 1: Current -> Pickup (Deadhead? usually HOS applies differently but let's assume standard driving)
-        # Actually user prompt says: "Route from Current -> Pickup -> Dropoff"
-        # But HOS usually starts when working.
-        # Let's assume the trip STARTS at Pickup for cargo? 
-        # Requirement: "Display route from Current -> Pickup -> Dropoff"
-        # Requirement: "Pickup/Dropoff Time: Add 1 hour 'On Duty' time at pickup location"
-        # Usually checking empty drive to pickup is "Driving". 
-        # Let's calculate total distance.
-        
-        route1 = get_route_details(curr_coords, pickup_coords)
-        route2 = get_route_details(pickup_coords, dropoff_coords)
-        
-        if not route1 or not route2:
-             return Response(
-                 {'error': 'Routing service is temporarily unavailable. Please try again in a moment.'},
-                 status=status.HTTP_503_SERVICE_UNAVAILABLE
-             )
-             
-        total_dist = route1['distance_miles'] + route2['distance_miles']
-        
-        # HOS Calculation
-        # We process the ENTIRE distance as driving segments?
-        # Or do we process Leg 1, then Pickup, then Leg 2, then Dropoff?
-        # Logic says: "Add 1 hour... at pickup".
-        # So structure: Drive(Current->Pickup) -> OnDuty(Pickup) -> Drive(Pickup->Dropoff) -> OnDuty(Dropoff)
-        # My utils.py assumed a single "distance" and started with Pickup.
-        # I should Refactor utils to handle generic segments or just pass total distance?
-        
-        # Refined Logic:
-        # The user example: "Chicago -> Indy -> Nashville".
-        # "Pickup time: 1 hour".
-        # "Driving time: 473 / 60" (Total distance).
-        # Segments example: 0:00-1:00 On Duty (Pickup) -> Driving -> Dropoff.
-        # It seems the example IGNORES the drive from Current to Pickup or assumes Current IS Pickup?
-        # Example Input: Current: Chicago, Pickup: Indy.
-        # Example Calculation: "Total distance 184 + 289 = 473".
-        # Example Segments: "0:00 - 1:00: On Duty (Pickup)".
-        # This implies the driver is ALREADY at Pickup? Or the "Current" loc is just for map?
-        # Wait, 184 miles is Chi->Indy.
-        # If segments start with "On Duty (Pickup)", then the drive Chi->Indy is MISSING from the log?
-        # OR the example assumes Current = Pickup?
-        # Input: Current: Chicago, Pickup: Indy (184 miles).
-        # Calculation: "Total distance... 473 miles".
-        # Segments: "1:00 - 9:00: Driving (473 miles)".
-        # Visual: "Hours 1-9: Driving".
-        
-        # Okay, the example implementation combines the distances (Current->Pickup + Pickup->Dropoff) into ONE driving block AFTER the Pickup?
-        # That's slightly weird physically (how do you drive from Current to Pickup AFTER picking up?).
-        # However, looking at the code provided in the prompt:
-        # segments.append({'type': 'on_duty', ... 'description': 'Pickup'})
-        # current_time += 1
-        # while remaining_distance > 0: ...
-        
-        # The prompt's example algorithm calculates "Pickup" FIRST, then drives "Total Distance".
-        # I will follow the prompt's algorithm vs physical reality if they conflict, 
-        # BUT "Current -> Pickup" is usually "Empty Move" and counts as Driving.
-        # Constructing the timeline:
-        # The prompt Example says:
-        # Distance: 184 (Chi->Indy) + 289 (Indy->Nash) = 473.
-        # Segments: Pickup (1h) -> Driving (473mi).
-        # This implies: Do Pickup Op -> Drive ALL miles.
-        # I will stick to this simplified model as requested by the prompt's "Example Calculation Walkthrough".
-        
+            locations, dwell_hours, hours_used, optimize = parse_multi_stop_input(request.data)
+            layout = parse_layout(request.query_params.get('layout') or request.data.get('layout'))
+            zoom = parse_zoom(request.query_params.get('zoom') or request.data.get('zoom'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        coords = geocode_locations(locations)
+        if not all(coords):
+            return Response({'error': GEOCODE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+
+        order = list(range(len(locations)))
+        optimized = optimize and len(locations) <= 3  # At most one stop in between: nothing to reorder
+        if optimize and not optimized:
+            with metrics.stage('matrix'):
+                matrix = get_distance_matrix(coords)
+            if matrix is not None:
+                with metrics.stage('optimize'):
+                    order = optimize_order(matrix[0])
+                optimized = True
+        locations, dwell_hours, coords = ([values[i] for i in order] for values in (locations, dwell_hours, coords))
+
+        with metrics.stage('route'):
+            route = get_route(coords)
+        if route is None:
+            return Response({'error': ROUTING_ERROR}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         try:
-            segments, cycle_hours_consumed = calculate_trip_segments(total_dist, hours_used)
+            planned = plan_multi_stop_trip(route['legs'], dwell_hours, hours_used, locations)
         except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            
-        final_hours_used = float(hours_used) + cycle_hours_consumed
-
-        # --- COORDINATE INTERPOLATION ---
-        # 1. Decode path
-        path1 = decode_polyline(route1['polyline'])
-        path2 = decode_polyline(route2['polyline'])
-        full_path = path1 + path2
-        
-        # 2. Assign coordinates to segments
-        driven_dist = 0.0
-        
-        for segment in segments:
-            # If segment has duration > 0 and type is driving, it advances distance
-            if segment['type'] == 'driving':
-                # Driving segment advances distance
-                # But we want the coordinate for the END of the driving? 
-                # No, driving is a span.
-                # Only "Events" (Stops) need coordinates for markers.
-                # Fuel Stop, Rest, Pickup, Dropoff.
-                
-                # Advance distance
-                seg_dist = segment.get('distance_miles', 0.0)
-                driven_dist += seg_dist
-                
-            elif segment['type'] in ['on_duty', 'off_duty', 'sleeper']:
-                # This affects Fuel Stops, Rest Breaks, Pickup, Dropoff
-                
-                # If Pickup (driven_dist = 0), get start.
-                # If Fuel/Rest (happens at driven_dist), get coord.
-                
-                # Need to distinguish "Pickup" from generic on_duty?
-                # Using description or existing distance check.
-                
-                coord = get_coordinate_at_distance(full_path, driven_dist)
-                if coord:
-                    segment['latitude'] = coord[0]
-                    segment['longitude'] = coord[1]
-        
-        response_data = {
-            'route': {
-                'total_distance': total_dist,
-                'total_duration': segments[-1]['start_time'] + segments[-1]['duration'],
-                'polyline_leg1': route1['polyline'],
-                'polyline_leg2': route2['polyline']
-            },
-            'trip_segments': segments,
-            'eld_logs': segments,
-            'available_hours': 70 - final_hours_used,
-            'total_trip_hours': segments[-1]['start_time'] + segments[-1]['duration']
-        }
-        
+
+        response_data = render_trip_plan(planned, layout, zoom)
+        response_data['stops'] = [
+            {'index': i, 'location': location, 'latitude': lat, 'longitude': lng, 'dwell_hours': dwell}
+            for i, location, (lat, lng), dwell in zip(order, locations, coords, dwell_hours)
+        ]
+        response_data['optimized'] = optimized
         return Response(response_data)
+
+
+class DispatchView(APIView):
+    """
+    Ranks a fleet snapshot for one load.
+    Body: {"pickup_location": ..., "dropoff_location": ..., "fleet": [{"id",
+    "latitude", "longitude", "hours_used", optional "driving_since_break",
+    "driving_today", "on_duty_today"}, ...], optional "top_k",
+    "max_deadhead_miles"}
+    Returns the best top_k trucks, those that can deliver within their HOS
+    limits first, by delivery ETA (see dispatch.rank_fleet).
+    """
+
+    def post(self, request):
+        try:
+            locations, fleet, top_k, max_deadhead_miles = parse_dispatch_input(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        coords, routes = geocode_and_route(locations)
+        if not all(coords):
+            return Response({'error': GEOCODE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(routes):
+            return Response({'error': ROUTING_ERROR}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        loaded_miles = routes[0]['distance_miles']
+        ranking, in_range = rank_fleet(fleet, coords[0], loaded_miles, top_k, max_deadhead_miles)
+        return Response({
+            'pickup': {'location': locations[0], 'latitude': coords[0][0], 'longitude': coords[0][1]},
+            'dropoff': {'location': locations[1], 'latitude': coords[1][0], 'longitude': coords[1][1]},
+            'loaded_miles': loaded_miles,
+            'fleet_size': len(fleet),
+            'in_range': in_range,
+            'ranking': ranking,
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCalculateTripView(View):
+    """
+    Async variant of CalculateTripView for ASGI deployments.
+    Outbound calls share one pooled HTTP client per process, so a worker can
+    hold many trip calculations in flight while waiting on Nominatim/ORS.
+    """
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+        except json.JSONDecodeError:
+            data = None
+        # A JSON array or scalar is valid JSON but not a trip
+        if not isinstance(data, dict):
+            return negotiated_response(request, {'error': 'Invalid JSON body.'}, status.HTTP_400_BAD_REQUEST)
+        try:
+            locations, hours_used = parse_trip_input(data)
+            layout = parse_layout(request.GET.get('layout') or data.get('layout'))
+            zoom = parse_zoom(request.GET.get('zoom') or data.get('zoom'))
+            log_sheets = parse_log_sheets(request.GET.get('log_sheets') or data.get('log_sheets'))
+        except ValueError as e:
+            return negotiated_response(request, {'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        key = response_cache.trip_key(locations, hours_used, layout, zoom, log_sheets)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached_trip_response(request, cached)
+
+        coords, routes = await ageocode_and_route(locations)
+
+        if not all(coords):
+            return negotiated_response(request, {'error': GEOCODE_ERROR}, status.HTTP_400_BAD_REQUEST)
+        if not all(routes):
+            return negotiated_response(request, {'error': ROUTING_ERROR}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            planned = plan_trip(routes, hours_used)
+        except ValueError as e:
+            return negotiated_response(request, {'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        response_data = await sync_to_async(publish_trip_plan)(locations, planned, layout, zoom, log_sheets)
+        return cached_trip_response(request, response_cache.put(key, response_data, locations, coords))
+
+
+class ReplanTripView(APIView):
+    """
+    Re-plans the rest of a stored trip from the driver's progress.
+    Body: {"miles_driven": ..., "hours_used": ..., optional "elapsed_hours",
+    "driving_since_break", "driving_today", "on_duty_today", "miles_since_fuel"}
+    Reuses the stored route geometry, so no geocoding or routing is done.
+    """
+
+    def post(self, request, plan_id):
+        stored = load_stored_trip(plan_id)
+        if stored is None:
+            return Response({'error': 'Trip plan not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            layout = parse_layout(request.query_params.get('layout') or request.data.get('layout'))
+            zoom = parse_zoom(request.query_params.get('zoom') or request.data.get('zoom'))
+            log_sheets = parse_log_sheets(request.query_params.get('log_sheets') or request.data.get('log_sheets'))
+            planned = replan_trip(stored, request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_data = render_trip_plan(planned, layout, zoom, log_sheets)
+        response_data['trip_plan_id'] = str(plan_id)
+        return Response(response_data)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CalculateTripStreamView(View):
+    """
+    Streaming variant of CalculateTripView: sends coordinates, route legs, the
+    HOS timeline, stop coordinates and finally the full plan as each stage
+    completes (see streaming.trip_events), so clients can draw the map before
+    the whole pipeline has finished. Events are newline-delimited JSON, or
+    Server-Sent Events with Accept: text/event-stream. GET takes the trip as
+    query parameters, for EventSource.
+    """
+
+    def get(self, request):
+        return self.stream(request, request.GET)
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+        except json.JSONDecodeError:
+            data = None
+        # A JSON array or scalar is valid JSON but not a trip
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.stream(request, data)
+
+    def stream(self, request, data):
+        try:
+            locations, hours_used = parse_trip_input(data)
+            layout = parse_layout(request.GET.get('layout') or data.get('layout'))
+            zoom = parse_zoom(request.GET.get('zoom') or data.get('zoom'))
+            log_sheets = parse_log_sheets(request.GET.get('log_sheets') or data.get('log_sheets'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        events = in_request_context(trip_events(locations, hours_used, layout, zoom, log_sheets))
+        if SSE_MEDIA_TYPE in request.headers.get('Accept', ''):
+            content, content_type = encode_sse(events), SSE_MEDIA_TYPE
+        else:
+            content, content_type = encode_ndjson(events), NDJSON_MEDIA_TYPE
+        if isinstance(request, ASGIRequest):
+            content = aiterate(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let nginx hold events back
+        return response
+
+
+class TripJobsView(APIView):
+    """
+    Queues a trip calculation for the run_trip_worker processes and returns
+    at once with 202 and the job's status URL. Takes the same body as
+    /api/calculate-trip/.
+    """
+
+    def post(self, request):
+        data = dict(request.data.items())
+        for name in ('layout', 'zoom'):
+            data.setdefault(name, request.query_params.get(name))
+        try:
+            job = jobs.submit(data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except jobs.QueueFull as e:
+            response = Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '30'
+            return response
+
+        response = Response(
+            dict(jobs.job_status(job), status_url=f'/api/trip-jobs/{job.id}/'), status=status.HTTP_202_ACCEPTED
+        )
+        response['Location'] = f'/api/trip-jobs/{job.id}/'
+        return response
+
+
+class TripJobView(APIView):
+    """Status of a trip job; includes the trip response once it has succeeded."""
+
+    def get(self, request, job_id):
+        job = TripJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return Response({'error': 'Trip job not found.'}, status=status.HTTP_404_NOT_FOUND)
+        response = Response(jobs.job_status(job))
+        if job.status not in TripJob.FINISHED:
+            response['Retry-After'] = str(max(1, round(settings.TRIP_JOB_POLL_INTERVAL)))
+        return response
+
+
+class TripJobCancelView(APIView):
+    """Cancels a queued job, or asks the worker running it to stop after its current stage."""
+
+    def post(self, request, job_id):
+        job = jobs.cancel(job_id)
+        if job is None:
+            return Response({'error': 'Trip job not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if job.status in (TripJob.SUCCEEDED, TripJob.FAILED):
+            return Response({'error': f'Trip job already {job.status}.'}, status=status.HTTP_409_CONFLICT)
+        # A running job stops at its worker's next check
+        code = status.HTTP_202_ACCEPTED if job.status == TripJob.RUNNING else status.HTTP_200_OK
+        return Response(jobs.job_status(job), status=code)
+
+
+class TripLogSheetsView(APIView):
+    """Daily ELD log sheets of a stored trip plan (see eld.daily_sheets)."""
+
+    def get(self, request, plan_id):
+        stored = load_stored_trip(plan_id)
+        if stored is None:
+            return Response({'error': 'Trip plan not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'trip_plan_id': str(plan_id), 'log_sheets': eld.daily_sheets(stored.segments)})
+
+
+class TripLogSheetRenderView(View):
+    """
+    A stored plan's log sheet for one day as PNG or PDF, or (without a day)
+    every sheet as one PDF. Renders run on the ELD render pool and are
+    cached per plan and day.
+    """
+
+    def get(self, request, plan_id, fmt, day=None):
+        stored = load_stored_trip(plan_id)
+        if stored is None:
+            raise Http404('Trip plan not found.')
+        sheets = eld.daily_sheets(stored.segments)
+        if day is not None and not any(sheet['day'] == day for sheet in sheets):
+            raise Http404('No log sheet for that day.')
+        try:
+            data = eld.rendered_sheets(plan_id, sheets, day, fmt)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        name = f'eld-log-{plan_id}' + (f'-day-{day}' if day is not None else '')
+        response = HttpResponse(data, content_type='application/pdf' if fmt == 'pdf' else 'image/png')
+        response['Content-Disposition'] = f'inline; filename="{name}.{fmt}"'
+        # Stored plans never change
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+class LocationAutocompleteView(APIView):
+    """Type-ahead suggestions for location fields, served from the local gazetteer only."""
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', MAX_SUGGESTIONS))
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+
+        places = suggest(request.query_params.get('q', ''), limit)
+        response = Response({'results': [place._asdict() for place in places]})
+        response['Cache-Control'] = 'public, max-age=3600'
+        return response
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        return Response({
+            'geocode': geocode_cache_stats(),
+            'route': route_cache_stats(),
+            'matrix': matrix_cache_stats(),
+            'response': response_cache.stats(),
+            'eld_render': eld.render_cache_stats(),
+        })
@@ -0,0 +1,42 @@
+"""
+Compares the scalar HOS planner with the vectorized batch engine.
+
+Usage (from backend/):
+    python -m benchmarks.hos [--trips 10000] [--repeat 3]
+"""
+import argparse
+import random
+import timeit
+
+from api.utils import calculate_trip_segments, calculate_trip_segments_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--trips', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    distances = [rng.uniform(50, 3000) for _ in range(args.trips)]
+    hours = [rng.uniform(0, 60) for _ in range(args.trips)]
+
+    def scalar():
+        return [calculate_trip_segments(d, h) for d, h in zip(distances, hours)]
+
+    cases = [
+        ('scalar', scalar),
+        ('batch (summary)', lambda: calculate_trip_segments_batch(distances, hours)),
+        ('batch (with segments)', lambda: calculate_trip_segments_batch(distances, hours, with_segments=True)),
+    ]
+    results = {}
+    print(f"Trips: {args.trips}")
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:<24} {best * 1000:9.1f} ms")
+    print(f"summary speedup: {results['scalar'] / results['batch (summary)']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
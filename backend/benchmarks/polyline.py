@@ -0,0 +1,69 @@
+"""
+Compares the list-of-tuples polyline/haversine path with the NumPy kernels.
+
+Usage (from backend/):
+    python -m benchmarks.polyline [--vertices 20000] [--repeat 20]
+"""
+import argparse
+import random
+import timeit
+
+from api.utils import (
+    decode_polyline, decode_polyline_arrays, encode_polyline,
+    haversine_distance, haversine_segments
+)
+
+
+def synthetic_polyline(vertices, seed=0):
+    """Builds an encoded polyline resembling a long HGV route."""
+    rng = random.Random(seed)
+    lat, lng = 41.8781, -87.6298
+    path = []
+    for _ in range(vertices):
+        lat += rng.uniform(-0.004, 0.003)
+        lng += rng.uniform(-0.001, 0.006)
+        path.append((lat, lng))
+    return encode_polyline(path)
+
+
+def list_pipeline(encoded):
+    path = decode_polyline(encoded)
+    return [
+        haversine_distance(p1[0], p1[1], p2[0], p2[1])
+        for p1, p2 in zip(path, path[1:])
+    ]
+
+
+def array_pipeline(encoded):
+    lats, lngs = decode_polyline_arrays(encoded)
+    return haversine_segments(lats, lngs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vertices', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    encoded = synthetic_polyline(args.vertices)
+    print(f"Polyline: {args.vertices} vertices, {len(encoded)} characters")
+
+    cases = [
+        ('decode (list)', lambda: decode_polyline(encoded)),
+        ('decode (arrays)', lambda: decode_polyline_arrays(encoded)),
+        ('decode + lengths (list)', lambda: list_pipeline(encoded)),
+        ('decode + lengths (arrays)', lambda: array_pipeline(encoded)),
+    ]
+    results = {}
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:<28} {best * 1000:9.3f} ms")
+
+    for kind in ('decode', 'decode + lengths'):
+        speedup = results[f'{kind} (list)'] / results[f'{kind} (arrays)']
+        print(f"{kind} speedup: {speedup:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures local road-graph queries per second (bidirectional A* vs Dijkstra).
+
+Usage (from backend/):
+    python -m benchmarks.routing [--size 150] [--queries 200]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from api.routing import RoadGraph
+
+
+def synthetic_grid(size, seed=0):
+    """
+    Builds a size x size two-way grid over the central US (~0.05 deg spacing)
+    with jittered nodes, mixed road speeds and a few fast "interstate" rows.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.divmod(np.arange(size * size), size)
+    lats = 35.0 + rows * 0.05 + rng.uniform(-0.01, 0.01, rows.size)
+    lngs = -100.0 + cols * 0.05 + rng.uniform(-0.01, 0.01, cols.size)
+
+    ids = np.arange(size * size).reshape(size, size)
+    sources = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    targets = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+
+    dlat = np.radians(lats[targets] - lats[sources])
+    dlng = np.radians(lngs[targets] - lngs[sources]) * np.cos(np.radians(lats[sources]))
+    miles = 3958.8 * np.hypot(dlat, dlng) * rng.uniform(1.0, 1.3, sources.size)
+    speeds = rng.choice([35.0, 45.0, 55.0], sources.size)
+    speeds[(rows[sources] % 20 == 0) & (rows[targets] % 20 == 0)] = 70.0
+    return RoadGraph.from_edges(lats, lngs, sources, targets, miles, miles / speeds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=150)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    graph = synthetic_grid(args.size)
+    rng = random.Random(0)
+    pairs = [
+        (rng.randrange(graph.node_count), rng.randrange(graph.node_count))
+        for _ in range(args.queries)
+    ]
+    print(f"graph: {graph.node_count} nodes, {graph.edge_count} edges, {args.queries} queries")
+
+    results = {}
+    for name, query in (('dijkstra', graph.dijkstra), ('bidirectional A*', graph.shortest_path)):
+        start = time.perf_counter()
+        results[name] = [query(s, t) for s, t in pairs]
+        elapsed = time.perf_counter() - start
+        print(f"{name:>18}: {args.queries / elapsed:9.1f} queries/s")
+
+    mismatches = sum(
+        abs(a[1] - b[1]) > 1e-9 for a, b in zip(results['dijkstra'], results['bidirectional A*'])
+    )
+    print(f"travel-time mismatches: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
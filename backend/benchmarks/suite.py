@@ -0,0 +1,227 @@
+"""
+Benchmark suite for the trip pipeline, with Nominatim/ORS stubbed from recorded fixtures.
+
+Usage (from backend/):
+    python -m benchmarks.suite [--filter hos] [--output results.json]
+    python -m benchmarks.suite --baseline benchmarks/baseline.json [--threshold 0.3]
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+
+With --baseline, any case slower than baseline * (1 + threshold) fails the run
+(exit status 1). Baselines are machine-specific: record one on the machine
+that runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+HOS_DISTANCES = (150, 700, 2500)   # miles: short, regional, long haul
+HOS_HOURS_USED = (0, 35, 65)       # hours already used in the 8-day cycle
+TRIP_PAYLOAD = {
+    'current_location': 'Chicago, IL',
+    'pickup_location': 'Indianapolis, IN',
+    'dropoff_location': 'Nashville, TN',
+    'hours_used': 20,
+}
+
+
+class FixtureResponse:
+    """Minimal stand-in for a requests.Response built from a recorded body."""
+
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        return None
+
+
+def load_fixture(name):
+    with open(FIXTURES / name) as f:
+        return json.load(f)
+
+
+@contextmanager
+def stubbed_upstream():
+    """
+    Patches the shared HTTP session so Nominatim and ORS answer from fixtures,
+    and lifts the Nominatim rate limit.
+    """
+    searches = load_fixture('nominatim_search.json')
+    directions = load_fixture('ors_directions.json')
+
+    def get(url, params=None, **kwargs):
+        return FixtureResponse(searches.get(params['q'], []))
+
+    def post(url, json=None, **kwargs):
+        return FixtureResponse(directions)
+
+    with mock.patch.multiple('api.services._http', get=get, post=post), \
+            mock.patch('api.services.nominatim_limiter.rate', 0):
+        yield
+
+
+def build_cases():
+    """Returns [(name, callable)] for every benchmark case."""
+    from django.test import Client
+
+    from api import response_cache, services
+    from api.models import GeocodeCacheEntry, RouteCacheEntry
+    from api.utils import (
+        RouteGeometry, calculate_trip_segments, decode_polyline, decode_polyline_arrays,
+        get_coordinate_at_distance
+    )
+
+    polyline = load_fixture('ors_directions.json')['routes'][0]['geometry']
+    path = decode_polyline(polyline)
+    geometry = RouteGeometry(path)
+    targets = [geometry.total_miles * k / 50 for k in range(51)]
+
+    cases = [
+        ('polyline.decode', lambda: decode_polyline(polyline)),
+        ('polyline.decode_arrays', lambda: decode_polyline_arrays(polyline)),
+        ('geometry.coordinate_at_distance', lambda: [get_coordinate_at_distance(path, t) for t in targets]),
+        ('geometry.coordinates_at', lambda: geometry.coordinates_at(targets)),
+    ]
+    for distance in HOS_DISTANCES:
+        for hours_used in HOS_HOURS_USED:
+            cases.append((
+                f'hos.calculate_trip_segments[{distance}mi,{hours_used}h]',
+                lambda d=distance, h=hours_used: calculate_trip_segments(d, h),
+            ))
+
+    client = Client()
+
+    def post_trip():
+        response = client.post('/api/calculate-trip/', TRIP_PAYLOAD, content_type='application/json')
+        assert response.status_code == 200, response.content
+
+    def cold_trip():
+        response_cache.clear()
+        services.clear_geocode_cache()
+        services.clear_route_cache()
+        GeocodeCacheEntry.objects.all().delete()
+        RouteCacheEntry.objects.all().delete()
+        post_trip()
+
+    def warm_pipeline_trip():
+        response_cache.clear()
+        post_trip()
+
+    cases.append(('view.calculate_trip[cold]', cold_trip))
+    cases.append(('view.calculate_trip[warm_caches]', warm_pipeline_trip))
+    cases.append(('view.calculate_trip[warm]', post_trip))
+    return cases
+
+
+def measure(fn, repeat):
+    """Per-call seconds: best and median of `repeat` runs of an auto-ranged loop."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {'min': min(runs), 'median': statistics.median(runs), 'number': number, 'repeat': repeat}
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns [(name, ratio)] for cases slower than baseline by more than threshold.
+    Both the best and the median time must have slowed down, so one noisy
+    repeat can't fail the run on its own.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference:
+            ratio = min(result['min'] / reference['min'], result['median'] / reference['median'])
+            if ratio > 1 + threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def setup_django():
+    """Configures Django against a throwaway test database with external services stubbed."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ.setdefault('ORS_API_KEY', 'benchmark')
+    import django
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    if connection.vendor == 'sqlite':
+        # A file database: geocode threads can't share an in-memory one without lock errors
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = str(
+            Path(tempfile.gettempdir()) / f'trucking_benchmarks_{os.getpid()}.sqlite3'
+        )
+    old_name = connection.creation.create_test_db(verbosity=0)
+    # Geocoding goes through the recorded Nominatim responses, not the local gazetteer
+    overrides = override_settings(GAZETTEER_PATH='', ROUTING_BACKEND='ors', ROUTE_CACHE_PERSIST=False)
+    overrides.enable()
+
+    def teardown():
+        overrides.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return teardown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--filter', default='', help='Only run cases whose name contains this text.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a results JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='Allowed slowdown vs the baseline before failing (0.3 = 30%%).')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Write results as the new baseline.')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        with stubbed_upstream():
+            results = {}
+            for name, fn in build_cases():
+                if args.filter in name:
+                    results[name] = measure(fn, args.repeat)
+                    print(f"{name:<45} {results[name]['min'] * 1e6:12.1f} us")
+    finally:
+        teardown()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x baseline")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.RequestDeadlineMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -88,6 +90,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Cache writes from concurrent geocode threads wait for the write
+            # lock instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -131,3 +139,186 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Outbound calls
+# Threads shared by all requests of a process for concurrent geocoding/routing.
+
+EXTERNAL_IO_WORKERS = int(os.environ.get('EXTERNAL_IO_WORKERS', 16))
+# Connection pool size of the shared async HTTP client used by the ASGI endpoint
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', 100))
+
+
+# Batch trip planning
+# Batches of at least TRIP_BATCH_PROCESS_THRESHOLD trips are planned on a pool of
+# TRIP_BATCH_PROCESSES worker processes (set to 1 to plan in the web worker).
+
+TRIP_BATCH_MAX_SIZE = int(os.environ.get('TRIP_BATCH_MAX_SIZE', 1000))
+TRIP_BATCH_PROCESSES = int(os.environ.get('TRIP_BATCH_PROCESSES', os.cpu_count() or 1))
+TRIP_BATCH_PROCESS_THRESHOLD = int(os.environ.get('TRIP_BATCH_PROCESS_THRESHOLD', 32))
+
+
+# Trip response cache
+# Rendered /api/calculate-trip/ responses, keyed by a hash of the normalized
+# request, are kept while the geocode and route cache entries they were built
+# from stay current. Bounded by total body size (LRU); 0 disables it.
+
+TRIP_RESPONSE_CACHE_BYTES = int(os.environ.get('TRIP_RESPONSE_CACHE_BYTES', 32 * 1024 * 1024))
+
+
+# Trip plans
+# Single-trip plans are stored (TripPlan) with their decoded route geometry, so
+# they can be re-planned from a driver's progress without external calls.
+# TRIP_PLAN_CACHE_SIZE stored plans are kept in memory once loaded.
+
+TRIP_PLAN_PERSIST = os.environ.get('TRIP_PLAN_PERSIST', 'True').lower() in ('true', '1', 'yes')
+TRIP_PLAN_CACHE_SIZE = int(os.environ.get('TRIP_PLAN_CACHE_SIZE', 1000))
+
+
+# Background trip jobs
+# POST /api/trip-jobs/ queues a trip in the TripJob table and returns at once;
+# `manage.py run_trip_worker` runs queued jobs on TRIP_JOB_WORKERS processes.
+# At most TRIP_JOB_MAX_QUEUED jobs wait at once. A job gets TRIP_JOB_DEADLINE
+# seconds of upstream calls; one whose worker stops renewing its lease for
+# TRIP_JOB_LEASE seconds is queued again (up to TRIP_JOB_MAX_ATTEMPTS runs).
+# Finished jobs are deleted after TRIP_JOB_RETENTION seconds.
+
+TRIP_JOB_WORKERS = int(os.environ.get('TRIP_JOB_WORKERS', 2))
+TRIP_JOB_MAX_QUEUED = int(os.environ.get('TRIP_JOB_MAX_QUEUED', 1000))
+TRIP_JOB_DEADLINE = float(os.environ.get('TRIP_JOB_DEADLINE', 120))
+TRIP_JOB_LEASE = float(os.environ.get('TRIP_JOB_LEASE', 300))
+TRIP_JOB_MAX_ATTEMPTS = int(os.environ.get('TRIP_JOB_MAX_ATTEMPTS', 3))
+TRIP_JOB_RETENTION = int(os.environ.get('TRIP_JOB_RETENTION', 24 * 60 * 60))
+TRIP_JOB_POLL_INTERVAL = float(os.environ.get('TRIP_JOB_POLL_INTERVAL', 1.0))
+
+# Multi-stop trips
+# /api/calculate-trip/multi-stop/ takes 2..MULTI_STOP_MAX_STOPS stops. With
+# `optimize`, intermediate stops are reordered using pairwise road distances
+# from the ORS matrix service, of which MATRIX_CACHE_SIZE pairs are cached.
+
+MULTI_STOP_MAX_STOPS = int(os.environ.get('MULTI_STOP_MAX_STOPS', 25))
+MATRIX_CACHE_SIZE = int(os.environ.get('MATRIX_CACHE_SIZE', 20000))
+
+
+# Fleet dispatch
+# /api/dispatch/ ranks a snapshot of up to DISPATCH_MAX_FLEET trucks for a load.
+# Trucks within max_deadhead_miles (straight line, DISPATCH_MAX_DEADHEAD_MILES
+# by default) of the pickup are estimated from straight-line distances; only
+# the best top_k (DISPATCH_TOP_K, at most DISPATCH_MAX_TOP_K) get real deadhead
+# routing. Straight-line miles are scaled by DISPATCH_ROAD_FACTOR when the
+# matrix service is unavailable. The index buckets trucks into
+# DISPATCH_GRID_DEGREES cells.
+
+DISPATCH_MAX_FLEET = int(os.environ.get('DISPATCH_MAX_FLEET', 1000))
+DISPATCH_TOP_K = int(os.environ.get('DISPATCH_TOP_K', 10))
+DISPATCH_MAX_TOP_K = int(os.environ.get('DISPATCH_MAX_TOP_K', 50))
+DISPATCH_MAX_DEADHEAD_MILES = float(os.environ.get('DISPATCH_MAX_DEADHEAD_MILES', 500))
+DISPATCH_ROAD_FACTOR = float(os.environ.get('DISPATCH_ROAD_FACTOR', 1.25))
+DISPATCH_GRID_DEGREES = float(os.environ.get('DISPATCH_GRID_DEGREES', 1.0))
+
+
+# ELD log sheets
+# Stored plans' daily log sheets are rendered to PNG/PDF on a pool of
+# ELD_RENDER_PROCESSES worker processes (0 renders in the web worker) and kept
+# in an LRU bounded by ELD_RENDER_CACHE_BYTES.
+
+ELD_RENDER_PROCESSES = int(os.environ.get('ELD_RENDER_PROCESSES', 2))
+ELD_RENDER_CACHE_BYTES = int(os.environ.get('ELD_RENDER_CACHE_BYTES', 16 * 1024 * 1024))
+
+
+# Local gazetteer
+# Known places and facilities (CSV, or SQLite with a `places` table) answered
+# without Nominatim and used for location autocomplete. Empty disables it.
+
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', str(BASE_DIR / 'api' / 'data' / 'places.csv'))
+
+
+# Geocode cache
+# In-process LRU in front of the shared GeocodeCacheEntry table.
+
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 2048))
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 24 * 3600))           # seconds
+GEOCODE_NEGATIVE_CACHE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_CACHE_TTL', 3600))  # seconds
+
+
+# Route cache
+# ORS results keyed by start/end coordinates snapped to ROUTE_CACHE_PRECISION decimals
+# (3 decimals ~ 110 m). Expired routes are served for ROUTE_CACHE_STALE_TTL more seconds
+# while a background refresh runs.
+
+ROUTE_CACHE_PRECISION = int(os.environ.get('ROUTE_CACHE_PRECISION', 3))
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 1024))
+ROUTE_CACHE_TTL = int(os.environ.get('ROUTE_CACHE_TTL', 7 * 24 * 3600))           # seconds
+ROUTE_CACHE_STALE_TTL = int(os.environ.get('ROUTE_CACHE_STALE_TTL', 30 * 24 * 3600))  # seconds
+ROUTE_CACHE_PERSIST = os.environ.get('ROUTE_CACHE_PERSIST', 'False').lower() in ('true', '1', 'yes')
+
+
+# Upstream services
+# Point these at loadtest/fake_upstream.py to load-test without the real services.
+
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+ORS_DIRECTIONS_URL = os.environ.get(
+    'ORS_DIRECTIONS_URL', 'https://api.openrouteservice.org/v2/directions/driving-hgv'
+)
+ORS_MATRIX_URL = os.environ.get('ORS_MATRIX_URL', 'https://api.openrouteservice.org/v2/matrix/driving-hgv')
+
+
+# Nominatim rate limiting
+# The public Nominatim usage policy allows at most 1 request per second. Calls
+# over the rate queue for a slot (at most NOMINATIM_QUEUE_SIZE at once, each for
+# at most NOMINATIM_MAX_WAIT seconds). Set NOMINATIM_RATE_LIMIT_FILE to a path
+# on local disk to share one budget between all workers on the host;
+# NOMINATIM_RATE_LIMIT=0 disables the limiter (e.g. for a self-hosted server).
+
+NOMINATIM_RATE_LIMIT = float(os.environ.get('NOMINATIM_RATE_LIMIT', 1.0))  # requests per second
+NOMINATIM_BURST = int(os.environ.get('NOMINATIM_BURST', 1))
+NOMINATIM_QUEUE_SIZE = int(os.environ.get('NOMINATIM_QUEUE_SIZE', 50))
+NOMINATIM_MAX_WAIT = float(os.environ.get('NOMINATIM_MAX_WAIT', 10))  # seconds
+NOMINATIM_RATE_LIMIT_FILE = os.environ.get('NOMINATIM_RATE_LIMIT_FILE', '')
+
+
+# Upstream resilience
+# Requests give up on upstream calls once REQUEST_DEADLINE seconds have passed
+# (0 disables). ORS calls fail fast for ORS_BREAKER_RECOVERY seconds after
+# ORS_BREAKER_FAILURES consecutive failures; retries are capped at
+# ORS_RETRY_BUDGET_RATIO retries per call. With ORS_HEDGE, a second request
+# is sent when the first is slower than the recent p95.
+
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 25))  # seconds; below gunicorn's 30s timeout
+ORS_BREAKER_FAILURES = int(os.environ.get('ORS_BREAKER_FAILURES', 5))
+ORS_BREAKER_RECOVERY = float(os.environ.get('ORS_BREAKER_RECOVERY', 30))  # seconds
+ORS_RETRY_BUDGET_RATIO = float(os.environ.get('ORS_RETRY_BUDGET_RATIO', 0.2))
+ORS_HEDGE = os.environ.get('ORS_HEDGE', 'False').lower() in ('true', '1', 'yes')
+ORS_HEDGE_MIN_DELAY = float(os.environ.get('ORS_HEDGE_MIN_DELAY', 0.5))  # seconds
+
+
+# Routing backend
+# 'ors' routes uncached legs through OpenRouteService. 'graph' routes them over
+# the local road graph built by `manage.py build_road_graph`, falling back to
+# ORS (if ROUTING_ORS_FALLBACK) when a waypoint is more than
+# ROAD_GRAPH_MAX_SNAP_MILES from the network or no path exists.
+
+ROUTING_BACKEND = os.environ.get('ROUTING_BACKEND', 'ors')
+ROAD_GRAPH_PATH = os.environ.get('ROAD_GRAPH_PATH', str(BASE_DIR / 'road_graph.npz'))
+ROAD_GRAPH_MAX_SNAP_MILES = float(os.environ.get('ROAD_GRAPH_MAX_SNAP_MILES', 10.0))
+ROUTING_ORS_FALLBACK = os.environ.get('ROUTING_ORS_FALLBACK', 'True').lower() in ('true', '1', 'yes')
+
+
+# Geometry simplification
+# With a `zoom` parameter, returned polylines are simplified to
+# SIMPLIFY_PIXEL_TOLERANCE screen pixels at that zoom level.
+
+SIMPLIFY_PIXEL_TOLERANCE = float(os.environ.get('SIMPLIFY_PIXEL_TOLERANCE', 1.0))
+SIMPLIFY_CACHE_SIZE = int(os.environ.get('SIMPLIFY_CACHE_SIZE', 512))
+
+
+# Django REST Framework
+# MessagePack is served when the client sends Accept: application/msgpack.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.MessagePackRenderer',
+    ],
+}
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+
+from api import metrics
 
 
 def api_root(request):
@@ -9,12 +11,28 @@ def api_root(request):
         'service': 'Trucking Logistics API',
         'endpoints': {
             'calculate_trip': '/api/calculate-trip/',
+            'calculate_trip_batch': '/api/calculate-trip/batch/',
+            'calculate_trip_multi_stop': '/api/calculate-trip/multi-stop/',
+            'calculate_trip_async': '/api/calculate-trip-async/',
+            'calculate_trip_stream': '/api/calculate-trip/stream/',
+            'dispatch': '/api/dispatch/',
+            'trip_jobs': '/api/trip-jobs/',
+            'trip_plan_replan': '/api/trip-plans/<id>/replan/',
+            'trip_plan_logs': '/api/trip-plans/<id>/logs/',
+            'location_autocomplete': '/api/locations/autocomplete/?q=',
+            'metrics': '/metrics',
         }
     })
 
 
+def metrics_view(request):
+    """Prometheus scrape endpoint."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 urlpatterns = [
     path('', api_root, name='api-root'),
+    path('metrics', metrics_view, name='metrics'),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]
@@ -0,0 +1,195 @@
+"""
+Stand-in for Nominatim search and ORS directions/matrix, for load tests.
+
+Usage (from backend/):
+    python -m loadtest.fake_upstream [--port 8081] [--geocode-latency lognormal:150,0.4]
+        [--route-latency lognormal:600,0.5] [--error-rate 0.02] [--timeout-rate 0.005]
+        [--vertices 2000]
+
+Then start the app with
+    NOMINATIM_URL=http://127.0.0.1:8081/search
+    ORS_DIRECTIONS_URL=http://127.0.0.1:8081/v2/directions/driving-hgv
+    ORS_MATRIX_URL=http://127.0.0.1:8081/v2/matrix/driving-hgv
+    ORS_API_KEY=fake GAZETTEER_PATH= NOMINATIM_RATE_LIMIT=0
+Latencies are `fixed:MS`, `uniform:MIN_MS,MAX_MS` or `lognormal:MEDIAN_MS,SIGMA`.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from api.utils import encode_polyline, haversine_distance
+
+ERROR_STATUSES = (502, 503, 504)
+ROAD_FACTOR = 1.25   # Road miles per straight-line mile
+TRUCK_SPEED = 55.0   # mph
+
+
+def parse_latency(spec):
+    """Returns a callable giving a latency in seconds for a `kind:args` spec (args in ms)."""
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(',')]
+    except ValueError:
+        values = []
+    if kind == 'fixed' and len(values) == 1:
+        seconds = values[0] / 1000
+        return lambda: seconds
+    if kind == 'uniform' and len(values) == 2:
+        low, high = values[0] / 1000, values[1] / 1000
+        return lambda: random.uniform(low, high)
+    if kind == 'lognormal' and len(values) == 2:
+        median, sigma = values[0] / 1000, values[1]
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise argparse.ArgumentTypeError(f'Invalid latency spec: {spec!r}')
+
+
+def geocode(query):
+    """Deterministic point in the continental US for a query string."""
+    digest = hashlib.sha1(query.strip().lower().encode()).digest()
+    lat = 30.0 + int.from_bytes(digest[:4], 'big') / 2 ** 32 * 17.0
+    lng = -120.0 + int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 45.0
+    return round(lat, 6), round(lng, 6)
+
+
+def directions(coordinates, vertices, rng):
+    """ORS-shaped directions body with a synthetic wiggly path of `vertices` points per leg."""
+    waypoints = [(lat, lng) for lng, lat in coordinates]
+    path, way_points, segments = [], [0], []
+    for (a_lat, a_lng), (b_lat, b_lng) in zip(waypoints, waypoints[1:]):
+        leg = []
+        for i in range(vertices + 1):
+            t = i / vertices
+            wobble = (0.01 * math.sin(t * 40) + rng.uniform(-0.002, 0.002)) if 0 < i < vertices else 0.0
+            leg.append((a_lat + (b_lat - a_lat) * t + wobble, a_lng + (b_lng - a_lng) * t - wobble))
+        path.extend(leg[1:] if path else leg)
+        way_points.append(len(path) - 1)
+
+        miles = haversine_distance(a_lat, a_lng, b_lat, b_lng) * ROAD_FACTOR
+        segments.append({'distance': miles / 0.000621371, 'duration': miles / TRUCK_SPEED * 3600})
+
+    return {'routes': [{
+        'summary': {
+            'distance': sum(s['distance'] for s in segments),
+            'duration': sum(s['duration'] for s in segments),
+        },
+        'segments': segments,
+        'way_points': way_points,
+        'geometry': encode_polyline(path),
+    }]}
+
+
+def matrix(body):
+    """ORS-shaped matrix body (miles, seconds) with the same road distances as directions()."""
+    points = [(lat, lng) for lng, lat in body['locations']]
+    sources = body.get('sources') or range(len(points))
+    destinations = body.get('destinations') or range(len(points))
+    distances = [
+        [haversine_distance(*points[i], *points[j]) * ROAD_FACTOR for j in destinations] for i in sources
+    ]
+    return {
+        'distances': distances,
+        'durations': [[miles / TRUCK_SPEED * 3600 for miles in row] for row in distances],
+    }
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real services
+    config = None                  # argparse.Namespace set by make_server()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('/search'):
+            return self._send(404, {'error': 'not found'})
+        if self._misbehave(self.config.geocode_latency):
+            return
+        query = parse_qs(url.query).get('q', [''])[0]
+        lat, lng = geocode(query)
+        self._send(200, [{'lat': str(lat), 'lon': str(lng), 'display_name': query}])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = urlparse(self.path).path
+        if not path.startswith(('/v2/directions', '/v2/matrix')):
+            return self._send(404, {'error': 'not found'})
+        if self._misbehave(self.config.route_latency):
+            return
+        if path.startswith('/v2/matrix'):
+            try:
+                return self._send(200, matrix(json.loads(body)))
+            except (ValueError, KeyError, IndexError):
+                return self._send(400, {'error': 'invalid body'})
+        try:
+            coordinates = json.loads(body)['coordinates']
+        except (ValueError, KeyError):
+            return self._send(400, {'error': 'invalid body'})
+        self._send(200, directions(coordinates, self.config.vertices, random.Random(body)))
+
+    def _misbehave(self, latency):
+        """Sleeps for the configured latency; returns True if an error/timeout was sent instead."""
+        time.sleep(latency())
+        roll = random.random()
+        if roll < self.config.timeout_rate:
+            time.sleep(self.config.timeout_delay)
+            self.close_connection = True
+            return True
+        if roll < self.config.timeout_rate + self.config.error_rate:
+            self._send(random.choice(ERROR_STATUSES), {'error': 'injected failure'})
+            return True
+        return False
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--geocode-latency', type=parse_latency, default='lognormal:150,0.4')
+    parser.add_argument('--route-latency', type=parse_latency, default='lognormal:600,0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction answered with 502/503/504.')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction that hang, then drop.')
+    parser.add_argument('--timeout-delay', type=float, default=35.0, help='Seconds a hanging request hangs.')
+    parser.add_argument('--vertices', type=int, default=2000, help='Polyline vertices per route leg.')
+    parser.add_argument('--verbose', action='store_true')
+    return parser
+
+
+def make_server(config):
+    handler = type('Handler', (FakeUpstreamHandler,), {'config': config})
+    server = ThreadingHTTPServer((config.host, config.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    config = build_parser().parse_args()
+    server = make_server(config)
+    host, port = server.server_address[:2]
+    print(f"Fake Nominatim: http://{host}:{port}/search")
+    print(f"Fake ORS:       http://{host}:{port}/v2/directions/driving-hgv")
+    print(f"Fake ORS:       http://{host}:{port}/v2/matrix/driving-hgv")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
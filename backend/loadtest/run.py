@@ -0,0 +1,115 @@
+"""
+Load generator for the trip endpoint: throughput and latency percentiles under concurrency.
+
+Usage (from backend/):
+    python -m loadtest.run [--url http://127.0.0.1:8000/api/calculate-trip/]
+        [--concurrency 16] [--requests 500 | --duration 60] [--locations 50]
+
+--locations sets how many distinct place names the trips are drawn from:
+a small pool exercises the caches, a large one the upstream services.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0-100) of an ascending list."""
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * q // 100))  # ceil(n * q / 100)
+    return sorted_values[int(rank) - 1]
+
+
+def trip_payload(rng, locations):
+    current, pickup, dropoff = rng.sample(range(locations), 3)
+    return {
+        'current_location': f'Loadtest Place {current}',
+        'pickup_location': f'Loadtest Place {pickup}',
+        'dropoff_location': f'Loadtest Place {dropoff}',
+        'hours_used': round(rng.uniform(0, 60), 1),
+    }
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = args.requests
+
+    async def worker(client):
+        nonlocal remaining
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif remaining <= 0:
+                return
+            else:
+                remaining -= 1
+
+            start = time.perf_counter()
+            try:
+                response = await client.post(args.url, json=trip_payload(rng, args.locations))
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'statuses': {str(key): value for key, value in sorted(statuses.items(), key=str)},
+        'latency_ms': {
+            name: round(value * 1000, 1) for name, value in (
+                ('p50', percentile(latencies, 50)),
+                ('p95', percentile(latencies, 95)),
+                ('p99', percentile(latencies, 99)),
+                ('max', latencies[-1] if latencies else float('nan')),
+            )
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api/calculate-trip/')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--duration', type=float, help='Run for this many seconds instead of --requests.')
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args()
+    if args.locations < 3:
+        parser.error('--locations must be at least 3')
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    latency = report['latency_ms']
+    print(f"{report['requests']} requests in {report['elapsed_s']}s "
+          f"at concurrency {report['concurrency']}: {report['throughput_rps']} req/s")
+    print(f"latency ms  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"statuses    {report['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import React, { useState } from 'react';
-import axios from 'axios';
 import InputForm from './components/InputForm';
 import RouteMap from './components/RouteMap';
 import ELDLog from './components/ELDLog';
@@ -9,8 +8,28 @@ import './index.css';
 // Resolve the API base URL: prefer the env variable, fall back to Railway production URL
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'https://trucking-logistics-app-production.up.railway.app/';
 
+// Reads a newline-delimited JSON event stream, calling onEvent for each event as it arrives
+const readEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.filter(Boolean).forEach(line => onEvent(JSON.parse(line)));
+  }
+};
+
 function App() {
   const [tripData, setTripData] = useState(null);
+  // Route legs and timeline streamed in before the full plan arrives
+  const [partialRoute, setPartialRoute] = useState(null);
+  const [partialSegments, setPartialSegments] = useState(null);
+  // Daily ELD sheets, fetched from the stored plan's logs endpoint
+  const [logSheets, setLogSheets] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
 
@@ -18,10 +37,38 @@ function App() {
     setIsLoading(true);
     setError(null);
     setTripData(null);
+    setPartialRoute(null);
+    setPartialSegments(null);
+    setLogSheets(null);
 
     try {
-      const response = await axios.post(`${API_BASE_URL}api/calculate-trip/`, formData);
-      setTripData(response.data);
+      const response = await fetch(`${API_BASE_URL}api/calculate-trip/stream/`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(formData)
+      });
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.error || `Request failed with status ${response.status}`);
+      }
+      await readEvents(response, ({ event, data }) => {
+        if (event === 'route') {
+          setPartialRoute(prev => ({ ...prev, [`polyline_leg${data.index + 1}`]: data.polyline }));
+        } else if (event === 'segments') {
+          setPartialSegments(data.trip_segments);
+        } else if (event === 'plan') {
+          setTripData(data);
+          if (data.trip_plan_id) {
+            // Without sheets the log falls back to drawing the segments itself
+            fetch(`${API_BASE_URL}api/trip-plans/${data.trip_plan_id}/logs/`)
+              .then(res => (res.ok ? res.json() : null))
+              .then(body => body && setLogSheets(body.log_sheets))
+              .catch(() => {});
+          }
+        } else if (event === 'error') {
+          throw new Error(data.error);
+        }
+      });
     } catch (err) {
       console.error(err);
       const errorMessage = err.response?.data?.error || err.message || 'An unexpected error occurred';
@@ -40,7 +87,7 @@ function App() {
 
       <div style={{ display: 'grid', gridTemplateColumns: '350px 1fr', gap: '2rem', textAlign: 'left' }}>
         <aside>
-          <InputForm onSubmit={handleTripCalculation} isLoading={isLoading} />
+          <InputForm onSubmit={handleTripCalculation} isLoading={isLoading} apiBaseUrl={API_BASE_URL} />
 
           {error && (
             <div className="error-message">
@@ -60,13 +107,19 @@ function App() {
         </aside>
 
         <main>
-          {tripData ? (
+          {tripData || partialRoute ? (
             <>
               <RouteMap
-                routeData={tripData.route}
-                tripSegments={tripData.trip_segments}
+                routeData={tripData ? tripData.route : partialRoute}
+                tripSegments={(tripData ? tripData.trip_segments : partialSegments) || []}
               />
-              <ELDLog segments={tripData.eld_logs} />
+              {tripData && (
+                <ELDLog
+                  segments={tripData.eld_logs}
+                  sheets={logSheets}
+                  pdfUrl={tripData.trip_plan_id && `${API_BASE_URL}api/trip-plans/${tripData.trip_plan_id}/logs/`}
+                />
+              )}
             </>
           ) : (
             <div className="card" style={{ height: '400px', display: 'flex', alignItems: 'center', justifyContent: 'center', color: '#888' }}>
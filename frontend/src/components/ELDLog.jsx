@@ -1,6 +1,8 @@
 import React, { useEffect, useRef, useState } from 'react';
 
-const DayLog = ({ segments, dayIndex }) => {
+const STATUS_KEYS = ['off_duty', 'sleeper', 'driving', 'on_duty']; // Index = server status code
+
+const DayLog = ({ segments, dayIndex, sheet, pdfUrl }) => {
     const canvasRef = useRef(null);
     const [hoveredInfo, setHoveredInfo] = useState(null);
 
@@ -37,7 +39,7 @@ const DayLog = ({ segments, dayIndex }) => {
             return;
         }
 
-        const absTime = (dayIndex * 24) + hour;
+        const absTime = (sheet ? sheet.start_hour : dayIndex * 24) + hour;
 
         // Find Segment
         // Segments are sorted by start_time usually.
@@ -121,6 +123,21 @@ const DayLog = ({ segments, dayIndex }) => {
             }
         }
 
+        if (sheet) {
+            // Server-built sheet: one bar per run of equal 15-minute slots
+            const slotHours = 24 / sheet.grid.length;
+            let start = 0;
+            for (let slot = 1; slot <= sheet.grid.length; slot++) {
+                if (slot < sheet.grid.length && sheet.grid[slot] === sheet.grid[start]) continue;
+                const row = sheet.grid[start];
+                ctx.fillStyle = colors[STATUS_KEYS[row]];
+                ctx.fillRect(labelWidth + start * slotHours * pixelsPerHour, gridTop + (row * rowH) + 5,
+                    (slot - start) * slotHours * pixelsPerHour, rowH - 10);
+                start = slot;
+            }
+            return;
+        }
+
         // Filter segments for this specific day (dayIndex)
         // A day is from hour dayIndex*24 to (dayIndex+1)*24
         const dayStart = dayIndex * 24;
@@ -156,11 +173,19 @@ const DayLog = ({ segments, dayIndex }) => {
             ctx.fillStyle = colors[status] || '#999';
             ctx.fillRect(x, y, w, h);
         });
-    }, [segments, dayIndex]);
+    }, [segments, dayIndex, sheet]);
 
     return (
         <div className="day-log-wrapper" style={{ marginBottom: '2rem', position: 'relative' }}>
-            <h3>Day {dayIndex + 1}</h3>
+            <h3>Day {sheet ? sheet.day : dayIndex + 1}</h3>
+            {sheet && (
+                <p style={{ margin: '0 0 0.5rem', color: '#555', fontSize: '0.9rem' }}>
+                    Off Duty {sheet.totals.off_duty.toFixed(2)}h · Sleeper {sheet.totals.sleeper.toFixed(2)}h ·
+                    Driving {sheet.totals.driving.toFixed(2)}h · On Duty {sheet.totals.on_duty.toFixed(2)}h ·
+                    {' '}{sheet.miles_driven.toFixed(0)} mi
+                    {pdfUrl && <> · <a href={`${pdfUrl}${sheet.day}.pdf`} target="_blank" rel="noreferrer">PDF</a></>}
+                </p>
+            )}
             <canvas
                 ref={canvasRef}
                 width={800}
@@ -191,9 +216,21 @@ const DayLog = ({ segments, dayIndex }) => {
     );
 };
 
-const ELDLog = ({ segments }) => {
+const ELDLog = ({ segments, sheets, pdfUrl }) => {
     if (!segments || segments.length === 0) return null;
 
+    // Prefer the daily sheets built by the backend (GET .../logs/)
+    if (sheets && sheets.length > 0) {
+        return (
+            <div className="eld-log-container card">
+                <h2>ELD Logs</h2>
+                {sheets.map((sheet, i) => (
+                    <DayLog key={sheet.day} segments={segments} dayIndex={i} sheet={sheet} pdfUrl={pdfUrl} />
+                ))}
+            </div>
+        );
+    }
+
     // Determine number of days
     const totalDuration = segments[segments.length - 1].start_time + segments[segments.length - 1].duration;
     const numDays = Math.ceil(totalDuration / 24) || 1;
@@ -1,6 +1,9 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
+import axios from 'axios';
 
-const InputForm = ({ onSubmit, isLoading }) => {
+const LOCATION_FIELDS = ['current_location', 'pickup_location', 'dropoff_location'];
+
+const InputForm = ({ onSubmit, isLoading, apiBaseUrl }) => {
     const [formData, setFormData] = useState({
         current_location: '',
         pickup_location: '',
@@ -8,13 +11,43 @@ const InputForm = ({ onSubmit, isLoading }) => {
         hours_used: ''
     });
 
+    const [suggestions, setSuggestions] = useState({});
+    const debounceRef = useRef(null);
+
+    // Type-ahead from the backend gazetteer (never hits the external geocoder)
+    const fetchSuggestions = (field, query) => {
+        clearTimeout(debounceRef.current);
+        if (query.trim().length < 2) return;
+        debounceRef.current = setTimeout(async () => {
+            try {
+                const response = await axios.get(`${apiBaseUrl}api/locations/autocomplete/`, {
+                    params: { q: query }
+                });
+                setSuggestions((prev) => ({ ...prev, [field]: response.data.results }));
+            } catch (err) {
+                // Suggestions are optional; the field still accepts free text
+            }
+        }, 150);
+    };
+
     const handleChange = (e) => {
         setFormData({
             ...formData,
             [e.target.name]: e.target.value
         });
+        if (LOCATION_FIELDS.includes(e.target.name)) {
+            fetchSuggestions(e.target.name, e.target.value);
+        }
     };
 
+    const renderSuggestions = (field) => (
+        <datalist id={`${field}_suggestions`}>
+            {(suggestions[field] || []).map((place) => (
+                <option key={place.name} value={place.name} />
+            ))}
+        </datalist>
+    );
+
     const handleSubmit = (e) => {
         e.preventDefault();
         onSubmit(formData);
@@ -30,11 +63,14 @@ const InputForm = ({ onSubmit, isLoading }) => {
                         type="text"
                         id="current_location"
                         name="current_location"
+                        list="current_location_suggestions"
+                        autoComplete="off"
                         placeholder="e.g. Chicago, IL"
                         value={formData.current_location}
                         onChange={handleChange}
                         required
                     />
+                    {renderSuggestions('current_location')}
                 </div>
 
                 <div>
@@ -43,11 +79,14 @@ const InputForm = ({ onSubmit, isLoading }) => {
                         type="text"
                         id="pickup_location"
                         name="pickup_location"
+                        list="pickup_location_suggestions"
+                        autoComplete="off"
                         placeholder="e.g. Indianapolis, IN"
                         value={formData.pickup_location}
                         onChange={handleChange}
                         required
                     />
+                    {renderSuggestions('pickup_location')}
                 </div>
 
                 <div>
@@ -56,11 +95,14 @@ const InputForm = ({ onSubmit, isLoading }) => {
                         type="text"
                         id="dropoff_location"
                         name="dropoff_location"
+                        list="dropoff_location_suggestions"
+                        autoComplete="off"
                         placeholder="e.g. Nashville, TN"
                         value={formData.dropoff_location}
                         onChange={handleChange}
                         required
                     />
+                    {renderSuggestions('dropoff_location')}
                 </div>
 
                 <div>
@@ -32,7 +32,13 @@ const Recenter = ({ lat, lng }) => {
 };
 
 const RouteMap = ({ routeData, tripSegments }) => {
-    if (!routeData || !routeData.polyline_leg1) return null;
+    // polyline_leg1, polyline_leg2, ... (more legs for multi-stop trips); while streaming, any leg may arrive first
+    const legKeys = routeData
+        ? Object.keys(routeData)
+            .filter(key => key.startsWith('polyline_leg') && routeData[key])
+            .sort((a, b) => Number(a.slice(12)) - Number(b.slice(12)))
+        : [];
+    if (legKeys.length === 0) return null;
 
     // Decode Polyline (Using a library usually, but here we might get geojson from backend if we used 'geometry' differently)
     // The backend uses ORS which returns encoded polyline or geojson?
@@ -97,12 +103,7 @@ const RouteMap = ({ routeData, tripSegments }) => {
         return coordinates;
     };
 
-    const positions = decodePolyline(routeData.polyline_leg1); // + leg2?
-    // Using just leg1 for now or merge them?
-    // The RouteData has leg1 and leg2? 
-    // Backend views: `polyline_leg1`, `polyline_leg2`.
-    const positions2 = routeData.polyline_leg2 ? decodePolyline(routeData.polyline_leg2) : [];
-    const allPositions = [...positions, ...positions2];
+    const allPositions = legKeys.flatMap(key => decodePolyline(routeData[key]));
 
     if (allPositions.length === 0) return <div>No route data</div>;
 